@@ -0,0 +1,216 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+from files import write_json
+
+# Which subscription ('flatrate') providers each movie is on, in every region, so provider filters and the Where to Watch
+# column can be answered without calling TMDb. TMDb's watch providers call returns every region for a movie at once,
+# so each movie only needs one call, however many regions are looked at.
+#
+# Each movie gets a number (its position in ids), and each provider in each region a bitset of the movies on it, stored
+# as a Python int - so "is this movie on Netflix in GB" is a single bit test, and "which movies are on Netflix or MUBI
+# in GB" is an OR of two ints.
+#
+# If path is given, the matrix is saved there every save_every new movies (and by save()), and loaded back when it's
+# created, so a restarted app starts with every movie it had already looked up. Movies looked up longer ago than
+# max_age (in seconds) count as unknown, so they're fetched again on their next use. Other processes (other app
+# processes, export.py's workers) can save to the same path, so before saving, whatever they've saved since is merged in
+# (keeping the most recently checked copy of each movie) rather than written over.
+class AvailabilityMatrix:
+    def __init__(self, path=None, max_age=24 * 3600, save_every=200):
+        self.path = Path(path) if path else None
+        self.max_age = max_age
+        self.save_every = save_every
+        self.ids = [] # movie number -> tmdb id
+        self.numbers = {} # tmdb id -> movie number
+        self.fetched_at = [] # movie number -> when its providers were fetched
+        self.checked_at = [] # movie number -> when they were last known to be current (fetched, or renewed)
+        self.bits = {} # region -> provider id -> bitset of movie numbers
+        self.priorities = {} # region -> provider id -> TMDb's display priority (lower is shown first)
+        self.provider_names = {} # provider id -> name
+        self.unsaved = 0
+        self.saved_mtime = None # when the file was last changed, as of its last load or save
+        self.lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    # whether a movie's providers have been fetched, and checked not longer ago than max_age
+    def known(self, tmdb_id):
+        number = self.numbers.get(tmdb_id)
+        return number is not None and time.time() - self.checked_at[number] < self.max_age
+
+    # when a movie's providers are due to be fetched again, or None if they've never been fetched
+    def expires_at(self, tmdb_id):
+        number = self.numbers.get(tmdb_id)
+        return None if number is None else self.checked_at[number] + self.max_age
+
+    # Marks the providers of every movie checked since `since` as current at `now`, except for the ids in changed - i.e.
+    # the movies TMDb says haven't changed since then (see delta_sync.py). Returns their ids. TMDb's changes don't
+    # include provider changes (which come from JustWatch), so providers fetched longer than max_renew_age ago aren't
+    # renewed, and are fetched again once they expire.
+    def renew(self, since, now, changed, max_renew_age):
+        with self.lock:
+            renewed = [tmdb_id for tmdb_id, fetched_at, checked_at in zip(self.ids, self.fetched_at, self.checked_at)
+                       if checked_at >= since and now - fetched_at < max_renew_age and tmdb_id not in changed]
+            for tmdb_id in renewed:
+                self.checked_at[self.numbers[tmdb_id]] = now
+        self.save()
+        return renewed
+
+    # whether every one of the movies' providers have been fetched (however long ago)
+    def covers(self, tmdb_ids):
+        return len(tmdb_ids) <= len(self.numbers) and all(tmdb_id in self.numbers for tmdb_id in tmdb_ids)
+
+    # adds (or replaces) a movie's providers from TMDb's watch providers results, a dict of region code -> providers
+    def add(self, tmdb_id, results, fetched_at=None):
+        with self.lock:
+            number = self.numbers.get(tmdb_id)
+            if number is None:
+                number = len(self.ids)
+                self.numbers[tmdb_id] = number
+                self.ids.append(tmdb_id)
+                self.fetched_at.append(0)
+                self.checked_at.append(0)
+            else:
+                for region_bits in self.bits.values():
+                    for provider_id, bits in region_bits.items():
+                        region_bits[provider_id] = bits & ~(1 << number) # clears the movie's old providers
+
+            for region, providers in (results or {}).items():
+                region_bits = self.bits.setdefault(region, {})
+                region_priorities = self.priorities.setdefault(region, {})
+                for provider in getattr(providers, "flatrate", None) or []:
+                    region_bits[provider.provider_id] = region_bits.get(provider.provider_id, 0) | 1 << number
+                    self.provider_names[provider.provider_id] = provider.provider_name
+                    if provider.display_priority is not None:
+                        region_priorities[provider.provider_id] = min(provider.display_priority,
+                                                                      region_priorities.get(provider.provider_id, provider.display_priority))
+            self.fetched_at[number] = self.checked_at[number] = fetched_at or time.time()
+            self.unsaved += 1
+            save = self.unsaved >= self.save_every
+        if save:
+            self.save()
+
+    # names of the providers a movie is on in a region, in TMDb's display order
+    def where_to_watch(self, tmdb_id, region):
+        number = self.numbers.get(tmdb_id)
+        if number is None:
+            return []
+        with self.lock:
+            priorities = self.priorities.get(region, {})
+            provider_ids = [provider_id for provider_id, bits in self.bits.get(region, {}).items() if bits >> number & 1]
+            provider_ids.sort(key=lambda provider_id: priorities.get(provider_id, float("inf")))
+            return [self.provider_names[provider_id] for provider_id in provider_ids]
+
+    # tmdb ids of the movies on any of the providers in a region
+    def titles(self, region, provider_ids):
+        with self.lock:
+            region_bits = self.bits.get(region, {})
+            bits = 0
+            for provider_id in provider_ids:
+                bits |= region_bits.get(int(provider_id), 0)
+            ids = self.ids[:bits.bit_length()]
+        return {ids[number] for number in set_bits(bits)}
+
+    def load(self):
+        saved = self.read()
+        if saved is None:
+            return
+        self.ids, self.fetched_at, self.checked_at, self.bits, self.priorities, self.provider_names = saved
+        self.numbers = {tmdb_id: number for number, tmdb_id in enumerate(self.ids)}
+
+    # reads the saved matrix as (ids, fetched_at, checked_at, bits, priorities, provider_names), or None if there isn't
+    # one or it hasn't changed since it was last loaded or saved
+    def read(self):
+        if self.path is None:
+            return None
+        try:
+            mtime = self.path.stat().st_mtime_ns
+            if mtime == self.saved_mtime:
+                return None
+            with open(self.path) as f:
+                saved = json.load(f)
+            bits, priorities = {}, {}
+            for region, providers in saved["providers"].items():
+                bits[region] = {int(provider_id): int(hex_bits, 16) for provider_id, (hex_bits, _) in providers.items()}
+                priorities[region] = {int(provider_id): priority for provider_id, (_, priority) in providers.items()
+                                      if priority is not None}
+            provider_names = {int(provider_id): name for provider_id, name in saved["provider_names"].items()}
+            ids, fetched_at = saved["ids"], saved["fetched_at"]
+            checked_at = saved.get("checked_at", fetched_at)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None # ignores a missing or corrupt file, and fetches everything again
+        self.saved_mtime = mtime
+        return ids, fetched_at, checked_at, bits, priorities, provider_names
+
+    # Merges in the movies from a saved matrix that this one doesn't have, or checked longer ago. Must be called with
+    # the lock held. Their numbers in the saved matrix are different, so their bits are moved across one at a time, but
+    # only from the bitsets that have any of them.
+    def merge(self, saved):
+        ids, fetched_at, checked_at, bits, priorities, provider_names = saved
+        moved = {} # saved number -> number here
+        cleared = 0 # bits of the movies here whose providers are replaced
+        for saved_number, tmdb_id in enumerate(ids):
+            number = self.numbers.get(tmdb_id)
+            if number is not None and self.checked_at[number] >= checked_at[saved_number]:
+                continue
+            if number is None:
+                number = len(self.ids)
+                self.numbers[tmdb_id] = number
+                self.ids.append(tmdb_id)
+                self.fetched_at.append(0)
+                self.checked_at.append(0)
+            else:
+                cleared |= 1 << number
+            self.fetched_at[number] = fetched_at[saved_number]
+            self.checked_at[number] = checked_at[saved_number]
+            moved[saved_number] = number
+        if not moved:
+            return
+
+        if cleared:
+            for region_bits in self.bits.values():
+                for provider_id, provider_bits in region_bits.items():
+                    region_bits[provider_id] = provider_bits & ~cleared
+        moved_mask = 0
+        for saved_number in moved:
+            moved_mask |= 1 << saved_number
+        for region, saved_region_bits in bits.items():
+            region_bits = self.bits.setdefault(region, {})
+            for provider_id, saved_bits in saved_region_bits.items():
+                if saved_bits & moved_mask:
+                    provider_bits = region_bits.get(provider_id, 0)
+                    for saved_number in set_bits(saved_bits & moved_mask):
+                        provider_bits |= 1 << moved[saved_number]
+                    region_bits[provider_id] = provider_bits
+        for region, saved_priorities in priorities.items():
+            region_priorities = self.priorities.setdefault(region, {})
+            for provider_id, priority in saved_priorities.items():
+                region_priorities[provider_id] = min(priority, region_priorities.get(provider_id, priority))
+        for provider_id, name in provider_names.items():
+            self.provider_names.setdefault(provider_id, name)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            saved = self.read()
+            if saved is not None:
+                self.merge(saved)
+            saved = {"ids": list(self.ids), "fetched_at": list(self.fetched_at), "checked_at": list(self.checked_at),
+                     "provider_names": dict(self.provider_names),
+                     "providers": {region: {provider_id: [format(bits, "x"), self.priorities.get(region, {}).get(provider_id)]
+                                            for provider_id, bits in region_bits.items()}
+                                   for region, region_bits in self.bits.items()}}
+            self.unsaved = 0
+            write_json(self.path, saved)
+            self.saved_mtime = self.path.stat().st_mtime_ns
+
+
+# positions of the 1 bits in an int, lowest first
+def set_bits(bits):
+    return [number for number, bit in enumerate(reversed(bin(bits)[2:])) if bit == "1"]
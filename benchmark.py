@@ -0,0 +1,200 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from urllib.request import urlopen
+
+# Benchmarks the app's data functions offline, against the stand-in TMDb server in fake_tmdb.py, so performance
+# changes can be measured without network access or an API key and compared between commits.
+#
+# Every scenario runs in fresh processes with its own cache directory, in three phases:
+#   cold    - the first call, in a new process with empty caches
+#   warm    - the same call again in that process, so in-memory caches are warm too
+#   restart - the first call in another new process reusing the cold run's cache directory, i.e. the persistent
+#             response cache and metadata snapshot are warm but in-memory caches aren't
+# Each phase reports wall time (the median over --repeat runs), the number of requests the server received (and how
+# many it answered with 429), and peak memory. Memory is traced with tracemalloc in a separate run, so it doesn't
+# slow down the timed ones.
+#
+# Usage:
+#   python benchmark.py
+#   python benchmark.py --latency 0.1 --rate-limit 40 --repeat 3 --scenario top_movies_by_genre
+#   python benchmark.py --secret MAX_CONCURRENT_REQUESTS=16   (overrides a secrets.toml setting for the app)
+#   python benchmark.py --json before.json, then on another commit: python benchmark.py --compare before.json
+
+REPO = Path(__file__).parent.resolve()
+PHASES = ("cold", "warm", "restart")
+
+
+# Each scenario calls the app's data functions (from tmdb_data, which is passed in) the way the app does
+def metadata_maps(data):
+    data.get_genre_map()
+    data.get_genre_map(reverse=True)
+    data.get_genre_map(type="tv")
+    data.get_region_map()
+    data.get_provider_map(region="GB")
+
+# looks someone up by name (searching TMDb the first time) and gets their filmography, sorted by rating
+def cast_and_crew(data):
+    person = data.find_people("Jack")[0]
+    data.sort_filmography(data.get_filmography(person["id"]), sort_by="vote_average.desc")
+
+# shows where to watch in one region and then switches to two others, which the availability matrix answers locally
+def where_to_watch_regions(data):
+    for region in ("GB", "US", "DE"):
+        data.top_movies_by_genre(genre=["Action", "Drama"], vote_count__gte=500, get_watch_providers=True, watch_region=region)
+
+SCENARIOS = {
+    "metadata_maps": metadata_maps,
+    "multi_search": lambda data: data.multi_search("Night"),
+    "multi_search_biographies": lambda data: data.multi_search("Jack", fetch_details=True),
+    "single_search": lambda data: data.single_search("Night", search_type="movie"),
+    "top_movies_by_genre": lambda data: data.top_movies_by_genre(genre=["Action", "Drama"], vote_count__gte=500),
+    "top_movies_by_genre_providers": lambda data: data.top_movies_by_genre(genre=["Action", "Drama"], vote_count__gte=500,
+                                                                           get_watch_providers=True, watch_region="GB"),
+    "where_to_watch_regions": where_to_watch_regions,
+    "top_tv_shows_by_genre": lambda data: data.top_tv_shows_by_genre(genre=["Comedy", "Drama"], vote_count__gte=500),
+    "cast_and_crew": cast_and_crew,
+}
+
+
+#%% Worker - runs in its own process, with the benchmark's cache directory as its working directory
+
+def fake_stats(url):
+    from fake_tmdb import STATS_PATH
+    with urlopen(url + STATS_PATH) as response:
+        return json.load(response)
+
+def run_worker(scenario, url, phases, trace_memory=False):
+    import tmdb_data
+    tmdb_data.configure(TMDB_URL=url) # sends every TMDb request to the fake server
+
+    results = {}
+    for phase in phases:
+        before = fake_stats(url)
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        SCENARIOS[scenario](tmdb_data)
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        tracemalloc.stop()
+
+        # waits for pages being prefetched in the background, so their requests are counted in this phase
+        tmdb_data.get_page_prefetcher().wait()
+        after = fake_stats(url)
+        results[phase] = {"wall": wall, "requests": after["requests"] - before["requests"],
+                          "throttled": after["throttled"] - before["throttled"], "peak_memory": peak}
+    return results
+
+def start_worker(scenario, url, phases, workdir, trace_memory=False):
+    command = [sys.executable, str(REPO / "benchmark.py"), "--worker", scenario, "--url", url, "--phases", ",".join(phases)]
+    if trace_memory:
+        command.append("--trace-memory")
+    process = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Scenario '{scenario}' failed:\n{process.stderr[-3000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+#%% Runner
+
+# the app's settings for a benchmark run - its caches are kept in the working directory, so each run starts empty
+def write_secrets(workdir, secrets):
+    settings = {"TMDB_API_KEY": "benchmark", **secrets}
+    (Path(workdir) / ".streamlit").mkdir()
+    with open(Path(workdir) / ".streamlit" / "secrets.toml", "w") as f:
+        for key, value in settings.items():
+            f.write(f"{key} = {json.dumps(value)}\n")
+
+# runs a scenario's cold, warm and restart phases in fresh processes
+def run_phases(scenario, url, secrets, trace_memory=False):
+    with tempfile.TemporaryDirectory() as workdir:
+        write_secrets(workdir, secrets)
+        results = start_worker(scenario, url, ("cold", "warm"), workdir, trace_memory)
+        results.update(start_worker(scenario, url, ("restart",), workdir, trace_memory))
+    return results
+
+def run_scenario(scenario, url, secrets, repeat=1, memory=True):
+    runs = [run_phases(scenario, url, secrets) for _ in range(repeat)]
+    memory_run = run_phases(scenario, url, secrets, trace_memory=True) if memory else None
+    return {phase: {
+        "wall": statistics.median(run[phase]["wall"] for run in runs),
+        "requests": runs[-1][phase]["requests"],
+        "throttled": runs[-1][phase]["throttled"],
+        "peak_memory": memory_run[phase]["peak_memory"] if memory_run else None,
+    } for phase in PHASES}
+
+def print_results(results, baseline=None):
+    header = f"{'Scenario':<32}{'Phase':<9}{'Wall (ms)':>11}{'Requests':>10}{'429s':>6}{'Peak (MB)':>11}"
+    if baseline:
+        header += f"{'vs baseline':>13}"
+    print(header)
+    print("-" * len(header))
+    for scenario, phases in results.items():
+        for phase, result in phases.items():
+            peak = f"{result['peak_memory'] / 1024 / 1024:.1f}" if result["peak_memory"] is not None else "-"
+            line = f"{scenario:<32}{phase:<9}{result['wall'] * 1000:>11.1f}{result['requests']:>10}{result['throttled']:>6}{peak:>11}"
+            old = (baseline or {}).get(scenario, {}).get(phase)
+            if old:
+                line += f"{(result['wall'] / old['wall'] - 1) * 100 if old['wall'] else 0:>+12.1f}%"
+            print(line)
+
+# parses --secret KEY=VALUE, with values read as JSON where they can be (e.g. numbers and true/false)
+def parse_secret(setting):
+    key, _, value = setting.partition("=")
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's data functions against a local fake TMDb server.")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run (default: all of them)")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per scenario, the median is reported")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the fake server adds to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per response")
+    parser.add_argument("--rate-limit", type=float, default=None, help="the fake server's requests per second before 429s")
+    parser.add_argument("--burst", type=int, default=None)
+    parser.add_argument("--fixtures", default=None, help="JSON lines file of recorded responses to replay (see fake_tmdb.py)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the fake server's generated catalog")
+    parser.add_argument("--secret", action="append", default=[], type=parse_secret, metavar="KEY=VALUE",
+                        help="app setting to use instead of its default, as in secrets.toml")
+    parser.add_argument("--no-memory", action="store_true", help="skip the memory tracing run")
+    parser.add_argument("--json", default=None, help="also save the results to this file")
+    parser.add_argument("--compare", default=None, help="results file from an earlier run to compare against")
+    # used internally to run one scenario in a worker process
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--url", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--phases", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--trace-memory", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.url, args.phases.split(","), args.trace_memory)))
+        return
+
+    from fake_tmdb import FakeTMDb
+    fake = FakeTMDb(fixtures=args.fixtures, latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                    burst=args.burst, seed=args.seed).start()
+    try:
+        results = {scenario: run_scenario(scenario, fake.url, dict(args.secret), repeat=args.repeat, memory=not args.no_memory)
+                   for scenario in args.scenario or SCENARIOS}
+    finally:
+        fake.stop()
+
+    baseline = json.loads(Path(args.compare).read_text())["results"] if args.compare else None
+    print_results(results, baseline)
+    if args.json:
+        settings = {key: value for key, value in vars(args).items() if key not in ("json", "compare", "worker", "url", "phases", "trace_memory")}
+        Path(args.json).write_text(json.dumps({"settings": settings, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from files import replace_file
+
+# Local copy of TMDb's movie and tv show metadata, saved as one Parquet file per type (movie.parquet, tv.parquet).
+# Discover queries on genre, date range, vote count and sort order can then be answered with vectorized numpy masks
+# and precomputed sort orders instead of an API call - which takes milliseconds and works offline.
+#
+# Build (or refresh) the catalog with:
+#   python catalog.py --out .cache/catalog --type movie --from-year 1990
+# or load it from a dump file of JSON lines records with the same fields as TMDb's discover results:
+#   python catalog.py --out .cache/catalog --type movie --dump movies.ndjson
+#
+# A catalog built from TMDb only has the titles within the bounds it was built with (the years and minimum vote count),
+# which are saved in the Parquet file's metadata, so queries reaching outside them go to TMDb instead.
+
+# TMDb field names differ between movies and tv shows
+TITLE_FIELD = {"movie": "title", "tv": "name"}
+DATE_FIELD = {"movie": "release_date", "tv": "first_air_date"}
+DATE_PARAM = {"movie": "primary_release_date", "tv": "first_air_date"}
+
+# numeric fields the catalog can sort on, with sort orders for these precomputed when the catalog is loaded
+SORT_FIELDS = ("popularity", "vote_average", "vote_count")
+PRECOMPUTED_SORTS = ("popularity.desc", "vote_average.desc")
+
+# discover params the catalog can answer - any other param with a value means the query has to go to TMDb.
+# watch_region only matters together with with_watch_providers, so it's fine to ignore on its own.
+IGNORED_PARAMS = {"watch_region"}
+
+PAGE_SIZE = 20 # same as TMDb, so pages line up whichever one answers
+
+
+def columns_for(type):
+    return ["id", TITLE_FIELD[type], "overview", "genre_ids", DATE_FIELD[type], "popularity",
+            "vote_average", "vote_count", "poster_path"]
+
+
+class Catalog:
+    def __init__(self, df, type="movie"):
+        self.type = type
+        self.df = df.reset_index(drop=True)
+        # the min_votes, from_date and to_date (YYYY-MM-DD) it was built with, if any
+        self.bounds = dict(df.attrs.get("bounds") or {})
+
+        # columns as numpy arrays, so queries don't go through pandas indexing
+        self.ids = self.df["id"].to_numpy()
+        self.popularity = self.df["popularity"].to_numpy(dtype="float64", na_value=np.nan)
+        self.vote_average = self.df["vote_average"].to_numpy(dtype="float64", na_value=np.nan)
+        self.vote_count = self.df["vote_count"].to_numpy(dtype="float64", na_value=np.nan)
+        self.dates = pd.to_datetime(self.df[DATE_FIELD[type]], errors="coerce").to_numpy(dtype="datetime64[ns]")
+
+        # each genre gets a bit, and each title a bitmask of its genres, so genre filters are a single bitwise AND
+        genre_ids = sorted({g for genres in self.df["genre_ids"] for g in (genres if genres is not None else [])})
+        self.genre_bits = {g: np.uint64(1) << np.uint64(i) for i, g in enumerate(genre_ids[:64])}
+        self.genre_masks = np.array([genre_mask(genres, self.genre_bits) for genres in self.df["genre_ids"]], dtype="uint64")
+
+        self.sort_orders = {}
+        for sort_by in PRECOMPUTED_SORTS:
+            self.sort_order(sort_by)
+
+    @classmethod
+    def load(cls, path, type="movie"):
+        return cls(pd.read_parquet(path), type=type)
+
+    def __len__(self):
+        return len(self.df)
+
+    # returns row numbers in the given order, e.g. 'popularity.desc', computing it the first time it's asked for
+    def sort_order(self, sort_by):
+        if sort_by not in self.sort_orders:
+            field, _, direction = sort_by.partition(".")
+            values = getattr(self, field)
+            order = np.argsort(-values if direction == "desc" else values, kind="stable") # NaNs end up last either way
+            self.sort_orders[sort_by] = order
+        return self.sort_orders[sort_by]
+
+    # whether the catalog can answer a discover query with these params (on its own, without TMDb)
+    def can_answer(self, sort_by="popularity.desc", **params):
+        field, _, direction = (sort_by or "popularity.desc").partition(".")
+        if field not in SORT_FIELDS or direction not in ("asc", "desc"):
+            return False
+        if params.get("with_genres") and any(int(g) not in self.genre_bits for g in split_genres(params["with_genres"])):
+            return False
+        supported = {"with_genres", "vote_count__gte", f"{DATE_PARAM[self.type]}__gte", f"{DATE_PARAM[self.type]}__lte"}
+        if not all(value in (None, "") or key in supported or key in IGNORED_PARAMS for key, value in params.items()):
+            return False
+        return self.within_bounds(**params)
+
+    # whether every title a query could match is within the bounds the catalog was built with
+    def within_bounds(self, vote_count__gte=None, **params):
+        min_votes, from_date, to_date = self.bounds.get("min_votes"), self.bounds.get("from_date"), self.bounds.get("to_date")
+        date_gte = params.get(f"{DATE_PARAM[self.type]}__gte") or None
+        date_lte = params.get(f"{DATE_PARAM[self.type]}__lte") or None
+        if min_votes and (vote_count__gte or 0) < min_votes:
+            return False
+        if from_date and (date_gte is None or str(date_gte) < from_date):
+            return False
+        if to_date and (date_lte is None or str(date_lte) > to_date):
+            return False
+        return True
+
+    # answers a discover query, returning a page shaped like TMDb's discover results (iterable, with total_pages).
+    # If ids is given, only titles with those TMDb ids are included (e.g. the ones on a provider, see availability.py).
+    def discover(self, page=1, sort_by="popularity.desc", with_genres=None, vote_count__gte=None, ids=None, **params):
+        mask = np.ones(len(self.df), dtype=bool)
+
+        if ids is not None:
+            mask &= np.isin(self.ids, list(ids))
+
+        if with_genres:
+            # '|' means any of the genres, ',' means all of them
+            wanted = genre_mask(split_genres(with_genres), self.genre_bits)
+            if "," in str(with_genres):
+                mask &= (self.genre_masks & wanted) == wanted
+            else:
+                mask &= (self.genre_masks & wanted) != 0
+
+        if vote_count__gte is not None:
+            mask &= self.vote_count >= vote_count__gte
+
+        date_gte = params.get(f"{DATE_PARAM[self.type]}__gte")
+        date_lte = params.get(f"{DATE_PARAM[self.type]}__lte")
+        if date_gte:
+            mask &= self.dates >= np.datetime64(date_gte, "ns")
+        if date_lte:
+            mask &= self.dates <= np.datetime64(date_lte, "ns")
+
+        order = self.sort_order(sort_by or "popularity.desc")
+        matches = order[mask[order]]
+        rows = matches[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+
+        return CatalogPage([self.record(row) for row in rows], page, len(matches))
+
+    # a single title as an object with the same attribute names as TMDb's results
+    def record(self, row):
+        values = {key: None if np.isscalar(value) and pd.isna(value) else value for key, value in self.df.iloc[row].items()}
+        values["genre_ids"] = [int(g) for g in values["genre_ids"]] if values["genre_ids"] is not None else []
+        values[DATE_FIELD[self.type]] = to_date(values[DATE_FIELD[self.type]])
+        return SimpleNamespace(**values)
+
+
+# One page of catalog results, which can be used in place of a page of TMDb discover results
+class CatalogPage:
+    def __init__(self, results, page, total_results):
+        self.results = results
+        self.page = page
+        self.total_results = total_results
+        self.total_pages = max(1, math.ceil(total_results / PAGE_SIZE))
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+
+def split_genres(with_genres):
+    return [g for g in str(with_genres).replace(",", "|").split("|") if g]
+
+def genre_mask(genres, genre_bits):
+    mask = np.uint64(0)
+    for g in genres if genres is not None else []:
+        mask |= genre_bits.get(int(g), np.uint64(0))
+    return mask
+
+def to_date(value):
+    if value is None or pd.isna(value):
+        return None
+    return pd.Timestamp(value).date()
+
+
+#%% Ingestion
+
+# Fetches every title matching the given discover params, one year at a time (TMDb only serves the first 500 pages of
+# any query), with pages fetched in parallel. Returns a DataFrame with the catalog's columns.
+def fetch_from_tmdb(tmdb, type="movie", from_year=1990, to_year=None, vote_count__gte=10, max_workers=8):
+    to_year = to_year or date.today().year
+    discover = lambda **params: getattr(tmdb.discover(), type)(**params)
+    records = []
+    for year in range(from_year, to_year + 1):
+        params = {"sort_by": "popularity.desc",
+                  "vote_count__gte": vote_count__gte,
+                  f"{DATE_PARAM[type]}__gte": f"{year}-01-01",
+                  f"{DATE_PARAM[type]}__lte": f"{year}-12-31"}
+        first_page = discover(page=1, **params)
+        pages = [first_page]
+        last_page = min(first_page.total_pages or 1, 500)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pages += list(executor.map(lambda page: discover(page=page, **params), range(2, last_page + 1)))
+        for results in pages:
+            records += [{column: getattr(result, column, None) for column in columns_for(type)} for result in results]
+    df = to_catalog_frame(records, type)
+    df.attrs["bounds"] = {"min_votes": vote_count__gte, "from_date": f"{from_year}-01-01", "to_date": f"{to_year}-12-31"}
+    return df
+
+# Reads a dump file of JSON lines records (one title per line) into a DataFrame with the catalog's columns
+def read_dump(dump_path, type="movie"):
+    with open(dump_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return to_catalog_frame(records, type)
+
+def to_catalog_frame(records, type="movie"):
+    df = pd.DataFrame.from_records(records, columns=columns_for(type))
+    df = df.drop_duplicates(subset="id", keep="last")
+    df.attrs = {}
+    df[DATE_FIELD[type]] = pd.to_datetime(df[DATE_FIELD[type]], errors="coerce")
+    df["popularity"] = df["popularity"].astype("float64")
+    df["vote_average"] = df["vote_average"].astype("float64")
+    df["vote_count"] = df["vote_count"].astype("Int64")
+    df["genre_ids"] = df["genre_ids"].map(lambda genres: list(genres) if genres is not None else [])
+    return df.reset_index(drop=True)
+
+def save(df, out_dir, type="movie"):
+    path = Path(out_dir) / f"{type}.parquet"
+    # df.attrs (the bounds) are saved in the file's pandas metadata
+    replace_file(path, lambda temp_path: df.to_parquet(temp_path, index=False))
+    return path
+
+# Reads the TMDb API key from the environment, or from .streamlit/secrets.toml if it's not set there
+def read_api_key(secrets_path=Path(__file__).parent / ".streamlit" / "secrets.toml"):
+    if os.environ.get("TMDB_API_KEY"):
+        return os.environ["TMDB_API_KEY"]
+    import tomllib
+    with open(secrets_path, "rb") as f:
+        return tomllib.load(f)["TMDB_API_KEY"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local TMDb catalog used to answer discover queries offline.")
+    parser.add_argument("--out", default=".cache/catalog", help="folder to save movie.parquet / tv.parquet in")
+    parser.add_argument("--type", choices=["movie", "tv"], default="movie")
+    parser.add_argument("--dump", help="load from a JSON lines dump file instead of the TMDb API")
+    parser.add_argument("--from-year", type=int, default=1990)
+    parser.add_argument("--to-year", type=int, default=None)
+    parser.add_argument("--min-votes", type=int, default=10, help="only include titles with at least this many votes")
+    args = parser.parse_args()
+
+    if args.dump:
+        df = read_dump(args.dump, type=args.type)
+    else:
+        from themoviedb import TMDb
+        tmdb = TMDb(key=read_api_key(), language='en-GB', region='GB')
+        df = fetch_from_tmdb(tmdb, type=args.type, from_year=args.from_year, to_year=args.to_year, vote_count__gte=args.min_votes)
+
+    print(f"Saved {len(df)} titles to {save(df, args.out, type=args.type)}")
@@ -0,0 +1,62 @@
+import json
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+from files import write_json
+
+MAX_WINDOW = 13 * 24 * 3600 # TMDb's changes endpoints only go back 14 days, and dates are whole days
+
+# What's changed on TMDb since the app last checked, from TMDb's changes endpoints (movie/changes and tv/changes), which
+# list the id of every title edited between two dates. Cached data about a title that isn't in the list is still
+# current, so it can be kept rather than fetched again - see tmdb_data.sync_changes, which uses this to patch only the
+# changed titles in the app's caches, so keeping them fresh costs a call per changed title rather than per cached one.
+#
+# The time of the last sync of each type (the watermark) is saved to path, so a restarted app carries on from it.
+# fetch_ids(type, start_date, end_date) returns the ids changed between two dates (YYYY-MM-DD, in UTC).
+class ChangeFeed:
+    def __init__(self, fetch_ids, path=None, max_window=MAX_WINDOW):
+        self.fetch_ids = fetch_ids
+        self.path = Path(path) if path else None
+        self.max_window = max_window
+        self.watermarks = {} # type -> when it was last synced (unix time)
+        self.lock = threading.Lock()
+        self.load()
+
+    # Returns (since, changed ids): since is when type was last synced, and the ids are every title changed after then.
+    # since is None (with no ids) when there's nothing to sync from - on the first sync, or if the last one was longer
+    # ago than TMDb keeps changes for - in which case nothing cached can be vouched for.
+    def changes(self, type, now):
+        with self.lock:
+            since = self.watermarks.get(type)
+        if since is None or now - since > self.max_window:
+            return None, set()
+        # TMDb only takes dates, so this starts from the beginning of the last sync's day - some titles changed before
+        # the last sync are included again, but none after it are missed
+        return since, set(self.fetch_ids(type, utc_date(since), utc_date(now + 24 * 3600)))
+
+    # records a finished sync of type, so the next one starts from now
+    def advance(self, type, now):
+        with self.lock:
+            self.watermarks[type] = now
+        self.save()
+
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path) as f:
+                self.watermarks = {type: float(watermark) for type, watermark in json.load(f).items()}
+        except (OSError, ValueError, TypeError, AttributeError):
+            self.watermarks = {} # ignores a corrupt file, and starts again from the next sync
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            watermarks = dict(self.watermarks)
+        write_json(self.path, watermarks)
+
+
+def utc_date(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).date().isoformat()
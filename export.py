@@ -0,0 +1,264 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Runs the app's discover queries (top_movies_by_genre and top_tv_shows_by_genre, with where to watch) without
+# Streamlit, for many regions and genre combinations at once - e.g. for a nightly report of what's new on each
+# streaming service in each country. Each region and genre combination is a job for a pool of worker processes, which
+# share the persistent TMDb response cache, and each job's rows are written out as soon as it finishes, so memory use
+# doesn't grow with the number of regions.
+#
+#   python export.py --regions GB US DE --providers all --since 2025-01-01 --sort-by primary_release_date.desc --where-to-watch --output new.csv
+#   python export.py --type tv --genres Comedy --genres Drama,Crime --pages 3 > tv.ndjson
+#   python export.py --regions all --providers Netflix "Disney Plus" --output netflix.arrow --processes 8
+#
+# or from Python, where iter_results yields one DataFrame per job as it finishes:
+#   from export import export, iter_results
+#   export("new.ndjson", regions=["GB", "US"], providers=["all"], primary_release_date__gte="2025-01-01")
+#
+# The TMDb API key and other settings are read from the TMDB_API_KEY environment variable (or any other setting of the
+# same name) or .streamlit/secrets.toml, as in the app. TMDB_RATE_LIMIT and TMDB_RATE_BURST are shared between the
+# worker processes, so the export as a whole stays within them.
+
+FORMATS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv", ".arrow": "arrow", ".feather": "arrow"}
+
+
+#%% Jobs - run in the worker processes
+
+# Streamlit warns about every cached call made outside an app, which is expected here. Its config is loaded first, as
+# loading it sets the log level back to the config's.
+def quiet_streamlit():
+    from streamlit import config
+    from streamlit.logger import set_log_level
+    config.get_config_options()
+    set_log_level("error")
+
+# settings is passed to tmdb_data.configure() in each worker, before it makes any TMDb call
+def init_worker(settings):
+    quiet_streamlit()
+    import tmdb_data
+    tmdb_data.configure(**settings)
+
+# Runs one region and genre combination, returning every page of its results as one table, with the region and genres
+# in the first columns. Returns an empty table if none of the providers asked for are available in the region.
+def run_job(job):
+    import tmdb_data
+    type, region, genres, providers = job["type"], job["region"], job["genres"], job["providers"]
+    filters = dict(job["filters"])
+
+    if region:
+        filters["watch_region"] = region
+    if region and providers:
+        provider_name_to_id = tmdb_data.get_provider_map(region=region, type=type)
+        names = provider_name_to_id if providers == ["all"] else [name for name in providers if name in provider_name_to_id]
+        if not names:
+            return pd.DataFrame()
+        filters["watch_providers"] = "|".join(str(provider_name_to_id[name]) for name in names)
+
+    if type == "movie":
+        top_function = tmdb_data.top_movies_by_genre
+        filters["get_watch_providers"] = job["where_to_watch"]
+    else:
+        top_function = tmdb_data.top_tv_shows_by_genre
+
+    frames = []
+    for page in range(1, job["pages"] + 1):
+        df = top_function(genre=genres, page=page, **filters)
+        frames.append(df)
+        if page >= df.attrs.get("total_pages", page):
+            break
+    df = pd.concat(frames, ignore_index=True)
+
+    if "Where to Watch" in df.columns and not job["where_to_watch"]:
+        df = df.drop(columns=["Where to Watch"])
+    df.insert(0, "Region", region or "")
+    df.insert(1, "Genre Filter", ", ".join(genres))
+    return df
+
+
+#%% Writers - each one writes tables as they arrive, so only one job's results are ever held in memory
+
+# One JSON object per row, with dates as YYYY-MM-DD
+class NDJSONWriter:
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, df):
+        for record in plain_records(df):
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        pass
+
+# CSV with a header row, with lists (genres and providers) written as comma separated names
+class CSVWriter:
+    def __init__(self, file):
+        self.file = file
+        self.writer = None
+
+    def write(self, df):
+        records = plain_records(df)
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(df.columns))
+            self.writer.writeheader()
+        for record in records:
+            self.writer.writerow({column: ", ".join(value) if isinstance(value, list) else value
+                                  for column, value in record.items()})
+        self.file.flush()
+
+    def close(self):
+        pass
+
+# Arrow IPC file (readable with pyarrow.ipc.open_file, pandas.read_feather or polars), one record batch per job
+class ArrowWriter:
+    def __init__(self, file):
+        self.file = file
+        self.writer = None
+        self.schema = None
+
+    def write(self, df):
+        if self.writer is None:
+            self.schema = arrow_schema(df)
+            self.writer = pa.ipc.new_file(self.file, self.schema)
+        self.writer.write_batch(pa.RecordBatch.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+WRITERS = {"ndjson": NDJSONWriter, "csv": CSVWriter, "arrow": ArrowWriter}
+
+# rows of a table as dicts of plain Python values, so they can be written as JSON or CSV
+def plain_records(df):
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime("%Y-%m-%d")
+    return [{column: plain_value(value) for column, value in row.items()} for row in df.to_dict("records")]
+
+def plain_value(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [plain_value(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is pd.NA or (isinstance(value, float) and value != value): # missing text or numbers
+        return None
+    return value
+
+# the table's Arrow schema, with empty columns (e.g. no genres in the first job's rows) typed as strings so that later
+# jobs' rows fit in the same file. Dictionary-encoded labels (category columns) are written as plain strings, as each
+# job's table has its own dictionary and an Arrow file can only have one per column.
+def arrow_schema(df):
+    fields = []
+    for field in pa.Schema.from_pandas(df, preserve_index=False):
+        if pa.types.is_null(field.type) or pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.string())
+        elif pa.types.is_list(field.type) and (pa.types.is_null(field.type.value_type) or pa.types.is_dictionary(field.type.value_type)):
+            field = field.with_type(pa.list_(pa.string()))
+        fields.append(field)
+    return pa.schema(fields)
+
+
+#%% Python API
+
+# Every job for the given regions and genre combinations. genres is a list of combinations, each a list of genres
+# (or a single genre name). Regions only matter with providers (or where_to_watch for movies) - otherwise there's
+# one job per genre combination. regions can be ["all"] for every region TMDb has providers for.
+def make_jobs(type="movie", regions=None, genres=None, providers=None, where_to_watch=False, pages=1, **filters):
+    import tmdb_data
+    where_to_watch = where_to_watch and type == "movie" # TMDb's where to watch lookup is only used for movies
+    if regions == ["all"]:
+        regions = sorted(tmdb_data.get_region_map(reverse=True))
+    if not regions or not (providers or where_to_watch):
+        regions = [None]
+    genres = [[combination] if isinstance(combination, str) else list(combination) for combination in genres or [[]]]
+    return [{"type": type, "region": region, "genres": genre_combination, "providers": providers,
+             "where_to_watch": where_to_watch, "pages": pages, "filters": filters}
+            for region, genre_combination in product(regions, genres)]
+
+# Settings for each worker process. The rate limit and burst are split between them, and pages past the last one asked
+# for aren't prefetched. Any settings given here (e.g. TMDB_API_KEY) override the environment and secrets.toml.
+def worker_settings(processes, pages, settings=None):
+    import tmdb_data
+    return {**(settings or {}),
+            "TMDB_API_KEY": tmdb_data.setting("TMDB_API_KEY"),
+            "TMDB_RATE_LIMIT": float(tmdb_data.setting("TMDB_RATE_LIMIT", 40)) / processes,
+            "TMDB_RATE_BURST": max(1, int(tmdb_data.setting("TMDB_RATE_BURST", 40)) // processes),
+            "MAX_DISCOVER_PAGES": pages}
+
+# Runs every job in a pool of processes, yielding each job's table as it finishes (in the order they finish).
+# Takes the same arguments as make_jobs, plus the number of processes (defaults to one per CPU, up to 8) and settings.
+def iter_results(processes=None, settings=None, pages=1, **options):
+    quiet_streamlit()
+    import tmdb_data
+    tmdb_data.configure(**(settings or {}))
+    jobs = make_jobs(pages=pages, **options)
+    processes = max(1, min(processes or min(os.cpu_count() or 1, 8), len(jobs)))
+    # spawn rather than fork, so workers don't inherit this process's TMDb session and its threads
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(worker_settings(processes, pages, settings),)) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            df = future.result()
+            if not df.empty:
+                yield df
+
+# Writes the results of every job to output (a path, or "-" for stdout) as they finish, returning the number of rows.
+# format is "ndjson", "csv" or "arrow", and is worked out from output's extension if not given (defaulting to ndjson).
+def export(output="-", format=None, **options):
+    format = format or FORMATS.get(os.path.splitext(str(output))[1].lower(), "ndjson")
+    binary = format == "arrow"
+    if output == "-":
+        file = sys.stdout.buffer if binary else sys.stdout
+    else:
+        file = open(output, "wb") if binary else open(output, "w", newline="", encoding="utf-8")
+
+    writer = WRITERS[format](file)
+    rows = 0
+    try:
+        for df in iter_results(**options):
+            writer.write(df)
+            rows += len(df)
+    finally:
+        writer.close()
+        if output != "-":
+            file.close()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export top movies or tv shows for many regions and genres without the app.")
+    parser.add_argument("--type", choices=["movie", "tv"], default="movie")
+    parser.add_argument("--regions", nargs="+", help="region codes such as GB US, or 'all' for every region with providers")
+    parser.add_argument("--genres", action="append", type=lambda value: [g.strip() for g in value.split(",") if g.strip()],
+                        help="comma separated genres to include (any of them) - repeat for more combinations, e.g. --genres Action,Drama --genres Comedy")
+    parser.add_argument("--providers", nargs="+", help="only titles on these providers (e.g. Netflix), or 'all' for every provider in the region")
+    parser.add_argument("--where-to-watch", action="store_true", help="add each movie's subscription providers in the region")
+    parser.add_argument("--pages", type=int, default=1, help="pages of 20 results for each region and genre combination")
+    parser.add_argument("--sort-by", default="popularity.desc", help="e.g. vote_average.desc or primary_release_date.desc")
+    parser.add_argument("--since", help="earliest release date (YYYY-MM-DD)")
+    parser.add_argument("--until", default=date.today().isoformat(), help="latest release date (defaults to today)")
+    parser.add_argument("--min-votes", type=int, default=0)
+    parser.add_argument("--output", default="-", help="file to write to (.ndjson, .csv or .arrow), or - for stdout")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="defaults to the output file's extension, or ndjson")
+    parser.add_argument("--processes", type=int, help="worker processes (defaults to one per CPU, up to 8)")
+    args = parser.parse_args()
+
+    filters = {"sort_by": args.sort_by, "primary_release_date__lte": args.until, "vote_count__gte": args.min_votes}
+    if args.since:
+        filters["primary_release_date__gte"] = args.since
+    rows = export(args.output, format=args.format, processes=args.processes, type=args.type, regions=args.regions,
+                  genres=args.genres, providers=args.providers, where_to_watch=args.where_to_watch, pages=args.pages,
+                  **filters)
+    print(f"Exported {rows} rows", file=sys.stderr)
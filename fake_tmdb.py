@@ -0,0 +1,402 @@
+import argparse
+import copy
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+
+from tmdb_cache import cache_key
+
+# A stand-in for the TMDb API, used by benchmark.py to measure the app without network access or an API key.
+# Responses are replayed from a fixtures file (recorded from the real API with --record) where there's one for the
+# request, and otherwise generated from a seeded, made-up catalog of movies, tv shows and people - so every discover
+# page, search and details request gets a realistic answer, and the same answer every time.
+#
+# The server can also add latency to every response, and enforce a rate limit the way TMDb does (answering 429
+# with a Retry-After header). Request counts, and the most requests it's had in flight at once, are served as JSON at
+# /__fake__/stats.
+#
+# Usage:
+#   python fake_tmdb.py --port 8765 --latency 0.05 --rate-limit 40
+#   python fake_tmdb.py --port 8765 --fixtures fixtures.jsonl --record --api-key <key>   (records real responses)
+
+STATS_PATH = "/__fake__/stats"
+PAGE_SIZE = 20
+MAX_PAGES = 500 # TMDb never returns more than 500 pages of results
+CHANGES_PAGE_SIZE = 100
+CHANGES_PER_DAY = 0.005 # fraction of the catalog's titles changed on each day
+
+MOVIE_GENRES = {28: "Action", 12: "Adventure", 16: "Animation", 35: "Comedy", 80: "Crime", 99: "Documentary",
+                18: "Drama", 10751: "Family", 14: "Fantasy", 36: "History", 27: "Horror", 10402: "Music",
+                9648: "Mystery", 10749: "Romance", 878: "Science Fiction", 10770: "TV Movie", 53: "Thriller",
+                10752: "War", 37: "Western"}
+TV_GENRES = {10759: "Action & Adventure", 16: "Animation", 35: "Comedy", 80: "Crime", 99: "Documentary", 18: "Drama",
+             10751: "Family", 10762: "Kids", 9648: "Mystery", 10763: "News", 10764: "Reality",
+             10765: "Sci-Fi & Fantasy", 10766: "Soap", 10767: "Talk", 10768: "War & Politics", 37: "Western"}
+REGIONS = {"GB": "United Kingdom", "US": "United States", "IE": "Ireland", "FR": "France", "DE": "Germany",
+           "ES": "Spain", "IT": "Italy", "CA": "Canada", "AU": "Australia", "JP": "Japan"}
+PROVIDERS = ["Netflix", "Amazon Prime Video", "Disney Plus", "Apple TV Plus", "Now TV", "BBC iPlayer", "ITVX",
+             "Channel 4", "Paramount Plus", "Sky Go", "MUBI", "BritBox", "Hulu", "Max", "Peacock", "Crunchyroll",
+             "Curzon Home Cinema", "BFI Player", "Shudder", "Rakuten TV"]
+
+TITLE_WORDS = ["Night", "Last", "Red", "Silent", "Lost", "City", "River", "Shadow", "Golden", "Broken", "Wild",
+               "Summer", "Winter", "Empire", "Secret", "Dark", "Long", "Road", "House", "Fire", "Star", "Glass",
+               "Iron", "Blue", "Storm", "Heart", "Ghost", "King", "Garden", "Island", "Echo", "Midnight"]
+FIRST_NAMES = ["Jack", "Emma", "Oliver", "Sophie", "Harry", "Grace", "James", "Lucy", "Thomas", "Chloe", "Daniel",
+               "Mia", "Samuel", "Ella", "Joseph", "Amelia", "Henry", "Isla", "George", "Ava"]
+LAST_NAMES = ["Smith", "Jones", "Taylor", "Brown", "Williams", "Wilson", "Johnson", "Davies", "Robinson", "Wright",
+              "Thompson", "Evans", "Walker", "White", "Roberts", "Green", "Hall", "Wood", "Jackson", "Clarke"]
+
+
+# The made-up catalog of movies, tv shows and people, generated from a seed so it's the same on every run
+class FakeCatalog:
+    def __init__(self, seed=0, movies=5000, tv_shows=2000, people=1000):
+        rng = random.Random(seed)
+        self.movies = {id: self.make_title(rng, id, "movie") for id in range(100, 100 + movies)}
+        self.tv_shows = {id: self.make_title(rng, id, "tv") for id in range(100, 100 + tv_shows)}
+        movie_ids = list(self.movies)
+        self.people = {}
+        for id in range(1000, 1000 + people):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            self.people[id] = {
+                "adult": False, "id": id, "name": name, "original_name": name, "gender": rng.choice([1, 2]),
+                "known_for_department": rng.choice(["Acting", "Acting", "Directing", "Writing"]),
+                "popularity": round(rng.lognormvariate(2.5, 1.2), 3), "profile_path": f"/p{id}.jpg",
+                "credits": rng.sample(movie_ids, 12),
+            }
+        self.providers = [{"provider_id": i + 1, "provider_name": name, "logo_path": f"/logo{i + 1}.jpg",
+                           "display_priority": i + 1,
+                           "display_priorities": {region: i + 1 for region in REGIONS}}
+                          for i, name in enumerate(PROVIDERS)]
+
+    @staticmethod
+    def make_title(rng, id, type):
+        title = " ".join(rng.sample(TITLE_WORDS, rng.randint(1, 3)))
+        genres = list(MOVIE_GENRES if type == "movie" else TV_GENRES)
+        released = date(1970, 1, 1) + timedelta(days=rng.randint(0, 56 * 365))
+        record = {
+            "adult": False, "id": id, "backdrop_path": f"/b{type}{id}.jpg", "poster_path": f"/{type}{id}.jpg",
+            "genre_ids": rng.sample(genres, rng.randint(1, 3)), "original_language": "en",
+            "overview": f"{title} is a {rng.choice(['thrilling', 'moving', 'funny', 'dark', 'sweeping'])} story about "
+                        f"{rng.choice(FIRST_NAMES)}, who {rng.choice(['returns home', 'takes one last job', 'falls in love', 'uncovers a secret'])}.",
+            "popularity": round(rng.lognormvariate(2.5, 1.2), 3),
+            "vote_average": round(min(10, max(1, rng.gauss(6.5, 1))), 1),
+            "vote_count": int(rng.lognormvariate(6, 2)),
+        }
+        if type == "movie":
+            record.update(title=title, original_title=title, release_date=released.isoformat(), video=False)
+        else:
+            record.update(name=title, original_name=title, first_air_date=released.isoformat(), origin_country=["GB"])
+        return record
+
+    def titles(self, type):
+        return self.movies if type == "movie" else self.tv_shows
+
+    # the providers a title can be streamed on in each region - a few per region, chosen by the title's id
+    def watch_providers(self, type, id):
+        rng = random.Random(f"{type}{id}")
+        results = {}
+        for region in REGIONS:
+            flatrate = rng.sample(self.providers, rng.randint(0, 4))
+            results[region] = {"link": f"https://www.themoviedb.org/{type}/{id}/watch?locale={region}",
+                               "flatrate": [{k: p[k] for k in ("provider_id", "provider_name", "logo_path", "display_priority")}
+                                            for p in flatrate]}
+        return results
+
+    # ids of the titles changed between two dates (YYYY-MM-DD, inclusive) - a few on each day, chosen by the date
+    def changes(self, type, start_date, end_date):
+        titles = sorted(self.titles(type))
+        day, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        ids = set()
+        while day <= end:
+            ids.update(random.Random(f"{type}{day}").sample(titles, max(1, int(len(titles) * CHANGES_PER_DAY))))
+            day += timedelta(days=1)
+        return [{"id": id, "adult": False} for id in sorted(ids)]
+
+    def person(self, id, details=False):
+        person = {k: v for k, v in self.people[id].items() if k != "credits"}
+        person["known_for"] = [{**self.movies[movie_id], "media_type": "movie"} for movie_id in self.people[id]["credits"][:3]]
+        if details:
+            person.pop("known_for")
+            person.update(biography=f"{person['name']} is an actor and filmmaker. " * 20,
+                          birthday="1970-01-01", place_of_birth="London, England, UK")
+        return person
+
+    # a person's cast and crew credits - acting in some titles, and directing (some of them as well as acting in them) others
+    def combined_credits(self, id):
+        credits = self.people[id]["credits"]
+        cast = [{**self.movies[movie_id], "media_type": "movie", "character": f"Character {i + 1}", "credit_id": f"c{id}-{movie_id}"}
+                for i, movie_id in enumerate(credits[:8])]
+        crew = [{**self.movies[movie_id], "media_type": "movie", "department": "Directing", "job": "Director", "credit_id": f"d{id}-{movie_id}"}
+                for movie_id in credits[6:]]
+        shows = random.Random(id).sample(list(self.tv_shows), 2)
+        cast += [{**self.tv_shows[show_id], "media_type": "tv", "character": "Themselves", "episode_count": 3,
+                  "credit_id": f"t{id}-{show_id}"} for show_id in shows]
+        return {"id": id, "cast": cast, "crew": crew}
+
+
+# Answers a TMDb API request from the fake catalog, returning (status, body)
+def respond(catalog, path, params):
+    path = re.sub(r"^/\d+/", "", path)
+    page = int(params.get("page", 1))
+
+    if path in ("genre/movie/list", "genre/tv/list"):
+        genres = MOVIE_GENRES if "movie" in path else TV_GENRES
+        return 200, {"genres": [{"id": id, "name": name} for id, name in genres.items()]}
+    if path == "watch/providers/regions":
+        return 200, {"results": [{"iso_3166_1": code, "english_name": name, "native_name": name} for code, name in REGIONS.items()]}
+    if path in ("watch/providers/movie", "watch/providers/tv"):
+        return 200, {"results": catalog.providers}
+    if match := re.fullmatch(r"discover/(movie|tv)", path):
+        return 200, paginate(discover(catalog, match.group(1), params), page)
+    if match := re.fullmatch(r"search/(movie|tv|person|multi)", path):
+        return 200, paginate(search(catalog, match.group(1), params.get("query", "")), page)
+    if match := re.fullmatch(r"(movie|tv)/changes", path):
+        today = date.today()
+        changes = catalog.changes(match.group(1), params.get("start_date") or (today - timedelta(days=1)).isoformat(),
+                                  params.get("end_date") or today.isoformat())
+        return 200, paginate(changes, page, page_size=CHANGES_PAGE_SIZE)
+    if match := re.fullmatch(r"(movie|tv)/(\d+)/watch/providers", path):
+        type, id = match.group(1), int(match.group(2))
+        if id in catalog.titles(type):
+            return 200, {"id": id, "results": catalog.watch_providers(type, id)}
+    if match := re.fullmatch(r"(movie|tv)/(\d+)", path):
+        type, id = match.group(1), int(match.group(2))
+        if id in catalog.titles(type):
+            title = dict(catalog.titles(type)[id])
+            title["genres"] = [{"id": g, "name": (MOVIE_GENRES if type == "movie" else TV_GENRES)[g]} for g in title.pop("genre_ids")]
+            return 200, title
+    if match := re.fullmatch(r"person/(\d+)/combined_credits", path):
+        if int(match.group(1)) in catalog.people:
+            return 200, catalog.combined_credits(int(match.group(1)))
+    if match := re.fullmatch(r"person/(\d+)", path):
+        if int(match.group(1)) in catalog.people:
+            return 200, catalog.person(int(match.group(1)), details=True)
+    return 404, {"success": False, "status_code": 34, "status_message": "The resource you requested could not be found."}
+
+def discover(catalog, type, params):
+    date_field = "release_date" if type == "movie" else "first_air_date"
+    title_field = "title" if type == "movie" else "name"
+    date_param = "primary_release_date" if type == "movie" else "first_air_date"
+    titles = list(catalog.titles(type).values())
+
+    if params.get("with_genres"):
+        if "," in params["with_genres"]:
+            wanted = {int(g) for g in params["with_genres"].split(",")}
+            titles = [t for t in titles if wanted <= set(t["genre_ids"])]
+        else:
+            wanted = {int(g) for g in params["with_genres"].split("|")}
+            titles = [t for t in titles if wanted & set(t["genre_ids"])]
+    if params.get("vote_count.gte"):
+        titles = [t for t in titles if t["vote_count"] >= float(params["vote_count.gte"])]
+    if params.get(f"{date_param}.gte"):
+        titles = [t for t in titles if t[date_field] >= params[f"{date_param}.gte"]]
+    if params.get(f"{date_param}.lte"):
+        titles = [t for t in titles if t[date_field] <= params[f"{date_param}.lte"]]
+    if params.get("with_watch_providers"):
+        wanted = {int(p) for p in params["with_watch_providers"].split("|")}
+        region = params.get("watch_region") or "US"
+        titles = [t for t in titles
+                  if wanted & {p["provider_id"] for p in catalog.watch_providers(type, t["id"])[region]["flatrate"]}]
+
+    field, _, order = params.get("sort_by", "popularity.desc").partition(".")
+    field = {"primary_release_date": date_field, "release_date": date_field, "first_air_date": date_field,
+             "title": title_field, "original_title": title_field, "name": title_field}.get(field, field)
+    if field not in ("popularity", "vote_average", "vote_count", date_field, title_field):
+        field = "popularity" # e.g. revenue, which the fake catalog doesn't have
+    return sorted(titles, key=lambda t: t[field], reverse=order != "asc")
+
+def search(catalog, type, query):
+    query = query.lower()
+    results = []
+    if type in ("movie", "multi"):
+        results += [{**t, "media_type": "movie"} for t in catalog.movies.values() if query in t["title"].lower()]
+    if type in ("tv", "multi"):
+        results += [{**t, "media_type": "tv"} for t in catalog.tv_shows.values() if query in t["name"].lower()]
+    if type in ("person", "multi"):
+        results += [{**catalog.person(id), "media_type": "person"} for id, p in catalog.people.items() if query in p["name"].lower()]
+    results.sort(key=lambda r: r["popularity"], reverse=True)
+    if type != "multi":
+        results = [{k: v for k, v in r.items() if k != "media_type"} for r in results]
+    return results
+
+def paginate(results, page, page_size=PAGE_SIZE):
+    total_pages = min(MAX_PAGES, max(1, -(-len(results) // page_size)))
+    return {"page": page, "results": results[(page - 1) * page_size:page * page_size] if page <= MAX_PAGES else [],
+            "total_pages": total_pages, "total_results": len(results)}
+
+
+# Token bucket for the fake server's rate limit - unlike the app's RateLimiter it never waits, it just says no
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+# Recorded responses, one JSON object per line: {"key": cache key, "status": status code, "body": response body}
+class Fixtures:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self.responses = {}
+        self.lock = threading.Lock()
+        if self.path and self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        fixture = json.loads(line)
+                        self.responses[fixture["key"]] = (fixture["status"], fixture["body"])
+
+    def get(self, key):
+        return self.responses.get(key)
+
+    def add(self, key, status, body):
+        with self.lock:
+            self.responses[key] = (status, body)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"key": key, "status": status, "body": body}) + "\n")
+
+
+# Accepts many connections at once (e.g. from a pooled async client), where the default backlog of 5 would drop the
+# rest and make them wait to retry
+class Server(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+class FakeTMDb:
+    def __init__(self, fixtures=None, latency=0.0, jitter=0.0, rate_limit=None, burst=None, seed=0,
+                 record=False, api_key=None):
+        self.catalog = FakeCatalog(seed=seed)
+        self.fixtures = Fixtures(fixtures)
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket = TokenBucket(rate_limit, burst or rate_limit) if rate_limit else None
+        self.record = record
+        self.api_key = api_key
+        self.stats = {"requests": 0, "throttled": 0, "replayed": 0, "endpoints": {}, "in_flight": 0, "max_in_flight": 0}
+        self.stats_lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host="127.0.0.1", port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keeps connections open between requests, as TMDb does
+
+            def do_GET(self):
+                with fake.stats_lock:
+                    fake.stats["in_flight"] += 1
+                    fake.stats["max_in_flight"] = max(fake.stats["max_in_flight"], fake.stats["in_flight"])
+                try:
+                    status, body, headers = fake.handle(self.path)
+                finally:
+                    with fake.stats_lock:
+                        fake.stats["in_flight"] -= 1
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json;charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = Server((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="fake-tmdb").start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # returns (status, body, extra headers) for a request path (including its query string)
+    def handle(self, request_path):
+        url = urlparse(request_path)
+        if url.path == STATS_PATH:
+            with self.stats_lock:
+                return 200, copy.deepcopy(self.stats), {}
+
+        endpoint = re.sub(r"/\d+(?=/|$)", "/{id}", re.sub(r"^/\d+/", "", url.path))
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            self.stats["endpoints"][endpoint] = self.stats["endpoints"].get(endpoint, 0) + 1
+
+        if self.bucket is not None and not self.bucket.take():
+            with self.stats_lock:
+                self.stats["throttled"] += 1
+            return 429, {"success": False, "status_code": 25, "status_message": "Your request count is over the allowed limit."}, {"Retry-After": "1"}
+
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        params = dict(parse_qsl(url.query))
+        key = cache_key(url.path, params)
+        fixture = self.fixtures.get(key)
+        if fixture is not None:
+            with self.stats_lock:
+                self.stats["replayed"] += 1
+            return (*fixture, {})
+        if self.record:
+            response = requests.get(f"https://api.themoviedb.org{url.path}", params={**params, "api_key": self.api_key}, timeout=30)
+            self.fixtures.add(key, response.status_code, response.json())
+            return response.status_code, response.json(), {}
+        return (*respond(self.catalog, url.path, params), {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stand-in TMDb API server for offline benchmarking.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds, chosen at random per response")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second before answering 429")
+    parser.add_argument("--burst", type=int, default=None, help="requests allowed at once (defaults to the rate limit)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated catalog")
+    parser.add_argument("--fixtures", default=None, help="JSON lines file of recorded responses to replay")
+    parser.add_argument("--record", action="store_true", help="forward requests with no fixture to TMDb and record them")
+    parser.add_argument("--api-key", default=None, help="TMDb API key used when recording")
+    args = parser.parse_args()
+    if args.record and not (args.fixtures and args.api_key):
+        parser.error("--record needs --fixtures and --api-key")
+
+    fake = FakeTMDb(fixtures=args.fixtures, latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                    burst=args.burst, seed=args.seed, record=args.record, api_key=args.api_key)
+    fake.start(args.host, args.port)
+    print(f"Fake TMDb API running at {fake.url} (stats at {fake.url}{STATS_PATH})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
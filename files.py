@@ -0,0 +1,22 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+
+# Writes a file by writing a temporary file next to it and swapping that in, in one step, so readers (other threads,
+# other app processes, or a running app) never see a half-written file. write(temp_path) writes the new contents.
+# The temporary file is named after the process and thread, so two writers at once don't write into the same one.
+def replace_file(path, write):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        write(temp_path)
+        temp_path.replace(path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+def write_json(path, value):
+    replace_file(path, lambda temp_path: temp_path.write_text(json.dumps(value)))
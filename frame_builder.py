@@ -0,0 +1,72 @@
+import sys
+
+import pandas as pd
+
+from metrics import metrics
+
+# Collects rows into one list per column and builds the DataFrame once at the end, rather than growing it
+# one row at a time with df.loc[len(df)] = [...] (which copies the whole frame on every append).
+#
+# Columns get compact dtypes, as the tables are kept in the result caches and query store (see result_cache.py).
+# columns is a dict of column name -> dtype, where dtype is one of:
+#   "str"      - text, stored in one Arrow buffer rather than a Python object per value (missing values are <NA>)
+#   "float"    - e.g. popularity, vote average
+#   "int"      - e.g. vote count (nullable, so missing values don't force a float column, and 32 bit, as counts are small)
+#   "datetime" - e.g. release date, invalid or missing dates become NaT
+#   "category" - repeated labels, stored once with integer codes
+#   "list"     - lists of labels such as genres or providers, as Python lists whose labels are interned, so each
+#                distinct label is stored once for the whole process rather than once per row. (Not Arrow lists, which
+#                pandas can't convert back from Arrow - e.g. for Parquet or Streamlit's dataframes - and whose
+#                dictionaries would only be shared within one page of 20 rows.)
+class FrameBuilder:
+    def __init__(self, columns):
+        self.dtypes = dict(columns)
+        self.buffers = {name: [] for name in self.dtypes}
+
+    def __len__(self):
+        return len(next(iter(self.buffers.values()), []))
+
+    # adds one row, with values given in the same order as the columns
+    def append(self, row):
+        for buffer, value in zip(self.buffers.values(), row, strict=True):
+            buffer.append(value)
+
+    # sets a value in a row that has already been added (e.g. where to watch, filled in as results arrive)
+    def set(self, row, column, value):
+        self.buffers[column][row] = value
+
+    @metrics.timed("build_frame")
+    def to_frame(self):
+        return pd.DataFrame({name: to_series(values, self.dtypes[name]) for name, values in self.buffers.items()})
+
+
+# converts a column buffer to a series of the given dtype
+def to_series(values, dtype):
+    if dtype == "float":
+        return pd.Series(values, dtype="float64")
+    elif dtype == "int":
+        return pd.Series(values, dtype="Int32")
+    elif dtype == "datetime":
+        return pd.to_datetime(pd.Series(values, dtype="object"), errors="coerce")
+    elif dtype == "category":
+        return pd.Series(values, dtype="category")
+    elif dtype == "str":
+        return pd.Series(values, dtype=pd.StringDtype("pyarrow"))
+    elif dtype == "list":
+        return pd.Series([[sys.intern(label) for label in labels] if labels is not None else [] for labels in values],
+                         dtype="object")
+    else:
+        raise ValueError(f"Unknown column dtype '{dtype}'. Choose from 'str', 'float', 'int', 'datetime', 'category' or 'list'.")
+
+# Returns a copy of a table built by FrameBuilder with some of its values replaced, where updates is a dict of row
+# position -> {column: value}, and columns is the dict of column name -> dtype it was built with. Only the columns with
+# new values are rebuilt - the rest are shared with the original table.
+def replace_values(df, updates, columns):
+    df = df.copy(deep=False)
+    for column in {column for values in updates.values() for column in values}:
+        values = df[column].tolist()
+        for row, row_values in updates.items():
+            if column in row_values:
+                values[row] = row_values[column]
+        df[column] = to_series(values, columns[column]).set_axis(df.index)
+    return df
@@ -1,300 +1,46 @@
 import pandas as pd
 import streamlit as st
-from themoviedb import TMDb
-import time
+from tmdb_data import (get_genre_map, get_region_map, get_provider_map, max_discover_pages, stream_pages,
+                       top_movies_by_genre, top_tv_shows_by_genre, get_person_index, find_people, get_filmography,
+                       sort_filmography, get_title_index, suggest_titles, start_delta_sync, setting, enabled)
+from posters import COLUMN_WIDTH, FULL_SIZE, ThumbnailCache, resize_url
+from metrics import metrics
+from pathlib import Path
 from datetime import date
+import functools
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-# gets API key for TMDB (The Movie Database) from Streamlit secrets
-api_key = st.secrets["TMDB_API_KEY"] # enter this yourself in a secrets.toml file in the .streamlit folder
-
-## Initialize TMDb with the API key
-tmdb = TMDb(key=api_key, language='en-GB', region='GB')
-
-#%% Movie search function:
-
-movie_df = pd.DataFrame(columns=['Title', 'Overview'])
-
-# function to search for movies, actors and tv shows(slow: takes 5-10 seconds)
-def multi_search(search_term="Jack", search_type="multi"):
-
-    # checks search type and calls the appropriate TMDb search method
-    if search_type == "movie":
-        results = tmdb.search().movies(search_term)
-    elif search_type == "tv":
-        results = tmdb.search().tv(search_term)
-    elif search_type == "person":
-        results = tmdb.search().people(search_term)
-    elif search_type == "multi":
-        results = tmdb.search().multi(search_term)
-    else:
-        raise ValueError("Invalid search type. Choose from 'movie', 'tv', or 'person'.")
-
-    # creates empty dataframes for each type of result
-    movie_df = pd.DataFrame(columns=['Title', 'Overview'])
-    person_df = pd.DataFrame(columns=['Name', 'Biography'])
-    tv_df = pd.DataFrame(columns=['Title', 'Overview'])
-
-    # loops through results and appends to the appropriate dataframe
-    for result in results:
-        if result.media_type == "movie":
-            movie = tmdb.movie(result.id).details()
-            movie_df.loc[len(movie_df)] = [movie.title, movie.overview]
-            
-        elif result.media_type == "person":
-            person = tmdb.person(result.id).details()
-            person_df.loc[len(person_df)] = [person.name, person.biography]
-
-        elif result.media_type == "tv":
-            tv = tmdb.tv(result.id).details()
-            tv_df.loc[len(tv_df)] = [tv.title, tv.overview]
-
-    # creates dict of all results dataframes
-    results_dict = {
-        'movie': movie_df, 
-        'person': person_df,
-        'tv': tv_df
-    }
-    
-    # returns all results in a dict if search_type is 'multi', otherwise returns the specific type
-    if search_type == "multi":
-        return results_dict
-    else:
-        return results_dict[search_type]
-
-        
-# function to search for only one of movies, tv shows or actors (may be faster?)
-def single_search(search_term="Jack", search_type="movie"):
-    if search_type == "movie":
-        results = tmdb.search().movies(search_term)
-    elif search_type == "tv":
-        results = tmdb.search().tv(search_term)
-    elif search_type == "person":
-        results = tmdb.search().people(search_term)
-    else:
-        raise ValueError("Invalid search type. Choose from 'movie', 'tv', or 'person'.")
-
-
-    # Convert results to a DataFrame
-    results_df = pd.DataFrame(columns=['Title', 'Overview'])
-    for result in results:
-        if search_type == "movie":
-            movie = tmdb.movie(result.id).details()
-            results_df.loc[len(results_df)] = [movie.title, movie.overview]
-        elif search_type == "tv":
-            tv = tmdb.tv(result.id).details()
-            results_df.loc[len(results_df)] = [tv.title, tv.overview]
-        elif search_type == "person":
-            person = tmdb.person(result.id).details()
-            results_df.loc[len(results_df)] = [person.name, person.biography]
-    return results
-
-
-#%% Top movies by genre
-
-# Get and cache a list of genre IDs from TMDb and create a dict for mapping genre names to IDs
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def get_genre_map(reverse=False):
-    if reverse == False:
-        genre_map = dict((g.name, g.id) for g in tmdb.genres().movie().genres)
-    else:
-        genre_map = dict((g.id, g.name) for g in tmdb.genres().movie().genres)
-    return genre_map
-
-# Create a mapping of genre names to IDs and vice versa
-genre_name_to_id = get_genre_map()
-genre_id_to_name = get_genre_map(reverse=True)
-
-# Get and cache a dict of regions from tmdb which have watch provider data (GB: United Kingdom)
-@st.cache_data(ttl=3600) # Cache for 1 hour
-def get_region_map(reverse=False):
-    if reverse == False:
-        region_map = dict((r.native_name, r.iso_3166_1) for r in tmdb.watch_providers().regions())
-    else:
-        region_map = dict((r.iso_3166_1, r.native_name) for r in tmdb.watch_providers().regions())
-    return region_map
-
-region_name_to_id = get_region_map()
-region_id_to_name = get_region_map(reverse=True)
-
-# Get a list of watch providers for a given region and create a mapping dict
-def get_provider_map(region="GB", type="movie", display_priority=25, reverse=False): 
-    # display priority is tmdb's score for how high to display the provider, and top_n is how many providers are returned
-    if type=="movie":
-        if reverse == False:
-            provider_map = dict((p.provider_name, p.provider_id) for p in tmdb.watch_providers().movie(watch_region=region) if p.display_priority <= display_priority)
-        else:
-            provider_map = dict((p.provider_id, p.provider_name) for p in tmdb.watch_providers().movie(watch_region=region) if p.display_priority <= display_priority)
-    elif type=="tv":
-        if reverse == False:
-            provider_map = dict((p.provider_name, p.provider_id) for p in tmdb.watch_providers().tv(watch_region=region) if p.display_priority <= display_priority)
-        else:
-            provider_map = dict((p.provider_id, p.provider_name) for p in tmdb.watch_providers().tv(watch_region=region) if p.display_priority <= display_priority)
-    else:
-        return "Please pass 'movie' or 'tv' to type parameter."
-    return provider_map
-
-provider_name_to_id = get_provider_map()
-provider_id_to_name = get_provider_map(reverse=True)
-
-@st.cache_data(ttl=3600) # Cache for 1 hour - cache's where to watch for each movie.id, so if the same movie appears in a separate search, it will hit the cache rather than requiring another API call.
-def where_to_watch(tmdb_id, region='GB'):
-    providers = (tmdb.movie(tmdb_id) # searches on given tmdb id e.g. 5255
-                 .watch_providers() # gets watch providers 
-                 .results # gets dict of result 
-                 .get(region) # gets results for only given region code
-    )
-
-    # returns a list of the top 5 'flatrate' providers, where flatrate providers are subscription providers
-    try:
-        provider_names = [p.provider_name for p in providers.flatrate[:5]]
-        provider_names_string = ", ".join(provider_names) # converts to string for streamlit st.dataframe comprehension
-    except:
-        provider_names_string = ""
-
-    return(provider_names_string)
-
-    
-
-st.cache_data(ttl=3600)  # Cache for 1 hour
-def top_movies_by_genre(genre=['Action', 'Drama'], 
-                        keyword = None, # e.g. a list such as ['Christmas'] or ['Fast', 'Furious'] 
-                        people = None, # e.g. directors or actors
-                        sort_by="popularity.desc",
-                        primary_release_date__gte="1997-08-15",
-                        primary_release_date__lte="2025-12-31",
-                        vote_count__gte=10000,
-                        get_watch_providers=False, # defaults to False due to slow 20s API call
-                        watch_region = None,
-                        watch_providers = None, # e.g. 8 for netflix. 
-                        page=1
-                        ): 
-    
-    genre_ids = [str(genre_name_to_id[g]) for g in genre if g in genre_name_to_id]
-
-    # Join into a string so that it can be passed to the TMDb API in 'with_genres'
-    # join with '|' for OR and ',' for AND, i.e. whether to include films with one of the genres or exclusively films with ALL genres given
-    genre_string = "|".join(genre_ids)
-
-    progress_bar = st.progress(0, "Fetching movies...")
-        
-
-    # Fetches top movies by genre using the TMDb API for given criteria
-    results = tmdb.discover().movie(
-        sort_by=sort_by,
-        primary_release_date__gte=primary_release_date__gte,
-        primary_release_date__lte=primary_release_date__lte,
-        vote_count__gte=vote_count__gte,
-        with_genres=genre_string,
-        with_keywords=keyword,
-        with_people=people,
-        watch_region=watch_region,
-        with_watch_providers=watch_providers
-    )
+# starts timing this run of the app, so the debug panel can show where the time went
+rerun_trace = metrics.start_rerun("app")
 
-    # Create a DataFrame to store movie details
-    movie_details_df = pd.DataFrame(columns=['Poster', 'Title', 'Overview', 'Popularity', 
-                                               'Release Date', 'Vote Average',
-                                               'Vote Count', 'Genres', 'Trailer', 'Where to Watch'])
-
-    # Loop through the movies and get details
-    movie_count=1
-    for movie in results:
-        progress_bar.progress(movie_count/len(results), f"Finding where to watch ({movie_count} / {len(results)}) ...")
-        # Full details of object functions here: https://github.com/leandcesar/themoviedb/blob/7879120fb550f17741d3f8b26add27549e7ed192/themoviedb/schemas/_partial.py#L61
-        movie_details_df.loc[len(movie_details_df)] = [f"https://image.tmdb.org/t/p/w1280{movie.poster_path}", 
-                                                       movie.title,
-                                                       movie.overview, 
-                                                       movie.popularity,
-                                                       movie.release_date,
-                                                       movie.vote_average,
-                                                       movie.vote_count,
-                                                       [genre_id_to_name[g] for g in movie.genre_ids if g in genre_id_to_name],
-                                                       f"https://www.youtube.com/results?search_query={movie.title.replace(" ", "+")} trailer",
-                                                       where_to_watch(movie.id) if get_watch_providers else [] # finds where to watch for given movie.id or returns empty list
-
-        ]
-        movie_count+=1 
-
-    if get_watch_providers==False:
-        movie_details_df.drop(columns=['Where to Watch']) # drops null where to watch column if parameter is False
-
-    
-    progress_bar.progress(100, "Loading Complete")
-    time.sleep(0.2)
-    progress_bar.empty()
-
-    return movie_details_df
-
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def top_tv_shows_by_genre(genre=['Action', 'Comedy'], 
-                          sort_by="popularity.desc",
-                          primary_release_date__gte="1997-08-15",
-                          primary_release_date__lte="2025-12-31",
-                          keyword=None,
-                          vote_count__gte=10000):
-    
-    genre_ids = [str(genre_name_to_id[g]) for g in genre if g in genre_name_to_id]
-
-    # Join into a string so that it can be passed to the TMDb API in 'with_genres'
-    # join with '|' for OR and ',' for AND, i.e. whether to include films with one of the genres or exclusively films with ALL genres given
-    genre_string = "|".join(genre_ids)
-        
-
-    # Fetches top tv shows by genre using the TMDb API for given criteria
-    results = tmdb.discover().tv(
-        sort_by=sort_by,
-        first_air_date__gte=primary_release_date__gte,
-        first_air_date__lte=primary_release_date__lte,
-        with_keywords=keyword,
-        vote_count__gte=vote_count__gte,
-        with_genres=genre_string
-    )
-
-    # Create a DataFrame to store tv show details
-    tv_details_df = pd.DataFrame(columns=['Poster', 'Title', 'Overview', 'Popularity', 
-                                           'Release Date', 'Vote Average',
-                                           'Vote Count', 'Genres'])
-
-    # Loop through the tv shows and get details
-    for show in results:
-        # Full details of object functions here: https://github.com/leandcesar/themoviedb/blob/7879120fb550f17741d3f8b26add27549e7ed192/themoviedb/schemas/_partial.py#L61
-        tv_details_df.loc[len(tv_details_df)] = [f"https://image.tmdb.org/t/p/w1280{show.poster_path}", 
-                                                 show.name,
-                                                 show.overview, 
-                                                 show.popularity,
-                                                 show.first_air_date,
-                                                 show.vote_average,
-                                                 show.vote_count,
-                                                 [genre_id_to_name[g] for g in show.genre_ids if g in genre_id_to_name]
-        ]
-
-    return tv_details_df
-    
 st.set_page_config(layout="centered", # centers page content, with width set in styles.css
                    page_title="TMDb Streamlit App",
                    page_icon="🍿"
                    ) 
 
+# keeps the cached tables and where to watch up to date with changes on TMDb, in the background (once per process)
+start_delta_sync()
+
 # helper function to load CSS styles
-from pathlib import Path
 def load_css(file_name):
     with open(file_name) as f:
         st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 load_css(str(Path(__file__).parent.resolve() / "styles.css"))
 
-# initialises app with a run_id, which is appended to each widget key, and incremented each time the 'clear filter' button is pressed
-if "run_id" not in st.session_state:
-    st.session_state.run_id = 1
+# each tab has a run_id, which is appended to each of its widget keys, and incremented each time its 'clear filter' button is pressed
+def run_id(key_suffix):
+    return st.session_state.setdefault(f"run_id_{key_suffix}", 1)
 
-def clear_widgets():
-    st.session_state.run_id += 1
+def clear_widgets(key_suffix):
+    st.session_state[f"run_id_{key_suffix}"] = run_id(key_suffix) + 1
 
-# function to magically type a sentence in streamlit 
-def stream_sentence(sentence, interval=0.015):
-    sentence_array = [char for char in sentence] # splits sentence into a list of characters
-    for char in sentence_array:
-        yield char
-        time.sleep(interval)
+# heading for a tab, based on the chosen sort order
+def tab_heading(kind, sort_by):
+    sort_by_headings = {
+        "popularity.desc": f"#### Most Popular {kind} by Genre",
+        "vote_average.desc": f"#### Top Rated {kind} by Genre"
+    }
+    return sort_by_headings.get(sort_by, f"#### Top {kind} by Genre") # falls back to generic title if one not chosen
 
 st.title("TMDb Streamlit App")
 
@@ -309,24 +55,24 @@ def sort_by_widget(key_suffix):
         format_func=lambda x: sort_by_map[x], # formats the display value using the dict values
         default="popularity.desc",  # Default to Most Popular
         selection_mode="single",
-        key=f"sort_by_{key_suffix}{st.session_state["run_id"]}"  # Unique key for each tab (movie or tv)
+        key=f"sort_by_{key_suffix}{run_id(key_suffix)}"  # Unique key for each tab (movie or tv)
     )
     return sort_by
 
-def genre_selection_widget(key_suffix):
+def genre_selection_widget(key_suffix, type="movie"):
     genre_selection = st.multiselect(
         "Select Genres",
-        options=sorted(list(genre_name_to_id.keys())),
+        options=sorted(list(get_genre_map(type=type).keys())),
         # default=['Action', 'Drama'],  # Default genres
-        key=f"genre_selection_{key_suffix}{st.session_state["run_id"]}"
+        key=f"genre_selection_{key_suffix}{run_id(key_suffix)}"
     )
     return genre_selection
 
 def region_selection_widget(key_suffix):
     region_selection = st.selectbox(
         "Select Region",
-        options=["United Kingdom"] + ["United States"] + sorted(list(region_name_to_id.keys())),
-        key=f"region_selection_{key_suffix}{st.session_state["run_id"]}"
+        options=["United Kingdom"] + ["United States"] + sorted(list(get_region_map().keys())),
+        key=f"region_selection_{key_suffix}{run_id(key_suffix)}"
     )
     return region_selection
 
@@ -334,7 +80,7 @@ def provider_selection_widget(key_suffix, region):
     provider_selection = st.multiselect(
         "Select Watch Providers",
         options=list(get_provider_map(region=region))[0:25], # passes only first 26 options to selectbox
-        key=f"provider_selection_{key_suffix}{st.session_state["run_id"]}"
+        key=f"provider_selection_{key_suffix}{run_id(key_suffix)}"
     )
     return provider_selection
 
@@ -345,7 +91,7 @@ def release_year_widget(key_suffix, current_year=date.today().year):
         max_value=current_year,
         value=(2000, current_year),  # Default range
         step=1,
-        key=f"release_year_{key_suffix}{st.session_state["run_id"]}"  
+        key=f"release_year_{key_suffix}{run_id(key_suffix)}"  
     )
     return release_year
 
@@ -354,19 +100,19 @@ def advanced_options_widget(key_suffix, where_to_watch_checkbox=False):
         # keyword_search = st.text_input(
         #     "Keyword search",
         #     help="Enter keywords separated by commas (e.g. Christmas, British, Comedy)",
-        #     key=f"keyword_search_{key_suffix}{st.session_state["run_id"]}"
+        #     key=f"keyword_search_{key_suffix}{run_id(key_suffix)}"
         # )
         # people_search = st.text_input(
         #     "Cast and Crew",
         #     help="Enter the names of cast and crew separated by commas (e.g. Steven Spielberg, Leonardo DiCaprio)",
-        #     key=f"people_search_{key_suffix}{st.session_state["run_id"]}"
+        #     key=f"people_search_{key_suffix}{run_id(key_suffix)}"
         # ).split(", "),
         min_vote_count = st.number_input(
             "Minimum Vote Count",
             min_value=0,
             value=5000,  # Default value
             step=1000,
-            key=f"min_vote_count_{key_suffix}{st.session_state["run_id"]},",
+            key=f"min_vote_count_{key_suffix}{run_id(key_suffix)},",
             help=f"The minimum number of votes required on TMDB to be included in the table. Reduce this number to see less popular TV shows or movies."
         )
         if where_to_watch_checkbox:
@@ -374,8 +120,8 @@ def advanced_options_widget(key_suffix, where_to_watch_checkbox=False):
                 show_watch_providers = st.checkbox(
                     "Show watch providers", 
                     value=False,
-                    key=f"show_watch_providers_{key_suffix}{st.session_state["run_id"]}",
-                    help="Include where to watch column - this takes about 30 seconds to load."
+                    key=f"show_watch_providers_{key_suffix}{run_id(key_suffix)}",
+                    help="Include where to watch column - this takes a few seconds to load."
                 )
                 st.badge("⚠️ Experimental", color="orange")
             return {
@@ -391,19 +137,105 @@ def advanced_options_widget(key_suffix, where_to_watch_checkbox=False):
                 "min_vote_count" : min_vote_count
             }
 
+# Number of result pages to show in a table, which goes back to 1 whenever the table's filters change
+def pages_to_show(key_suffix, filters):
+    if st.session_state.get(f"pages_{key_suffix}_filters") != filters:
+        st.session_state[f"pages_{key_suffix}_filters"] = filters
+        st.session_state[f"pages_{key_suffix}"] = 1
+    return st.session_state[f"pages_{key_suffix}"]
+
+# Button to add the next page of results to a table - the page will usually already have been prefetched
+def load_more_button(key_suffix, df):
+    def load_more():
+        st.session_state[f"pages_{key_suffix}"] += 1
+    more_pages = st.session_state[f"pages_{key_suffix}"] < min(df.attrs.get("total_pages", 1), max_discover_pages())
+    st.button("Load More", icon=':material/expand_more:', key=f"load_more_{key_suffix}", on_click=load_more, disabled=not more_pages)
+
+# Local cache of downscaled poster thumbnails shared by every session, only used if POSTER_CACHE is on (in secrets.toml
+# or as an environment variable).
+# Thumbnails are kept in static/posters, which Streamlit serves because enableStaticServing is on in config.toml.
+@st.cache_resource
+def get_thumbnail_cache():
+    if not enabled("POSTER_CACHE"):
+        return None
+    return ThumbnailCache(Path(__file__).parent / "static" / "posters",
+                          max_bytes=int(setting("POSTER_CACHE_MAX_MB", 64)) * 1024 * 1024)
+
+# swaps a table's poster urls for local thumbnails, where the thumbnail cache has them
+def with_cached_posters(df):
+    thumbnails = get_thumbnail_cache()
+    if thumbnails is None or df.empty:
+        return df
+    df = df.copy()
+    df["Poster"] = df["Poster"].map(thumbnails.url, na_action="ignore")
+    return df
+
+# Shows the full size poster for the row selected in a table, so full size images are only downloaded when asked for
+def show_full_size_poster(placeholder, df, table):
+    rows = table.selection.rows
+    if not rows or rows[0] >= len(df) or pd.isna(df["Poster"].iloc[rows[0]]): # rows without a poster have <NA>
+        placeholder.empty()
+        return
+    placeholder.image(resize_url(df["Poster"].iloc[rows[0]], FULL_SIZE), caption=df["Title"].iloc[rows[0]], width=260)
+
+# When only a fragment reruns, it gets its own trace (a full rerun of the app is already covered by rerun_trace)
+def traced_fragment(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            ctx = get_script_run_ctx()
+            if ctx is None or not ctx.fragment_ids_this_run:
+                return function(*args, **kwargs)
+            trace = metrics.start_rerun(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.finish_rerun(trace)
+        return wrapper
+    return decorate
+
+# Search box above the tabs, which suggests movies, tv shows and people from the ones the app has already seen
+@st.fragment
+@traced_fragment("search box")
+def search_box():
+    query = st.selectbox(
+        "Search",
+        options=get_title_index().titles(limit=1000), # titles seen before are suggested as the user types
+        index=None,
+        accept_new_options=True,
+        placeholder="🔎 Search for a movie, tv show or person...",
+        label_visibility="collapsed",
+        key="title_search"
+    )
+    if not query:
+        return
+    suggestions = suggest_titles(query)
+    if suggestions.empty:
+        st.caption(f"Nothing found for '{query}'.")
+        return
+    st.dataframe(with_cached_posters(suggestions),
+            hide_index=True,
+            column_config = {
+                "Poster" : st.column_config.ImageColumn("", width=COLUMN_WIDTH),
+                "Name" : st.column_config.TextColumn(width=300),
+                "Type" : st.column_config.TextColumn(width=70),
+                "Year" : st.column_config.NumberColumn(width=70, format="%d"),
+                "Popularity" : st.column_config.NumberColumn(width=85, format="%.1f")
+            },
+            row_height=85
+    )
+
+search_box()
+
 movies_tab, tv_shows_tab, cast_and_crew_tab = st.tabs(['🎬 Movies', '📺 TV Shows', '👥 Cast and Crew Search'])
 
-with movies_tab:
+# Each tab is a fragment, so changing one of its widgets only reruns that tab rather than the whole app
+@st.fragment
+@traced_fragment("movies tab")
+def movies_tab_content():
 
-    # checks if sort by has been chosen, if it has, then writes the relevant title in a stream/typewriter fashion
-    if "m_sort_by" not in st.session_state:
-        st.session_state.m_sort_by =  "vote_average.desc" # initialises sort by selection if not already in session state
-    elif st.session_state["m_sort_by"] == "vote_average.desc":
-        st.write(stream_sentence(f"#### Most Popular Movies by Genre"))
-    elif st.session_state["m_sort_by"] == "popularity.desc":
-        st.write(stream_sentence(f"#### Top Rated Movies by Genre"))
-    else:
-        st.write(stream_sentence(f"#### Top Movies by Genre")) # fall back to generic title if one not chosen
+    # placeholder for the heading, which is filled in once the sort by widget has been read
+    m_heading = st.empty()
 
     col1, col2 = st.columns([0.6, 0.4])
 
@@ -414,9 +246,10 @@ with movies_tab:
         col1a, col1b = st.columns([0.28, 0.72])
         with col1a:
             m_region = region_selection_widget('m')
-            m_region_id = region_name_to_id[m_region]
+            m_region_id = get_region_map()[m_region]
         with col1b:
-            m_provider = provider_selection_widget('m', region=region_name_to_id[m_region])
+            m_provider = provider_selection_widget('m', region=m_region_id)
+            provider_name_to_id = get_provider_map(region=m_region_id)
             m_provider_id = []
             for p in m_provider:
                 m_provider_id.append(str(provider_name_to_id[p])) # adds each id as a string to a list, and then joins into a single string for tmdb searching
@@ -426,7 +259,7 @@ with movies_tab:
             
 
         m_sort_by = sort_by_widget("m")
-        st.session_state.m_sort_by = m_sort_by
+        m_heading.markdown(tab_heading("Movies", m_sort_by))
         m_release_year = release_year_widget("m")
 
         col1c, col1d = st.columns([0.75, 0.25])
@@ -437,58 +270,66 @@ with movies_tab:
             m_min_vote_count = m_advanced_options["min_vote_count"]
             m_show_watch_providers = m_advanced_options["show_watch_providers"]
         with col1d:
-            st.button("Clear All Filters", icon=':material/filter_alt_off:', key="clear_movie_filters", on_click=clear_widgets)
+            st.button("Clear All Filters", icon=':material/filter_alt_off:', key="clear_movie_filters", on_click=clear_widgets, args=("m",))
     
     with col2:
-        st.space()
-
-    # loads dataframe using data from top_movies_by_genre function, which queries TMDB API using the given filters from the widgets above
-    st.dataframe(top_movies_by_genre(genre=m_genre_selection,
-                                    sort_by=m_sort_by,
-                                    vote_count__gte=m_min_vote_count,
-                                    primary_release_date__gte=f"{m_release_year[0]}-01-01",
-                                    primary_release_date__lte=f"{m_release_year[1]}-12-31",
-                                    # keyword=m_keyword,
-                                    # people=m_people,
-                                    get_watch_providers=m_show_watch_providers,
-                                    watch_region=m_region_id,
-                                    watch_providers=m_provider_id),
-                hide_index=True,
-                height=565,
-                column_config = {
-                    "Poster" : st.column_config.ImageColumn("Movie", help = "Double-click images to enlarge.", width=53), # strict measurements to accomodate downsized movie poster (1/32 original size)
-                    "Title" : st.column_config.TextColumn(width=125),
-                    "Overview" : st.column_config.TextColumn(width=370),
-                    "Genres" : st.column_config.ListColumn(width=150),
-                    "Release Date" : st.column_config.DateColumn(width=100, format="D MMM Y"),
-                    "Popularity" : st.column_config.NumberColumn(width=85, format="%.1f", help="Popularity according to https://developer.themoviedb.org/docs/popularity-and-trending"),
-                    "Vote Average" : st.column_config.NumberColumn(label="Vote Avg.", width=85, format="%.1f"),
-                    "Vote Count" : st.column_config.NumberColumn(width=85, format="localized"),
-                    "Trailer" : st.column_config.LinkColumn(width=60, display_text="Trailer"),
-                    "Where to Watch" : st.column_config.ListColumn(help="Double click a cell to see its full contents.") if m_show_watch_providers else None
-                },
-                column_order=("Poster", "Title", "Overview", "Genres", "Release Date", "Popularity", "Vote Average", "Vote Count", "Trailer", "Where to Watch"),
-                row_height=85
-    ) 
-with tv_shows_tab:
-
-    # checks if sort by has been chosen, if it has, then writes the relevant title in a stream/typewriter fashion
-    if "t_sort_by" not in st.session_state:
-        st.session_state.t_sort_by =  "vote_average.desc" # initialises sort by selection if not already in session state
-    elif st.session_state["t_sort_by"] == "vote_average.desc":
-        st.write(stream_sentence(f"#### Most Popular TV Shows by Genre"))
-    elif st.session_state["t_sort_by"] == "popularity.desc":
-        st.write(stream_sentence(f"#### Top Rated TV Shows by Genre"))
-    else:
-        st.write(stream_sentence(f"#### Top TV Shows by Genre")) # fall back to generic title if one not chosen
+        poster = st.empty() # shows the full size poster of the selected row
+
+    # filters for the top_movies_by_genre function, which queries TMDB API using the given filters from the widgets above
+    m_filters = dict(genre=m_genre_selection,
+                     sort_by=m_sort_by,
+                     vote_count__gte=m_min_vote_count,
+                     primary_release_date__gte=f"{m_release_year[0]}-01-01",
+                     primary_release_date__lte=f"{m_release_year[1]}-12-31",
+                     # keyword=m_keyword,
+                     # people=m_people,
+                     get_watch_providers=m_show_watch_providers,
+                     watch_region=m_region_id,
+                     watch_providers=m_provider_id)
+
+    # loads dataframe one page at a time, redrawing the table as each page arrives
+    m_table = st.empty()
+    for m_df in stream_pages(top_movies_by_genre, pages=pages_to_show("m", m_filters), **m_filters):
+        with metrics.span("render_table", table="movies"):
+            m_selection = m_table.dataframe(with_cached_posters(m_df),
+                    key=f"m_table_{len(m_df)}{run_id('m')}", # one key per number of rows, as the table is redrawn as each page arrives
+                    on_select="rerun",
+                    selection_mode="single-row",
+                    hide_index=True,
+                    height=565,
+                    column_config = {
+                        "Poster" : st.column_config.ImageColumn("Movie", help = "Select a row to see its full size poster.", width=COLUMN_WIDTH), # posters are fetched at the smallest size that fits this width
+                        "Title" : st.column_config.TextColumn(width=125),
+                        "Overview" : st.column_config.TextColumn(width=370),
+                        "Genres" : st.column_config.ListColumn(width=150),
+                        "Release Date" : st.column_config.DateColumn(width=100, format="D MMM Y"),
+                        "Popularity" : st.column_config.NumberColumn(width=85, format="%.1f", help="Popularity according to https://developer.themoviedb.org/docs/popularity-and-trending"),
+                        "Vote Average" : st.column_config.NumberColumn(label="Vote Avg.", width=85, format="%.1f"),
+                        "Vote Count" : st.column_config.NumberColumn(width=85, format="localized"),
+                        "Trailer" : st.column_config.LinkColumn(width=60, display_text="Trailer"),
+                        "Where to Watch" : st.column_config.ListColumn(help="Double click a cell to see its full contents.") if m_show_watch_providers else None
+                    },
+                    column_order=("Poster", "Title", "Overview", "Genres", "Release Date", "Popularity", "Vote Average", "Vote Count", "Trailer", "Where to Watch"),
+                    row_height=85
+            ) 
+    show_full_size_poster(poster, m_df, m_selection)
+    load_more_button("m", m_df)
+
+@st.fragment
+@traced_fragment("tv shows tab")
+def tv_shows_tab_content():
+
+    # placeholder for the heading, which is filled in once the sort by widget has been read
+    t_heading = st.empty()
 
     col1, col2 = st.columns([0.6, 0.4])
 
     with col1:
 
         # loads reusable widget components defined in functions earlier, passes 'm' for tv_show to key parameter, to differentiate from tv shows filters
-        t_genre_selection = genre_selection_widget(key_suffix="t")
+        t_genre_selection = genre_selection_widget(key_suffix="t", type="tv")
         t_sort_by = sort_by_widget("t")
+        t_heading.markdown(tab_heading("TV Shows", t_sort_by))
         t_release_year = release_year_widget("t")
 
         col1a, col1b = st.columns([0.75, 0.25])
@@ -497,42 +338,124 @@ with tv_shows_tab:
             # t_keyword = t_advanced_options["keyword"]
             t_min_vote_count = t_advanced_options["min_vote_count"]
         with col1b:
-            st.button("Clear All Filters", icon=':material/filter_alt_off:', key="clear_tv_filters", on_click=clear_widgets)
+            st.button("Clear All Filters", icon=':material/filter_alt_off:', key="clear_tv_filters", on_click=clear_widgets, args=("t",))
     
     with col2:
-        st.space()
+        poster = st.empty() # shows the full size poster of the selected row
+
+
+    # filters for the top_tv_shows_by_genre function, which queries TMDB API using the given filters from the widgets above
+    t_filters = dict(genre=t_genre_selection,
+                     sort_by=t_sort_by,
+                     # keyword=t_keyword,
+                     vote_count__gte=t_min_vote_count,
+                     primary_release_date__gte=f"{t_release_year[0]}-01-01",
+                     primary_release_date__lte=f"{t_release_year[1]}-12-31")
+
+    # loads dataframe one page at a time, redrawing the table as each page arrives
+    t_table = st.empty()
+    for t_df in stream_pages(top_tv_shows_by_genre, pages=pages_to_show("t", t_filters), **t_filters):
+        with metrics.span("render_table", table="tv_shows"):
+            t_selection = t_table.dataframe(with_cached_posters(t_df),
+                    key=f"t_table_{len(t_df)}{run_id('t')}", # one key per number of rows, as the table is redrawn as each page arrives
+                    on_select="rerun",
+                    selection_mode="single-row",
+                    hide_index=True,
+                    height=565,
+                    column_config = {
+                        "Poster" : st.column_config.ImageColumn(
+                            "Show", help = "Select a row to see its full size poster.", 
+                            width=COLUMN_WIDTH # posters are fetched at the smallest size that fits this width
+                        ),
+                        "Title" : st.column_config.TextColumn(width=150),
+                        "Overview" : st.column_config.TextColumn(width=400),
+                        "Genres" : st.column_config.ListColumn(width=180),
+                        "First Aired" : st.column_config.DateColumn(width=100, format="D MMM Y"),
+                        "Popularity" : st.column_config.NumberColumn(width=100, format="%.1f"),
+                        "Vote Average" : st.column_config.NumberColumn(width=100, format="%.1f"),
+                        "Vote Count" : st.column_config.NumberColumn(width=100, format="localized") 
+                    },
+                    column_order=("Poster", "Title", "Overview", "Genres", "Release Date", "Popularity", "Vote Average", "Vote Count"),
+                    row_height=85
+            ) 
+    show_full_size_poster(poster, t_df, t_selection)
+    load_more_button("t", t_df)
+
+@st.fragment
+@traced_fragment("cast and crew tab")
+def cast_and_crew_tab_content():
+
+    # placeholder for the heading, which is filled in once the sort by widget has been read
+    p_heading = st.empty()
+
+    col1, col2 = st.columns([0.6, 0.4])
 
+    with col1:
+        # names of people seen before are suggested as the user types, and any other name is searched for on TMDb
+        p_name = st.selectbox(
+            "Search for an actor, director or writer",
+            options=get_person_index().names(limit=1000),
+            index=None,
+            accept_new_options=True,
+            placeholder="Start typing a name...",
+            key=f"person_name_p{run_id('p')}"
+        )
+        p_people = find_people(p_name) if p_name else []
+        if len(p_people) > 1:
+            p_person = st.selectbox(
+                "Did you mean",
+                options=p_people,
+                format_func=lambda person: f"{person['name']} ({person['department']})" if person['department'] else person['name'],
+                key=f"person_match_p{run_id('p')}"
+            )
+        else:
+            p_person = next(iter(p_people), None)
+
+        p_sort_by = sort_by_widget("p")
+        p_heading.markdown(f"#### {p_person['name']}'s Filmography" if p_person else "#### Search Cast and Crew")
+        st.button("Clear Search", icon=':material/filter_alt_off:', key="clear_person_search", on_click=clear_widgets, args=("p",))
 
-    # loads dataframe using data from top_tv_shows_by_genre function, which queries TMDB API using the given filters from the widgets above
-    st.dataframe(top_tv_shows_by_genre(genre=t_genre_selection,
-                                    sort_by=t_sort_by,
-                                    # keyword=t_keyword,
-                                    vote_count__gte=t_min_vote_count,
-                                    primary_release_date__gte=f"{t_release_year[0]}-01-01",
-                                    primary_release_date__lte=f"{t_release_year[1]}-12-31"),
+    with col2:
+        poster = st.empty() # shows the full size poster of the selected row
+
+    if p_name and not p_person:
+        st.info(f"No one called '{p_name}' was found on TMDb.")
+    if not p_person:
+        return
+
+    # the filmography is cached per person, so re-sorting it (or looking the same person up again) doesn't call TMDb
+    p_df = sort_filmography(get_filmography(p_person["id"]), p_sort_by)
+    with metrics.span("render_table", table="filmography"):
+        p_selection = st.dataframe(with_cached_posters(p_df),
+                key=f"p_table{run_id('p')}",
+                on_select="rerun",
+                selection_mode="single-row",
                 hide_index=True,
                 height=565,
                 column_config = {
-                    "Poster" : st.column_config.ImageColumn(
-                        "Show", help = "Double-click images to enlarge.", 
-                        width=53 # strict measurements to accomodate downsized movie poster (1/32 original size)
-                    ),
-                    "Title" : st.column_config.TextColumn(width=150),
-                    "Overview" : st.column_config.TextColumn(width=400),
-                    "Genres" : st.column_config.ListColumn(width=180),
-                    "First Aired" : st.column_config.DateColumn(width=100, format="D MMM Y"),
-                    "Popularity" : st.column_config.NumberColumn(width=100, format="%.1f"),
-                    "Vote Average" : st.column_config.NumberColumn(width=100, format="%.1f"),
-                    "Vote Count" : st.column_config.NumberColumn(width=100, format="localized") 
+                    "Poster" : st.column_config.ImageColumn("Poster", help = "Select a row to see its full size poster.", width=COLUMN_WIDTH),
+                    "Title" : st.column_config.TextColumn(width=180),
+                    "Type" : st.column_config.TextColumn(width=60),
+                    "Role" : st.column_config.TextColumn(width=180),
+                    "Genres" : st.column_config.ListColumn(width=150),
+                    "Release Date" : st.column_config.DateColumn(width=100, format="D MMM Y"),
+                    "Popularity" : st.column_config.NumberColumn(width=85, format="%.1f"),
+                    "Vote Average" : st.column_config.NumberColumn(label="Vote Avg.", width=85, format="%.1f"),
+                    "Vote Count" : st.column_config.NumberColumn(width=85, format="localized")
                 },
-                column_order=("Poster", "Title", "Overview", "Genres", "Release Date", "Popularity", "Vote Average", "Vote Count"),
+                column_order=("Poster", "Title", "Type", "Role", "Genres", "Release Date", "Popularity", "Vote Average", "Vote Count"),
                 row_height=85
-    ) 
+        )
+    show_full_size_poster(poster, p_df, p_selection)
+
+with movies_tab:
+    movies_tab_content()
+
+with tv_shows_tab:
+    tv_shows_tab_content()
 
 with cast_and_crew_tab:
-    st.warning("⚠️ Work in progress...")
-    with st.expander(label="More info:"):
-        st.text("This plan will allow users to search a given actor or director and return all of the films they they have featured in order of popularity or rating.")
+    cast_and_crew_tab_content()
 
 st.space()
 
@@ -544,4 +467,31 @@ st.image("https://www.themoviedb.org/assets/2/v4/logos/v2/blue_long_2-9665a76b1a
 
 st.caption("The lists of streaming services for each film and TV series are supplied by JustWatch. This product uses the JustWatch API but is not endorsed or certified by JustWatch. JustWatch makes it easy to find out where you can legally watch your favourite movies & TV shows online. Visit https://www.justwatch.com/ for more information.")
 
-st.image("https://www.justwatch.com/appassets/img/logo/JustWatch-logo-small.webp", width=120)
\ No newline at end of file
+st.image("https://www.justwatch.com/appassets/img/logo/JustWatch-logo-small.webp", width=120)
+
+#%% Instrumentation
+
+metrics.finish_rerun(rerun_trace)
+
+# Exports the app's metrics in Prometheus' text format, to a file after every run and/or at http://localhost:<port>/metrics
+@st.cache_resource
+def start_metrics_server(port):
+    return metrics.serve(port)
+
+if setting("METRICS_PORT"):
+    start_metrics_server(int(setting("METRICS_PORT")))
+if setting("METRICS_FILE"):
+    metrics.write_file(setting("METRICS_FILE"))
+
+# Opt-in debug panel (set DEBUG_METRICS = true in secrets.toml) showing where this run's time went. It's only turned on by
+# the setting, not from the url, since it shows every visitor's recent runs and cache stats.
+if enabled("DEBUG_METRICS"):
+    with st.expander("🛠️ Debug: performance", expanded=False):
+        st.caption(f"This run took {rerun_trace.duration * 1000:.0f} ms")
+        st.dataframe(rerun_trace.rows(), hide_index=True)
+        st.caption("Cache hit ratios since the app started")
+        st.dataframe(metrics.cache_rows(), hide_index=True)
+        st.caption("Recent runs (including tabs rerun on their own)")
+        st.dataframe([{"Run": trace.name, "Duration (ms)": round(trace.duration * 1000, 1),
+                       "Started": pd.Timestamp(trace.started_at, unit="s").strftime("%H:%M:%S")}
+                      for trace in reversed(metrics.traces)], hide_index=True)
@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+from files import write_json
+from metrics import metrics
+
+# Genre, region and watch provider lists from TMDb, each fetched once and then used for both
+# name -> id and id -> name lookups. Lists are only fetched the first time they're needed, and are kept
+# per (region, type), so switching back to a region that's already been seen doesn't need another call.
+#
+# If snapshot_path is given, every fetched list is also written to that file, and read back when the registry is
+# created - so after a restart the app can start from the lists saved on the previous run instead of waiting on TMDb.
+# Lists older than max_age (in seconds) are fetched again on their next use - or, with a refresher (see refresher.py),
+# the most used lists are fetched again in the background before they get that old, and a list that's expired is still
+# served while it's fetched again.
+class MetadataRegistry:
+    def __init__(self, tmdb, snapshot_path=None, max_age=3600, refresher=None):
+        self.tmdb = tmdb
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.max_age = max_age
+        self.refresher = refresher
+        self.lists = {} # key -> (fetched_at, list of rows)
+        self.lock = threading.Lock()
+        self.load_snapshot()
+
+    # returns a dict of genre name -> id, or id -> name if reverse is True
+    def genres(self, type="movie", reverse=False):
+        check_type(type)
+        rows = self.get(f"genres/{type}", lambda: [(g.id, g.name) for g in getattr(self.tmdb.genres(), type)().genres])
+        return lookup(rows, reverse)
+
+    # returns a dict of region name -> ISO 3166-1 code (e.g. United Kingdom -> GB), or code -> name if reverse is True
+    def regions(self, reverse=False):
+        rows = self.get("regions", lambda: [(r.iso_3166_1, r.native_name) for r in self.tmdb.watch_providers().regions()])
+        return lookup(rows, reverse)
+
+    # returns a dict of provider name -> id, or id -> name if reverse is True, for providers in the given region
+    # with a display priority of display_priority or better (lower is better)
+    def providers(self, region="GB", type="movie", display_priority=25, reverse=False):
+        check_type(type)
+        rows = self.get(f"providers/{region}/{type}",
+                        lambda: [(p.provider_id, p.provider_name, p.display_priority)
+                                 for p in getattr(self.tmdb.watch_providers(), type)(watch_region=region)])
+        return lookup([(id, name) for id, name, priority in rows if priority is not None and priority <= display_priority], reverse)
+
+    # returns the list saved under key, fetching it first if it hasn't been fetched yet or is older than max_age
+    def get(self, key, fetch):
+        with self.lock:
+            entry = self.lists.get(key)
+        if entry is not None and self.servable(entry[0] + self.max_age):
+            metrics.count("cache_requests", function=f"metadata:{key.split('/')[0]}", result="hit")
+            rows, expires_at = entry[1], entry[0] + self.max_age
+        else:
+            metrics.count("cache_requests", function=f"metadata:{key.split('/')[0]}", result="miss")
+            rows, expires_at = self.fetch(key, fetch), time.time() + self.max_age
+        if self.refresher is not None:
+            self.refresher.seen("metadata", key, expires_at, lambda: self.refresh(key, fetch))
+        return rows
+
+    # whether a list that expires (or expired) at expires_at can be served without fetching it first
+    def servable(self, expires_at):
+        return expires_at > time.time() or (self.refresher is not None and self.refresher.servable(expires_at))
+
+    def fetch(self, key, fetch):
+        with metrics.span("metadata_fetch", list=key.split('/')[0]):
+            rows = [list(row) for row in fetch()]
+        with self.lock:
+            self.lists[key] = (time.time(), rows)
+        self.save_snapshot()
+        return rows
+
+    # fetches a list again for the refresher, returning when the new copy expires
+    def refresh(self, key, fetch):
+        self.fetch(key, fetch)
+        return time.time() + self.max_age
+
+    def load_snapshot(self):
+        if self.snapshot_path is None or not self.snapshot_path.exists():
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            self.lists = {key: (entry["fetched_at"], entry["rows"]) for key, entry in snapshot.items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            self.lists = {} # ignores a missing or corrupt snapshot and fetches everything again
+
+    def save_snapshot(self):
+        if self.snapshot_path is None:
+            return
+        with self.lock:
+            snapshot = {key: {"fetched_at": fetched_at, "rows": rows} for key, (fetched_at, rows) in self.lists.items()}
+        write_json(self.snapshot_path, snapshot)
+
+
+def check_type(type):
+    if type not in ("movie", "tv"):
+        raise ValueError("Invalid type. Choose from 'movie' or 'tv'.")
+
+# builds a name -> id dict from (id, name) rows, or id -> name if reverse is True
+def lookup(rows, reverse=False):
+    if reverse:
+        return {row[0]: row[1] for row in rows}
+    else:
+        return {row[1]: row[0] for row in rows}
@@ -0,0 +1,213 @@
+import contextvars
+import functools
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from files import replace_file
+
+# Timings and counters for the app, used to find where a slow page load goes:
+#   - span(name) times a block of code, e.g. a TMDb request, a data function or drawing a table
+#   - count(name) counts events, e.g. cache hits and misses
+#   - every span and count is also added to the trace of the current rerun (see start_rerun), which the
+#     debug panel shows as a per-rerun breakdown
+# Totals can be exported in Prometheus' text format, to a file (write_file) or over HTTP (serve).
+
+# upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+# Total time, count and latency histogram for one span name and set of labels
+class Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+
+# The spans and counts recorded during one rerun of the app (or of one fragment)
+class RerunTrace:
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.finished_at = None
+        self.timings = defaultdict(Timing) # span name -> Timing
+        self.counts = defaultdict(int) # counter name -> count
+        self.lock = threading.Lock()
+
+    @property
+    def duration(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    # rows for the debug panel, slowest spans first
+    def rows(self):
+        with self.lock:
+            timings = sorted(self.timings.items(), key=lambda item: -item[1].total)
+            return [{"Span": name, "Calls": timing.count, "Total (ms)": round(timing.total * 1000, 1),
+                     "Max (ms)": round(timing.max * 1000, 1)} for name, timing in timings]
+
+
+class Metrics:
+    def __init__(self, max_traces=50):
+        self.timings = defaultdict(Timing) # (name, labels) -> Timing
+        self.counters = defaultdict(int) # (name, labels) -> count
+        self.traces = deque(maxlen=max_traces) # most recent reruns, newest last
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        with self.lock:
+            self.timings[(name, label_key(labels))].add(seconds)
+        trace = current_trace.get()
+        if trace is not None:
+            with trace.lock:
+                trace.timings[format_name(name, labels)].add(seconds)
+
+    def count(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[(name, label_key(labels))] += amount
+        trace = current_trace.get()
+        if trace is not None:
+            with trace.lock:
+                trace.counts[format_name(name, labels)] += amount
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # decorator which times every call to a function
+    def timed(self, name=None):
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name or function.__name__):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    # Decorators for counting hits and misses on a cached function: track_cache goes on top of the cache decorator
+    # and counts every call, and on_miss goes underneath it, so it only runs (and counts a miss) when the cache misses.
+    def track_cache(self, name):
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                misses = miss_count.set(0)
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.count("cache_requests", function=name, result="miss" if miss_count.get() else "hit")
+                    miss_count.reset(misses)
+            return wrapper
+        return decorate
+
+    def on_miss(self, name):
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                miss_count.set(miss_count.get() + 1)
+                return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    # starts a new trace, which every span and count in this thread is added to until the next one starts
+    def start_rerun(self, name="app"):
+        trace = RerunTrace(name)
+        current_trace.set(trace)
+        with self.lock:
+            self.traces.append(trace)
+        return trace
+
+    def finish_rerun(self, trace):
+        trace.finished_at = time.time()
+        self.observe("rerun", trace.duration, run=trace.name)
+
+    # hit ratio of every cache that's been tracked, as rows for the debug panel
+    def cache_rows(self):
+        with self.lock:
+            counts = defaultdict(lambda: {"hit": 0, "miss": 0})
+            for (name, labels), value in self.counters.items():
+                labels = dict(labels)
+                if name == "cache_requests":
+                    counts[labels["function"]][labels["result"]] += value
+        return [{"Cache": cache, "Hits": c["hit"], "Misses": c["miss"],
+                 "Hit Ratio": round(c["hit"] / (c["hit"] + c["miss"]), 3) if c["hit"] + c["miss"] else None}
+                for cache, c in sorted(counts.items())]
+
+    # all totals in Prometheus' text exposition format
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            timings = list(self.timings.items())
+            counters = list(self.counters.items())
+        for (name, labels), timing in sorted(timings):
+            metric = f"tmdb_app_{name}_seconds"
+            for bound, bucket in zip(BUCKETS, timing.buckets): # buckets are already cumulative, as Prometheus expects
+                lines.append(f"{metric}_bucket{format_labels(labels + (('le', str(bound)),))} {bucket}")
+            lines.append(f"{metric}_bucket{format_labels(labels + (('le', '+Inf'),))} {timing.count}")
+            lines.append(f"{metric}_sum{format_labels(labels)} {timing.total}")
+            lines.append(f"{metric}_count{format_labels(labels)} {timing.count}")
+        for (name, labels), value in sorted(counters):
+            lines.append(f"tmdb_app_{name}_total{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        text = self.prometheus_text()
+        replace_file(path, lambda temp_path: temp_path.write_text(text))
+
+    # serves the totals at http://<host>:<port>/metrics from a background thread, for Prometheus to scrape
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+        return server
+
+
+# the trace spans and counts are added to, and the number of cache misses in the current tracked call
+current_trace = contextvars.ContextVar("current_trace", default=None)
+miss_count = contextvars.ContextVar("miss_count", default=0)
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+def format_name(name, labels):
+    return name + "".join(f" [{value}]" for _, value in sorted(labels.items()))
+
+
+# metrics for the whole process, shared by every session
+metrics = Metrics()
@@ -0,0 +1,74 @@
+import bisect
+import heapq
+import threading
+import unicodedata
+from itertools import islice, takewhile
+
+
+# Index of the people the app has already seen (e.g. in search results), used to look names up as they're typed
+# without calling TMDb. Every word of a name is indexed in a sorted list, so a prefix of any word matches -
+# e.g. "spiel" finds Steven Spielberg, and "st sp" narrows it down to people with both words.
+class PersonIndex:
+    def __init__(self):
+        self.people = {} # person id -> {"id", "name", "popularity", "department"}
+        self.keys = [] # sorted (word, person id) pairs
+        self.version = 0 # changes whenever a person's name or popularity does, so names() knows to rebuild its list
+        self.options = (None, None, []) # (version, limit, names) of the last names() list
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.people)
+
+    def add(self, person_id, name, popularity=None, department=None):
+        if person_id is None or not name:
+            return
+        with self.lock:
+            known = self.people.get(person_id)
+            if known is None or known["name"] != name or known["popularity"] != (popularity or 0.0):
+                self.version += 1
+            if known is None or known["name"] != name:
+                if known is not None:
+                    self.keys = [key for key in self.keys if key[1] != person_id] # the person's name has changed
+                for word in set(words(name)):
+                    bisect.insort(self.keys, (word, person_id))
+            self.people[person_id] = {"id": person_id, "name": name, "popularity": popularity or 0.0,
+                                      "department": department or (known or {}).get("department")}
+
+    # returns up to limit people with a word starting with each word of the query, most popular first
+    def search(self, query, limit=10):
+        query_words = words(query)
+        if not query_words:
+            return []
+        with self.lock:
+            matches = None
+            for word in query_words:
+                start = bisect.bisect_left(self.keys, (word,))
+                keys = takewhile(lambda key: key[0].startswith(word), islice(self.keys, start, None))
+                ids = {person_id for _, person_id in keys}
+                matches = ids if matches is None else matches & ids
+            people = [self.people[person_id] for person_id in matches]
+        return sorted(people, key=lambda person: -person["popularity"])[:limit]
+
+    # Names of everyone in the index, most popular first (e.g. as options for a search box). The list is kept until the
+    # index changes, as it's asked for on every rerun.
+    def names(self, limit=None):
+        with self.lock:
+            version, cached_limit, names = self.options
+            if version == self.version and cached_limit == limit:
+                return names
+            people = self.people.values()
+            people = heapq.nlargest(limit, people, key=lambda person: person["popularity"]) if limit else \
+                     sorted(people, key=lambda person: -person["popularity"])
+            names = list(dict.fromkeys(person["name"] for person in people))
+            self.options = (self.version, limit, names)
+        return names
+
+
+# splits a name into lower case words without accents, so "Zoë" can be found by typing "zoe"
+def words(text):
+    text = text or ""
+    if not text.isascii(): # plain ASCII (most titles) has no accents to strip
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    text = text.lower()
+    return ["".join(c for c in word if c.isalnum()) for word in text.split() if any(c.isalnum() for c in word)]
+
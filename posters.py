@@ -0,0 +1,111 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import requests
+from PIL import Image
+
+from files import replace_file
+
+# TMDb serves posters at a fixed set of widths (https://developer.themoviedb.org/docs/image-basics), so tables
+# use the smallest one that's still sharp at the width posters are shown at, rather than a full-size image per row.
+IMAGE_BASE_URL = "https://image.tmdb.org/t/p/"
+POSTER_WIDTHS = (92, 154, 185, 342, 500, 780)
+
+COLUMN_WIDTH = 53 # width (in px) of the poster column in the movie and tv show tables
+PIXEL_RATIO = 2 # so posters are still sharp on high resolution screens
+FULL_SIZE = "w780" # size shown when a poster is enlarged
+PROFILE_SIZE = "w185" # smallest profile picture size that's still sharp in the poster column (the others are w45, h632 and original)
+
+
+# Returns the smallest TMDb poster size (e.g. "w154") at least width * pixel_ratio pixels wide
+def poster_size(width, pixel_ratio=PIXEL_RATIO):
+    for poster_width in POSTER_WIDTHS:
+        if poster_width >= width * pixel_ratio:
+            return f"w{poster_width}"
+    return "original"
+
+THUMBNAIL_SIZE = poster_size(COLUMN_WIDTH)
+
+# Returns the url of a poster at the given size, or None if the movie or show doesn't have a poster
+def poster_url(poster_path, size=None):
+    if not poster_path:
+        return None
+    return f"{IMAGE_BASE_URL}{size or THUMBNAIL_SIZE}{poster_path}"
+
+# Returns the url of a person's profile picture small enough for a table - profile pictures come in different sizes to posters
+def profile_url(profile_path):
+    return poster_url(profile_path, PROFILE_SIZE)
+
+# Returns the url of the same poster at a different size, e.g. the full size version of a thumbnail
+def resize_url(url, size):
+    if not url or not url.startswith(IMAGE_BASE_URL):
+        return url
+    return poster_url("/" + url.rsplit("/", 1)[-1], size)
+
+
+# Keeps downscaled copies of posters in a local folder served by Streamlit's static file serving (see config.toml),
+# so each poster is only downloaded from TMDb once and then shared by every session, including after a restart.
+# Posters are downloaded in the background the first time they're seen, and their TMDb url is used until then.
+# When the folder goes over max_bytes, the least recently used thumbnails are deleted.
+class ThumbnailCache:
+    def __init__(self, directory, url_prefix="app/static/posters", width=COLUMN_WIDTH * PIXEL_RATIO,
+                 max_bytes=64 * 1024 * 1024, max_workers=4):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.url_prefix = url_prefix
+        self.width = width
+        self.max_bytes = max_bytes
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnails")
+        self.pending = set() # file names being downloaded
+        self.lock = threading.Lock()
+
+        # file name -> size, least recently used first (after a restart, thumbnails downloaded longest ago come first)
+        self.files = OrderedDict()
+        thumbnails = [file for file in self.directory.iterdir() if file.suffix != ".tmp"]
+        for file in sorted(thumbnails, key=lambda file: file.stat().st_mtime):
+            self.files[file.name] = file.stat().st_size
+        self.total_bytes = sum(self.files.values())
+
+    # returns the local url of a poster's thumbnail if it's been cached, or its TMDb url (and starts caching it) if not
+    def url(self, tmdb_url):
+        if not tmdb_url or not tmdb_url.startswith(IMAGE_BASE_URL):
+            return tmdb_url
+        name = tmdb_url.rsplit("/", 1)[-1]
+        with self.lock:
+            if name in self.files:
+                self.files.move_to_end(name)
+                return f"{self.url_prefix}/{name}"
+            if name not in self.pending:
+                self.pending.add(name)
+                self.executor.submit(self.download, tmdb_url, name)
+        return tmdb_url
+
+    def download(self, tmdb_url, name):
+        try:
+            response = self.session.get(tmdb_url, timeout=10)
+            response.raise_for_status()
+            image = Image.open(BytesIO(response.content)).convert("RGB")
+            image.thumbnail((self.width, self.width * 3)) # keeps the aspect ratio, so only the width matters
+            path = self.directory / name
+            replace_file(path, lambda temp_path: image.save(temp_path, format="JPEG", quality=85, optimize=True))
+            size = path.stat().st_size
+            with self.lock:
+                self.total_bytes += size - self.files.get(name, 0)
+                self.files[name] = size
+                self.evict()
+        except (requests.RequestException, OSError):
+            pass # keeps using the TMDb url, and tries again the next time the poster is shown
+        finally:
+            with self.lock:
+                self.pending.discard(name)
+
+    # deletes the least recently used thumbnails until the folder fits in max_bytes
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.files:
+            name, size = self.files.popitem(last=False)
+            (self.directory / name).unlink(missing_ok=True)
+            self.total_bytes -= size
@@ -0,0 +1,46 @@
+import concurrent.futures
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Fetches pages of results in the background before they're asked for, e.g. page N+1 of a discover query
+# while the user is still looking at page N. Pages are keyed by (query key, page number), and get() picks up a
+# page that's already been prefetched (or is still in flight) rather than requesting it again.
+# Only the most recent max_entries prefetched pages are kept, and only for ttl seconds after they were prefetched, so a
+# page nobody asked for in time is fetched again rather than served older than the results it's shown with.
+class PagePrefetcher:
+    def __init__(self, max_workers=2, max_entries=64, ttl=3600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.pages = OrderedDict() # (key, page) -> (when it was prefetched, future)
+        self.lock = threading.Lock()
+
+    # returns the given page, using a prefetched copy if there is one, or calling fetch(page) if not
+    def get(self, key, page, fetch):
+        with self.lock:
+            prefetched_at, future = self.pages.pop((key, page), (None, None))
+        if future is not None and time.time() - prefetched_at < self.ttl:
+            try:
+                return future.result()
+            except Exception:
+                pass # the prefetch failed, so try again in the foreground
+        return fetch(page)
+
+    # waits for every page being prefetched to arrive (e.g. so a benchmark counts their requests)
+    def wait(self):
+        with self.lock:
+            futures = [future for _, future in self.pages.values()]
+        concurrent.futures.wait(futures)
+
+    # starts fetching the given page in the background, unless it's already been prefetched
+    def prefetch(self, key, page, fetch):
+        with self.lock:
+            prefetched_at, _ = self.pages.get((key, page), (None, None))
+            if prefetched_at is not None and time.time() - prefetched_at < self.ttl:
+                return
+            self.pages.pop((key, page), None) # so a page prefetched again goes to the back of the queue
+            self.pages[(key, page)] = (time.time(), self.executor.submit(fetch, page))
+            while len(self.pages) > self.max_entries:
+                self.pages.popitem(last=False)
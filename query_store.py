@@ -0,0 +1,225 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from result_cache import value_bytes
+
+PAGE_SIZE = 20 # rows per TMDb discover page
+
+# the filters which can be narrowed locally - any other filter has to match exactly for a stored result to be reused
+GENRE_PARAM = "genre"
+VOTE_COUNT_PARAM = "vote_count__gte"
+DATE_GTE_PARAM = "primary_release_date__gte"
+DATE_LTE_PARAM = "primary_release_date__lte"
+SORT_PARAM = "sort_by"
+REFINABLE_PARAMS = {GENRE_PARAM, VOTE_COUNT_PARAM, DATE_GTE_PARAM, DATE_LTE_PARAM, SORT_PARAM}
+
+# table column to sort on for each sort_by option
+SORT_COLUMNS = {"popularity.desc": "Popularity", "vote_average.desc": "Vote Average", "vote_count.desc": "Vote Count"}
+
+
+# Puts filters into one standard form, so the same query always looks the same - e.g. genres in any order
+# (or repeated) become the same sorted list
+def canonicalize(filters):
+    canonical = dict(filters)
+    if canonical.get(GENRE_PARAM) is not None:
+        canonical[GENRE_PARAM] = sorted(set(canonical[GENRE_PARAM]))
+    if canonical.get(VOTE_COUNT_PARAM) is not None:
+        canonical[VOTE_COUNT_PARAM] = int(canonical[VOTE_COUNT_PARAM])
+    for param in (DATE_GTE_PARAM, DATE_LTE_PARAM):
+        if canonical.get(param) is not None:
+            canonical[param] = pd.Timestamp(canonical[param]).date().isoformat()
+    return canonical
+
+def query_key(filters):
+    return tuple(sorted((key, tuple(value) if isinstance(value, list) else value) for key, value in filters.items()))
+
+
+# The pages of one query fetched so far
+class StoredResult:
+    def __init__(self, filters):
+        self.filters = filters
+        self.pages = {}
+        self.fetched_at = {} # page -> when its rows were fetched from TMDb (or last checked against its changes)
+        self.total_pages = None
+        self.size = 0 # bytes used by the pages
+
+    # rows from the pages fetched so far, as long as they're pages 1, 2, 3 ... with no gaps
+    def rows(self):
+        frames = []
+        for page in range(1, len(self.pages) + 1):
+            if page not in self.pages:
+                break
+            frames.append(self.pages[page])
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+    # whether every page of the query has been fetched, i.e. the rows are every title matching the filters
+    def complete(self):
+        return self.total_pages is not None and all(page in self.pages for page in range(1, self.total_pages + 1))
+
+
+# Keeps the results of recent discover queries, and answers new queries from them when it can rather than calling
+# TMDb again. A stored result can answer a new query if the new one is narrower - e.g. a subset of its genres, a higher
+# minimum vote count or a narrower date range - with the same sort order and otherwise identical filters.
+#
+# Filtering the top rows of a broader query gives the top rows of the narrower one in the same order (anything
+# the broader query hasn't fetched yet ranks below all of them), so a page can be answered as long as enough rows
+# are left after filtering. If every page of the broader query has been fetched, it can also be re-sorted.
+# Results are evicted least recently used first once their pages take up more than max_bytes, and pages expire ttl
+# seconds after their rows were fetched, so they're never served (or narrowed) for longer than the tables they came from.
+class QueryStore:
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.results = OrderedDict() # (function name, query key) -> StoredResult
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def remember(self, name, filters, page, df):
+        key = (name, query_key(filters))
+        with self.lock:
+            result = self.results.get(key) or StoredResult(filters)
+            self.total_bytes -= result.size
+            result.pages[page] = df
+            result.fetched_at[page] = fetched_at(df)
+            result.size = sum(value_bytes(page_df) for page_df in result.pages.values())
+            result.total_pages = df.attrs.get("total_pages", result.total_pages)
+            self.results[key] = result
+            self.total_bytes += result.size
+            self.results.move_to_end(key)
+            # evicts the least recently used results (but never the one just stored) until the store fits in max_bytes
+            while self.total_bytes > self.max_bytes and len(self.results) > 1:
+                _, evicted = self.results.popitem(last=False)
+                self.total_bytes -= evicted.size
+
+    # Replaces a page of a query with a newer copy (e.g. from a background refresh), if it's stored
+    def replace(self, name, filters, page, df):
+        with self.lock:
+            result = self.results.get((name, query_key(filters)))
+            if result is None or page not in result.pages:
+                return
+            result.pages[page] = df
+            result.fetched_at[page] = fetched_at(df)
+            result.total_pages = df.attrs.get("total_pages", result.total_pages)
+            self.total_bytes -= result.size
+            result.size = sum(value_bytes(page_df) for page_df in result.pages.values())
+            self.total_bytes += result.size
+
+    # Replaces stored pages of a function's results (e.g. with some rows updated): update(filters, df) returns a new
+    # page, or None to keep the page as it is
+    def update(self, name, update):
+        with self.lock:
+            results = [result for (result_name, _), result in self.results.items() if result_name == name]
+        for result in results:
+            for page, df in list(result.pages.items()):
+                new_df = update(result.filters, df)
+                if new_df is None:
+                    continue
+                with self.lock:
+                    result.pages[page] = new_df
+                    self.total_bytes -= result.size
+                    result.size = sum(value_bytes(page_df) for page_df in result.pages.values())
+                    self.total_bytes += result.size
+
+    # returns the given page for the query from a stored result, or None if no stored result can answer it
+    def answer(self, name, filters, page):
+        with self.lock:
+            self.expire(name)
+            exact_key = (name, query_key(filters))
+            exact = self.results.get(exact_key)
+            if exact is not None and page in exact.pages:
+                self.results.move_to_end(exact_key)
+                return exact.pages[page]
+            candidates = [(key, result) for key, result in reversed(self.results.items()) if key[0] == name]
+
+        for key, result in candidates:
+            if not covers(result, filters):
+                continue
+            rows = result.rows()
+            if rows is None:
+                continue
+            refined = refine(rows, filters, resort=result.filters.get(SORT_PARAM) != filters.get(SORT_PARAM))
+            if len(refined) >= page * PAGE_SIZE or result.complete():
+                page_df = refined.iloc[(page - 1) * PAGE_SIZE:page * PAGE_SIZE].reset_index(drop=True)
+                page_df.attrs = dict(rows.attrs)
+                page_df.attrs["total_pages"] = refined_total_pages(result, rows, refined)
+                with self.lock:
+                    if key in self.results:
+                        self.results.move_to_end(key)
+                return page_df
+        return None
+
+    # drops a function's pages which have expired, and any results left with no pages
+    def expire(self, name):
+        now = time.time()
+        for key, result in list(self.results.items()):
+            if key[0] != name:
+                continue
+            expired = [page for page, page_fetched_at in result.fetched_at.items() if now - page_fetched_at >= self.ttl]
+            if not expired:
+                continue
+            for page in expired:
+                del result.pages[page], result.fetched_at[page]
+            self.total_bytes -= result.size
+            result.size = sum(value_bytes(page_df) for page_df in result.pages.values())
+            self.total_bytes += result.size
+            if not result.pages:
+                del self.results[key]
+
+
+# when a page's rows were fetched, or last found to be unchanged on TMDb (see tmdb_data.sync_changes)
+def fetched_at(df):
+    return df.attrs.get("synced_at", time.time())
+
+
+# The number of pages of a refined query. It's only known exactly if the stored result had every matching title -
+# otherwise it's estimated from the share of the stored rows that matched, applied to all of the stored query's pages
+# (and is corrected by TMDb's own count once a page past the refined rows is fetched).
+def refined_total_pages(result, rows, refined):
+    known_pages = max(1, math.ceil(len(refined) / PAGE_SIZE))
+    if result.complete() or not result.total_pages:
+        return known_pages
+    return max(known_pages, math.ceil(result.total_pages * len(refined) / len(rows)))
+
+# whether the stored result's query includes every title the new query could return
+def covers(result, filters):
+    stored = result.filters
+    for key in set(stored) | set(filters):
+        if key not in REFINABLE_PARAMS and stored.get(key) != filters.get(key):
+            return False
+
+    stored_genres, genres = stored.get(GENRE_PARAM) or [], filters.get(GENRE_PARAM) or []
+    if stored_genres and (not genres or not set(genres) <= set(stored_genres)):
+        return False
+    if (filters.get(VOTE_COUNT_PARAM) or 0) < (stored.get(VOTE_COUNT_PARAM) or 0):
+        return False
+    if stored.get(DATE_GTE_PARAM) and (not filters.get(DATE_GTE_PARAM) or filters[DATE_GTE_PARAM] < stored[DATE_GTE_PARAM]):
+        return False
+    if stored.get(DATE_LTE_PARAM) and (not filters.get(DATE_LTE_PARAM) or filters[DATE_LTE_PARAM] > stored[DATE_LTE_PARAM]):
+        return False
+
+    # a different sort order needs every matching title, and a sort column the table has
+    if stored.get(SORT_PARAM) != filters.get(SORT_PARAM):
+        return result.complete() and filters.get(SORT_PARAM) in SORT_COLUMNS
+    return True
+
+# filters (and if resort is True, re-sorts) a table of results down to the rows matching the given filters
+def refine(df, filters, resort=False):
+    mask = pd.Series(True, index=df.index)
+    if filters.get(GENRE_PARAM):
+        genres = df["Genres"].explode()
+        mask &= genres.isin(filters[GENRE_PARAM]).groupby(level=0).any().reindex(df.index, fill_value=False)
+    if filters.get(VOTE_COUNT_PARAM) is not None:
+        mask &= df["Vote Count"].fillna(0) >= filters[VOTE_COUNT_PARAM]
+    if filters.get(DATE_GTE_PARAM):
+        mask &= df["Release Date"] >= pd.Timestamp(filters[DATE_GTE_PARAM])
+    if filters.get(DATE_LTE_PARAM):
+        mask &= df["Release Date"] <= pd.Timestamp(filters[DATE_LTE_PARAM])
+
+    refined = df[mask.to_numpy()]
+    if resort:
+        refined = refined.sort_values(SORT_COLUMNS[filters[SORT_PARAM]], ascending=False, kind="stable")
+    return refined.reset_index(drop=True)
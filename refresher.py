@@ -0,0 +1,123 @@
+import contextlib
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+# Keeps the most requested cached values fresh, so users don't wait on a cold fetch when they expire
+# (stale-while-revalidate). Caches tell the refresher every time they serve a value, with when it expires and a
+# function that refreshes it (and returns when the new value expires):
+#   - values that are still fresh are tracked, scored by how often they're asked for. Every interval seconds, the top_k
+#     most popular values that expire within lead seconds are refreshed in the background, before anyone sees them expire.
+#   - values that have already expired are refreshed in the background straight away, and the cache serves its stale
+#     copy meanwhile - as long as it expired less than max_stale seconds ago (see servable).
+# Scores halve every half_life seconds, so values that were popular once but aren't any more stop being refreshed.
+#
+# Refreshes run at most max_concurrent at a time, whichever cache they're for, and scheduled refreshes are only
+# started while can_start() returns True (e.g. while the rate limiter has room to spare), so they don't hold up
+# requests from live users. Each refresh runs inside refresh_context() (e.g. one that makes it skip a lower cache, so the
+# value it gets is actually new).
+class BackgroundRefresher:
+    def __init__(self, max_concurrent=2, lead=300, top_k=50, interval=30, half_life=3600, max_stale=1800,
+                 can_start=None, refresh_context=contextlib.nullcontext):
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="refresh")
+        self.lead = lead
+        self.top_k = top_k
+        self.interval = interval
+        self.half_life = half_life
+        self.max_stale = max_stale
+        self.can_start = can_start
+        self.refresh_context = refresh_context
+        self.entries = {} # (cache, key) -> [score, expires_at, refresh]
+        self.running = set() # (cache, key) of the values being refreshed
+        self.lock = threading.Lock()
+        self.thread = None
+
+    # whether a value that expires (or expired) at expires_at can still be served while it's refreshed
+    def servable(self, expires_at):
+        return time.time() < expires_at + self.max_stale
+
+    # called by a cache every time it serves a value: tracks the value if it's still fresh, or starts refreshing it
+    # if it's expired (and the cache is serving its stale copy)
+    def seen(self, cache, key, expires_at, refresh):
+        if expires_at > time.time():
+            self.track(cache, key, expires_at, refresh)
+        else:
+            metrics.count("stale_served", cache=cache)
+            self.refresh_now(cache, key, refresh)
+
+    # records a request for a value, which expires at expires_at and is refreshed by calling refresh()
+    def track(self, cache, key, expires_at, refresh):
+        with self.lock:
+            entry = self.entries.get((cache, key))
+            if entry is None:
+                self.entries[(cache, key)] = [1.0, expires_at, refresh]
+            else:
+                entry[0] += 1
+                entry[1] = expires_at
+                entry[2] = refresh
+        self.start()
+
+    # moves a tracked value's expiry back, e.g. once it's been checked and is still current, so it isn't refreshed early
+    def postpone(self, cache, key, expires_at):
+        with self.lock:
+            entry = self.entries.get((cache, key))
+            if entry is not None:
+                entry[1] = max(entry[1], expires_at)
+
+    # refreshes a value in the background as soon as there's a free slot, unless it's already being refreshed
+    def refresh_now(self, cache, key, refresh):
+        with self.lock:
+            if (cache, key) in self.running:
+                return
+            self.running.add((cache, key))
+        self.executor.submit(self.run, cache, key, refresh)
+
+    def run(self, cache, key, refresh):
+        try:
+            with metrics.span("background_refresh", cache=cache), self.refresh_context():
+                expires_at = refresh()
+            metrics.count("background_refreshes", cache=cache, result="ok")
+            with self.lock:
+                entry = self.entries.get((cache, key))
+                if entry is not None and expires_at is not None:
+                    entry[1] = expires_at
+        except Exception:
+            metrics.count("background_refreshes", cache=cache, result="error") # tried again on the next tick or request
+        finally:
+            with self.lock:
+                self.running.discard((cache, key))
+
+    # starts the scheduler thread, the first time a value is tracked
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, daemon=True, name="refresh-scheduler")
+                self.thread.start()
+
+    def loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.tick()
+
+    # refreshes the most popular values that are about to expire, and forgets the ones nobody's asked for in a while
+    def tick(self):
+        now = time.time()
+        decay = 0.5 ** (self.interval / self.half_life)
+        with self.lock:
+            for name, entry in list(self.entries.items()):
+                entry[0] *= decay
+                if entry[0] < 0.1 and entry[1] + self.max_stale < now:
+                    del self.entries[name]
+            popular = heapq.nlargest(self.top_k, self.entries.items(), key=lambda item: item[1][0])
+            due = [(name, entry[2]) for name, entry in popular
+                   if entry[1] - now < self.lead and name not in self.running]
+        for (cache, key), refresh in due:
+            if self.can_start is not None and not self.can_start():
+                metrics.count("background_refreshes_deferred")
+                return # live users are using the rate limit, so waits for the next tick
+            self.refresh_now(cache, key, refresh)
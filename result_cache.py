@@ -0,0 +1,141 @@
+import inspect
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from metrics import metrics
+
+# In-memory cache of the data functions' results (mostly DataFrames), shared by every session. It's used in place of
+# st.cache_data so its memory can be capped: once the entries add up to more than max_bytes, the least recently used
+# ones are evicted. Sizes are measured in bytes (with pandas' deep memory usage for tables) rather than counted as
+# entries, as one result can be a hundred times the size of another. Entries also expire ttl seconds after they're
+# added, as with st.cache_data(ttl=...) - or, for calls made with a refresher (see refresher.py), they're refreshed in
+# the background, and an expired entry is still served for a while after it expires, while it's being refreshed.
+class ResultCache:
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> (expires_at, size, value, kept_until), least recently used first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Returns function(*args, **kwargs), from the cache if it's been called with the same arguments before.
+    # on_refresh(function, args, kwargs, value) is called with each new value a background refresh gets, e.g. to update
+    # other copies of it.
+    def call(self, function, args, kwargs, ttl=None, refresher=None, on_refresh=None):
+        key = (function.__module__, function.__qualname__, call_key(function, args, kwargs))
+
+        def refresh():
+            value = function(*args, **kwargs)
+            if on_refresh is not None:
+                on_refresh(function, args, kwargs, value)
+            return self.put(key, value, ttl, refresher)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            servable = entry is not None and (entry[0] > time.time() or (refresher is not None and refresher.servable(entry[0])))
+            if servable:
+                self.entries.move_to_end(key)
+        if servable:
+            if refresher is not None:
+                refresher.seen(f"results:{function.__name__}", key, entry[0], refresh)
+            return shallow_copy(entry[2])
+
+        value = function(*args, **kwargs)
+        expires_at = self.put(key, value, ttl, refresher)
+        if refresher is not None:
+            refresher.track(f"results:{function.__name__}", key, expires_at, refresh)
+        return shallow_copy(value)
+
+    # adds a value, returning when it expires. With a refresher, it's kept for its max_stale after that.
+    def put(self, key, value, ttl=None, refresher=None):
+        expires_at = time.time() + ttl if ttl else float("inf")
+        size = value_bytes(value)
+        if size > self.max_bytes:
+            return expires_at # would push everything else out
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self.entries[key] = (expires_at, size, value, expires_at + (refresher.max_stale if refresher else 0))
+            self.total_bytes += size
+            self.evict()
+        return expires_at
+
+    # every cached result of a function
+    def values(self, function):
+        with self.lock:
+            return [entry[2] for key, entry in self.entries.items() if key[:2] == (function.__module__, function.__qualname__)]
+
+    # Replaces cached results of a function (e.g. with some rows updated), keeping each one's place in the LRU order.
+    # For each of the function's entries, update(key, value, expires_at) returns a new (value, expires_at), or None to
+    # leave the entry as it is. Returns the (key, expires_at) of the entries replaced.
+    def update(self, function, update):
+        with self.lock:
+            entries = [(key, entry) for key, entry in self.entries.items() if key[:2] == (function.__module__, function.__qualname__)]
+        updated = []
+        for key, (expires_at, _, value, kept_until) in entries:
+            result = update(key, value, expires_at)
+            if result is None:
+                continue
+            new_value, new_expires_at = result
+            size = value_bytes(new_value)
+            with self.lock:
+                old = self.entries.get(key)
+                if old is None or old[2] is not value:
+                    continue # evicted or replaced meanwhile
+                self.entries[key] = (new_expires_at, size, new_value, kept_until - expires_at + new_expires_at)
+                self.total_bytes += size - old[1]
+            updated.append((key, new_expires_at))
+        return updated
+
+    # removes expired entries (once they can't be served stale either), then the least recently used ones until the
+    # cache fits in max_bytes
+    def evict(self):
+        now = time.time()
+        for key in [key for key, (_, _, _, kept_until) in self.entries.items() if kept_until <= now]:
+            self.total_bytes -= self.entries.pop(key)[1]
+        while self.total_bytes > self.max_bytes and self.entries:
+            _, (_, size, _, _) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            metrics.count("cache_evictions", cache="results")
+
+
+# A hashable key for a call's arguments, with defaults filled in so f(1) and f(x=1) are the same call
+def call_key(function, args, kwargs):
+    try:
+        bound = inspect.signature(function).bind(*args, **kwargs)
+        bound.apply_defaults()
+        return freeze(bound.arguments)
+    except TypeError: # e.g. a builtin without a signature
+        return freeze((args, kwargs))
+
+def freeze(value):
+    if isinstance(value, dict):
+        return tuple((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return tuple(freeze(item) for item in (sorted(value) if isinstance(value, set) else value))
+    return value
+
+# Approximate memory used by a cached value, in bytes
+def value_bytes(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(index=True, deep=True)
+        return int(usage.sum() if isinstance(value, pd.DataFrame) else usage)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(value_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_bytes(key) + value_bytes(item) for key, item in value.items())
+    return sys.getsizeof(value)
+
+# a copy of a cached table for a caller to use, so adding or replacing its columns doesn't change the cached one.
+# It shares the same column data, so it doesn't cost any memory.
+def shallow_copy(value):
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=False)
+    return value
@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fake_tmdb import FakeTMDb
+
+
+# fake TMDb server (see fake_tmdb.py) shared by every test
+@pytest.fixture(scope="session")
+def fake_tmdb():
+    fake = FakeTMDb().start()
+    yield fake
+    fake.stop()
+
+
+# tmdb_data set up against the fake server, with its caches in a temporary folder. Its shared resources are created
+# once per process, so every test using it shares them.
+@pytest.fixture(scope="session")
+def tmdb_data(fake_tmdb, tmp_path_factory):
+    from export import quiet_streamlit
+    quiet_streamlit()
+    import tmdb_data
+    cache_path = tmp_path_factory.mktemp("cache")
+    tmdb_data.configure(TMDB_API_KEY="test",
+                        TMDB_URL=fake_tmdb.url,
+                        TMDB_CACHE_PATH=str(cache_path / "tmdb_cache.sqlite"),
+                        METADATA_SNAPSHOT_PATH=str(cache_path / "metadata_snapshot.json"),
+                        AVAILABILITY_PATH=str(cache_path / "availability.json"),
+                        DELTA_SYNC_PATH=str(cache_path / "delta_sync.json"))
+    return tmdb_data
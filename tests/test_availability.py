@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+from availability import AvailabilityMatrix
+
+NETFLIX = SimpleNamespace(provider_id=8, provider_name="Netflix", display_priority=1)
+MUBI = SimpleNamespace(provider_id=11, provider_name="MUBI", display_priority=5)
+
+
+def on(*providers, region="GB"):
+    return {region: SimpleNamespace(flatrate=list(providers))}
+
+
+# two processes saving to the same file keep each other's movies, and the most recently checked copy of the ones they share
+def test_save_merges_other_processes_movies(tmp_path):
+    path = tmp_path / "availability.json"
+    app = AvailabilityMatrix(path=path)
+    worker = AvailabilityMatrix(path=path)
+
+    app.add(1, on(NETFLIX), fetched_at=1000.0)
+    app.add(2, on(NETFLIX), fetched_at=1000.0)
+    app.save()
+    worker.add(3, on(MUBI), fetched_at=2000.0)
+    worker.add(2, on(MUBI), fetched_at=2000.0) # checked after the app's copy
+    worker.save()
+    app.add(4, on(NETFLIX, MUBI, region="US"), fetched_at=3000.0)
+    app.save()
+
+    for matrix in (app, AvailabilityMatrix(path=path)):
+        assert sorted(matrix.ids) == [1, 2, 3, 4]
+        assert matrix.titles("GB", [8]) == {1}
+        assert matrix.titles("GB", [11]) == {2, 3}
+        assert matrix.where_to_watch(4, "US") == ["Netflix", "MUBI"]
+        assert matrix.expires_at(2) == 2000.0 + matrix.max_age
@@ -0,0 +1,40 @@
+import pandas as pd
+import pyarrow as pa
+
+from frame_builder import FrameBuilder, replace_values
+
+COLUMNS = {"Title": "str", "Popularity": "float", "Vote Count": "int", "Release Date": "datetime",
+           "Genres": "list", "Where to Watch": "list"}
+
+
+def build():
+    rows = FrameBuilder(COLUMNS)
+    rows.append(["Heat", 51.2, 7000, "1995-12-15", ["Action", "Crime"], ["Netflix"]])
+    rows.append(["Up", 40.0, None, "not a date", [], []])
+    return rows.to_frame()
+
+
+# tables have to convert to Arrow and back unchanged, as Parquet and Streamlit's dataframes do
+def test_arrow_round_trip():
+    df = build()
+    round_tripped = pa.Table.from_pandas(df).to_pandas(types_mapper=pd.ArrowDtype)
+    assert round_tripped["Genres"].tolist() == df["Genres"].tolist()
+    assert pa.Table.from_pandas(df).to_pandas()["Genres"].map(list).tolist() == [["Action", "Crime"], []]
+
+
+def test_parquet_round_trip(tmp_path):
+    df = build()
+    df.to_parquet(tmp_path / "table.parquet")
+    read = pd.read_parquet(tmp_path / "table.parquet")
+    assert read["Title"].tolist() == ["Heat", "Up"]
+    assert read["Where to Watch"].map(list).tolist() == [["Netflix"], []]
+    assert read["Vote Count"].isna().tolist() == [False, True]
+
+
+def test_replace_values_keeps_dtypes():
+    df = build()
+    replaced = replace_values(df, {1: {"Title": "Up (2009)", "Genres": ["Animation"]}}, COLUMNS)
+    assert replaced["Title"].tolist() == ["Heat", "Up (2009)"]
+    assert replaced["Genres"].tolist()[1] == ["Animation"]
+    assert replaced.dtypes.equals(df.dtypes)
+    assert df["Title"].tolist() == ["Heat", "Up"]
@@ -0,0 +1,105 @@
+import pandas as pd
+import pytest
+
+import query_store
+from query_store import PAGE_SIZE, QueryStore, StoredResult, refined_total_pages
+from result_cache import value_bytes
+
+BROAD = {"genre": ["Action", "Comedy"], "vote_count__gte": 0, "sort_by": "popularity.desc"}
+ACTION = {"genre": ["Action"], "vote_count__gte": 0, "sort_by": "popularity.desc"}
+
+
+# a page of discover results, alternating Action and Comedy titles in order of popularity
+def make_page(page, total_pages, fetched_at=1000.0):
+    rows = range((page - 1) * PAGE_SIZE, page * PAGE_SIZE)
+    df = pd.DataFrame({"Title": [f"Title {row}" for row in rows],
+                       "Popularity": [1000.0 - row for row in rows],
+                       "Vote Count": [row * 10 for row in rows],
+                       "Release Date": pd.to_datetime(["2020-01-01"] * PAGE_SIZE),
+                       "Genres": [["Action"] if row % 2 == 0 else ["Comedy"] for row in rows]})
+    df.attrs = {"total_pages": total_pages, "fetched_at": fetched_at, "synced_at": fetched_at}
+    return df
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_store.time, "time", lambda: now[0])
+    return now
+
+
+def test_answers_narrower_query_from_broader_one(clock):
+    store = QueryStore()
+    for page in (1, 2):
+        store.remember("top", BROAD, page, make_page(page, total_pages=2))
+
+    df = store.answer("top", ACTION, 1)
+    assert len(df) == PAGE_SIZE
+    assert all(genres == ["Action"] for genres in df["Genres"])
+    assert df["Popularity"].is_monotonic_decreasing
+    assert df.attrs["total_pages"] == 1 # every title was stored, so the count is exact
+    assert store.answer("top", {**ACTION, "vote_count__gte": 100}, 1)["Vote Count"].min() >= 100
+
+
+def test_doesnt_answer_broader_or_different_queries(clock):
+    store = QueryStore()
+    store.remember("top", ACTION, 1, make_page(1, total_pages=5))
+    assert store.answer("top", BROAD, 1) is None
+    assert store.answer("top", {**ACTION, "keyword": "heist"}, 1) is None
+    assert store.answer("other", ACTION, 1) is None
+    # not every title is stored, so it can't be re-sorted
+    assert store.answer("top", {**ACTION, "sort_by": "vote_count.desc"}, 1) is None
+
+
+def test_refined_total_pages_estimated_from_match_ratio(clock):
+    store = QueryStore()
+    for page in (1, 2):
+        store.remember("top", BROAD, page, make_page(page, total_pages=10))
+    # half of the 40 stored rows are Action titles, so about half of the 10 pages would be
+    assert store.answer("top", ACTION, 1).attrs["total_pages"] == 5
+
+    result = StoredResult(BROAD)
+    rows = pd.concat([make_page(1, 10), make_page(2, 10)], ignore_index=True)
+    result.total_pages = 10
+    assert refined_total_pages(result, rows, rows.iloc[:2]) == 1
+    result.pages = {1: make_page(1, 2), 2: make_page(2, 2)}
+    result.total_pages = 2
+    assert refined_total_pages(result, rows, rows.iloc[:30]) == 2 # complete, so counted from the refined rows
+
+
+def test_pages_expire_after_ttl(clock):
+    store = QueryStore(ttl=3600)
+    for page in (1, 2):
+        store.remember("top", BROAD, page, make_page(page, total_pages=2))
+    assert store.answer("top", BROAD, 1) is not None
+
+    clock[0] += 3600
+    assert store.answer("top", BROAD, 1) is None
+    assert store.answer("top", ACTION, 1) is None
+    assert not store.results and store.total_bytes == 0
+
+
+def test_replace_updates_stored_page(clock):
+    store = QueryStore(ttl=3600)
+    store.remember("top", BROAD, 1, make_page(1, total_pages=2))
+    clock[0] += 3000
+    refreshed = make_page(1, total_pages=2, fetched_at=clock[0])
+    refreshed.loc[0, "Title"] = "Refreshed"
+    store.replace("top", BROAD, 1, refreshed)
+    store.replace("top", ACTION, 1, refreshed) # isn't stored, so nothing to replace
+
+    clock[0] += 1000 # past when the old copy would have expired
+    assert store.answer("top", BROAD, 1)["Title"][0] == "Refreshed"
+    assert list(store.results) == [("top", query_store.query_key(BROAD))]
+
+
+def test_answers_count_as_use_for_eviction(clock):
+    page_bytes = value_bytes(make_page(1, total_pages=1))
+    store = QueryStore(max_bytes=int(page_bytes * 2.5))
+    store.remember("top", ACTION, 1, make_page(1, total_pages=1))
+    store.remember("top", {**ACTION, "vote_count__gte": 5000}, 1, make_page(1, total_pages=1))
+    assert store.answer("top", ACTION, 1) is not None
+
+    store.remember("top", {**ACTION, "keyword": "heist"}, 1, make_page(1, total_pages=1))
+    assert store.answer("top", ACTION, 1) is not None
+    assert ("top", query_store.query_key({**ACTION, "vote_count__gte": 5000})) not in store.results
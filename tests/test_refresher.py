@@ -0,0 +1,53 @@
+
+
+# the refresher's entry for a cached result of the given function, called with the given arguments
+def refresh_entry(refresher, cache, **arguments):
+    return next((cache_name, key, entry[2]) for (cache_name, key), entry in refresher.entries.items()
+                if cache_name == cache and arguments.items() <= dict(key[2]).items())
+
+def retitle(fake_tmdb, title, new_title):
+    for movie in fake_tmdb.catalog.movies.values():
+        if movie["title"] == title:
+            movie["title"] = new_title
+
+
+# a background refresh has to get the results from TMDb again, not the cached responses the old ones were built from
+def test_refresh_fetches_from_server(tmdb_data, fake_tmdb):
+    df = tmdb_data.top_movies_by_genre(genre=["Comedy"], vote_count__gte=0)
+    retitle(fake_tmdb, df["Title"].iloc[0], "Retitled")
+    requests_before = fake_tmdb.stats["endpoints"].get("discover/movie", 0)
+
+    refresher = tmdb_data.get_refresher()
+    cache, key, refresh = refresh_entry(refresher, "results:top_movies_by_genre", genre=("Comedy",))
+    refresher.run(cache, key, refresh)
+
+    assert fake_tmdb.stats["endpoints"]["discover/movie"] > requests_before
+    refreshed = tmdb_data.top_movies_by_genre(genre=["Comedy"], vote_count__gte=0)
+    assert refreshed["Title"].iloc[0] == "Retitled"
+
+
+# tables are shown through the query store, so a refresh has to replace its copy of the page too
+def test_refresh_reaches_query_page(tmdb_data, fake_tmdb):
+    filters = {"genre": ["Drama"], "vote_count__gte": 0}
+    df = tmdb_data.query_page(tmdb_data.top_movies_by_genre, page=1, **filters)
+    retitle(fake_tmdb, df["Title"].iloc[0], "Refreshed")
+
+    refresher = tmdb_data.get_refresher()
+    refresher.run(*refresh_entry(refresher, "results:top_movies_by_genre", genre=("Drama",)))
+
+    assert tmdb_data.query_page(tmdb_data.top_movies_by_genre, page=1, **filters)["Title"].iloc[0] == "Refreshed"
+
+
+# requests outside a refresh are still answered from the response cache
+def test_requests_outside_refresh_use_cache(tmdb_data, fake_tmdb):
+    session = tmdb_data.get_tmdb_session()
+    url = f"{fake_tmdb.url}/3/genre/movie/list"
+    session.get(url, params={"api_key": "test"})
+    requests_before = fake_tmdb.stats["requests"]
+    assert session.get(url, params={"api_key": "test"}).from_cache
+    assert fake_tmdb.stats["requests"] == requests_before
+
+    from tmdb_cache import fresh_responses
+    with fresh_responses():
+        assert not getattr(session.get(url, params={"api_key": "test"}), "from_cache", False)
+    assert fake_tmdb.stats["requests"] == requests_before + 1
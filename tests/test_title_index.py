@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+from themoviedb.schemas import MediaType
+
+from title_index import TitleIndex
+
+
+def build():
+    index = TitleIndex()
+    index.add("movie", 155, "The Dark Knight", popularity=90.0, year=2008)
+    index.add("movie", 238, "The Godfather", popularity=80.0, year=1972)
+    index.add("movie", 49026, "The Dark Knight Rises", popularity=70.0, year=2012)
+    index.add("tv", 1399, "Game of Thrones", popularity=95.0, year=2011)
+    index.add("person", 3894, "Christian Bale", popularity=30.0)
+    return index
+
+def titles(suggestions):
+    return [suggestion["title"] for suggestion in suggestions]
+
+
+# a query matches from the start of any word in a title, most popular first
+def test_prefix_suggestions():
+    index = build()
+    assert titles(index.search("dark kn")) == ["The Dark Knight", "The Dark Knight Rises"]
+    assert titles(index.search("knight ri")) == ["The Dark Knight Rises"]
+    assert titles(index.search("God")) == ["The Godfather"]
+    assert index.search("god")[0]["score"] == 1.0
+    assert index.search("knight xyz") == []
+
+
+# a word with a typo is swapped for the most similar known word
+def test_trigram_suggestions():
+    index = build()
+    suggestions = index.search("godfahter")
+    assert titles(suggestions) == ["The Godfather"]
+    assert 0 < suggestions[0]["score"] < 1
+    assert titles(index.search("dark knigt")) == ["The Dark Knight", "The Dark Knight Rises"]
+
+
+# search and credits results say what they are with a MediaType enum rather than a plain string
+def test_indexes_results_by_media_type():
+    index = TitleIndex()
+    index.add_result(SimpleNamespace(media_type=MediaType.movie, id=603, title="The Matrix", popularity=50.0,
+                                     release_date="1999-03-30", poster_path="/matrix.jpg"))
+    index.add_result(SimpleNamespace(media_type=MediaType.person, id=6384, name="Keanu Reeves", popularity=40.0,
+                                     profile_path="/keanu.jpg"))
+    index.add_result(SimpleNamespace(media_type="tv", id=1396, name="Breaking Bad", popularity=60.0,
+                                     first_air_date="2008-01-20"))
+    assert index.search("matrix")[0] == {"kind": "movie", "id": 603, "title": "The Matrix", "popularity": 50.0,
+                                         "year": 1999, "poster_path": "/matrix.jpg", "score": 1.0}
+    assert index.search("keanu")[0]["kind"] == "person"
+    assert index.search("breaking")[0]["year"] == 2008
+
+
+# when a title's popularity changes, it moves up or down the suggestions
+def test_popularity_change_reranks():
+    index = build()
+    index.add("movie", 49026, "The Dark Knight Rises", popularity=99.0)
+    assert titles(index.search("dark")) == ["The Dark Knight Rises", "The Dark Knight"]
+    index.add("movie", 49026, "The Dark Knight Rises", popularity=10.0)
+    assert titles(index.search("dark")) == ["The Dark Knight", "The Dark Knight Rises"]
+    assert index.search("dark")[1]["popularity"] == 10.0
+
+    index = TitleIndex(top_k=2)
+    for id, popularity in ((1, 30.0), (2, 20.0), (3, 10.0)):
+        index.add("movie", id, f"Night {id}", popularity=popularity)
+    index.add("movie", 3, "Night 3", popularity=40.0)
+    assert titles(index.search("night")) == ["Night 3", "Night 1"]
+
+
+# titles from multi search and from filmographies are added to the index, so the same search is answered locally next time
+def test_search_and_credit_results_are_indexed(tmdb_data):
+    index = tmdb_data.get_title_index()
+    results = tmdb_data.multi_search("Night")
+    assert len(results["movie"]) and len(results["tv"])
+    found = {suggestion["title"] for suggestion in index.search("Night", limit=50)}
+    for df in (results["movie"], results["tv"]):
+        assert found >= {title for title in df["Title"][:5] if "night" in title.lower().split()}
+
+    people = tmdb_data.multi_search("Jack", search_type="person")
+    person = index.search(people["Name"][0])[0]
+    assert person["kind"] == "person"
+    filmography = tmdb_data.get_filmography(person["id"])
+    assert {(suggestion["title"], suggestion["kind"]) for suggestion in index.search(filmography["Title"][0])} \
+        >= {(filmography["Title"][0], "movie" if filmography["Type"][0] == "Movie" else "tv")}
+    assert tmdb_data.suggest_titles("Nig")["Name"].str.contains("Night").all()
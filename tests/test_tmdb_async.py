@@ -0,0 +1,80 @@
+import pytest
+from themoviedb.routes_async._base import Base as AsyncBase
+
+from fake_tmdb import FakeTMDb
+from tmdb_async import AsyncTMDb, AsyncTMDbSession, TMDbHTTPError
+from tmdb_cache import SQLiteCache
+from tmdb_client import RateLimiter
+
+
+# an AsyncTMDb client against its own fake server, started with the given options (e.g. latency or a rate limit)
+@pytest.fixture
+def connect(monkeypatch):
+    clients, servers = [], []
+
+    def connect(cache=None, pool_size=20, max_retries=3, **server_options):
+        fake = FakeTMDb(**server_options).start()
+        servers.append(fake)
+        monkeypatch.setattr(AsyncBase, "TMDB_URL", fake.url)
+        session = AsyncTMDbSession(cache=cache, limiter=RateLimiter(rate=1000, burst=1000), pool_size=pool_size,
+                                   max_retries=max_retries, backoff=0.01)
+        client = AsyncTMDb("test", session=session)
+        clients.append(client)
+        return client, fake
+
+    yield connect
+    for client in clients:
+        client.close()
+    for fake in servers:
+        fake.stop()
+
+
+def test_batch_details(connect):
+    client, fake = connect()
+    results = client.details_many("movie", [100, 101, 102, 100])
+    assert sorted(results) == [100, 101, 102]
+    assert results[101].title == fake.catalog.movies[101]["title"]
+    assert fake.stats["endpoints"]["movie/{id}"] == 3
+
+
+# 429s are retried after TMDb's Retry-After, so every request gets through in the end
+def test_retries_rate_limited_requests(connect):
+    client, fake = connect(rate_limit=5, burst=5)
+    results = client.details_many("movie", range(100, 110))
+    assert not [result for result in results.values() if isinstance(result, Exception)]
+    assert fake.stats["throttled"] > 0
+
+
+# a response that's still an error after every retry raises, after max_retries + 1 attempts
+def test_gives_up_after_max_retries(connect):
+    client, fake = connect(max_retries=2)
+    fake.fixtures.responses["/3/movie/100?"] = (503, {"status_message": "Service unavailable"})
+    with pytest.raises(TMDbHTTPError) as error:
+        client.run(client.session.request("GET", f"{fake.url}/3/movie/100", {"api_key": "test"}))
+    assert error.value.status == 503
+    assert fake.stats["endpoints"]["movie/{id}"] == 3
+
+
+# identical requests made at the same time share one call
+def test_coalesces_identical_requests(connect):
+    client, fake = connect(latency=0.2)
+    results = client.run(client.gather(lambda _: client.client.movie(100).details(), range(10)))
+    assert {result.id for result in results.values()} == {100}
+    assert fake.stats["endpoints"]["movie/{id}"] == 1
+
+
+# no more than pool_size requests are in flight at once
+def test_limits_requests_in_flight(connect):
+    client, fake = connect(pool_size=3, latency=0.05)
+    client.details_many("movie", range(100, 115))
+    assert fake.stats["endpoints"]["movie/{id}"] == 15
+    assert fake.stats["max_in_flight"] == 3
+
+
+# responses come from the response cache once they've been fetched
+def test_serves_cached_responses(connect, tmp_path):
+    client, fake = connect(cache=SQLiteCache(tmp_path / "cache.sqlite"))
+    first = client.sync.movie(100).details()
+    second = client.sync.movie(100).details()
+    assert first.title == second.title
+    assert fake.stats["endpoints"]["movie/{id}"] == 1
@@ -0,0 +1,243 @@
+import bisect
+import gzip
+import heapq
+import json
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from people import words
+
+# Local index of movie, tv show and person names for the search box, built up from every record the app fetches
+# (and optionally seeded from a local catalog or TMDb's daily id exports), so most searches never go to TMDb.
+#   - a prefix trie over each title from every word on, so "dark kn" and "knight" both find The Dark Knight.
+#     Each trie node keeps its best (most popular) entries, so a lookup is just a walk down the prefix. It's a
+#     compressed (radix) trie - runs of characters with only one way on share an edge and a node - as a node per
+#     character costs hundreds of MB for 100k titles.
+#   - a trigram index over every word in the index, for fuzzy matches - each word of a query with a typo (e.g.
+#     "godfahter") is swapped for the most similar known word, and the corrected query is looked up in the trie
+# Suggestions have a score from 0 to 1, where prefix matches score 1 and fuzzy matches score their trigram similarity.
+
+TOP_K = 20 # entries kept at each trie node
+GOOD_MATCH = 0.4 # suggestions scoring at least this are good enough to skip searching TMDb
+MAX_POSTINGS = 5000 # trigrams in more words than this are too common to help fuzzy matching, so are skipped
+KINDS = {"movie": "Movie", "tv": "TV", "person": "Person"}
+
+
+class TrieNode:
+    __slots__ = ("children", "top")
+
+    def __init__(self, top=None):
+        self.children = {} # first character of an edge -> (the edge's text, the node it leads to)
+        self.top = top or [] # (-popularity, key) of the best entries under this node, best first
+
+
+class TitleIndex:
+    def __init__(self, top_k=TOP_K):
+        self.top_k = top_k
+        self.entries = {} # (kind, id) -> {"kind", "id", "title", "popularity", "year", "poster_path"}
+        self.trie = TrieNode()
+        self.vocabulary = {} # every word in the index -> its number of distinct trigrams
+        self.trigrams = defaultdict(set) # trigram -> words containing it
+        self.version = 0 # changes whenever an entry's title or popularity does, so titles() knows to rebuild its list
+        self.options = (None, None, []) # (version, limit, titles) of the last titles() list
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, kind, id, title, popularity=None, year=None, poster_path=None):
+        if id is None or not title or kind not in KINDS:
+            return
+        key = (kind, id)
+        popularity = popularity or 0.0
+        with self.lock:
+            known = self.entries.get(key)
+            if known is None or known["title"] != title or known["popularity"] != popularity:
+                self.version += 1
+            self.entries[key] = {"kind": kind, "id": id, "title": title, "popularity": popularity,
+                                 "year": year or (known or {}).get("year"),
+                                 "poster_path": poster_path or (known or {}).get("poster_path")}
+            title_words = words(title)
+            if known is not None and known["title"] == title:
+                # already indexed, but if its popularity has changed it moves up or down each node's best entries
+                if known["popularity"] != popularity:
+                    for start in range(len(title_words)):
+                        self.rerank(" ".join(title_words[start:]), (-known["popularity"], key), (-popularity, key))
+                return
+            for start in range(len(title_words)):
+                self.insert(" ".join(title_words[start:]), (-popularity, key))
+            for word in title_words:
+                if word not in self.vocabulary:
+                    word_trigrams = trigrams(word)
+                    self.vocabulary[word] = len(word_trigrams)
+                    for trigram in word_trigrams:
+                        self.trigrams[trigram].add(word)
+
+    # adds a TMDb result (a movie, tv show or person from search, discover or credits results), or a catalog record.
+    # The kind is the result's media_type if not given, which is a MediaType enum in search and credits results.
+    def add_result(self, result, kind=None):
+        media_type = getattr(result, "media_type", None)
+        kind = kind or getattr(media_type, "value", media_type)
+        release = getattr(result, "release_date", None) or getattr(result, "first_air_date", None)
+        self.add(kind, getattr(result, "id", None),
+                 getattr(result, "title", None) or getattr(result, "name", None),
+                 popularity=getattr(result, "popularity", None),
+                 year=year_of(release),
+                 poster_path=getattr(result, "poster_path", None) or getattr(result, "profile_path", None))
+
+    def add_results(self, results, kind=None):
+        for result in results:
+            self.add_result(result, kind)
+
+    def insert(self, text, item):
+        node = self.trie
+        while text:
+            edge = node.children.get(text[0])
+            if edge is None:
+                child = TrieNode()
+                node.children[text[0]] = (text, child)
+                self.add_top(child, item)
+                return
+            label, child = edge
+            common = len(label) if text.startswith(label) else common_prefix_length(label, text)
+            if common < len(label): # text leaves the edge part way along, so it's split in two there
+                middle = TrieNode(top=list(child.top))
+                middle.children[label[common]] = (label[common:], child)
+                node.children[text[0]] = (label[:common], middle)
+                child = middle
+            self.add_top(child, item)
+            node, text = child, text[common:]
+
+    def add_top(self, node, item):
+        if (len(node.top) < self.top_k or item < node.top[-1]) and item not in node.top:
+            bisect.insort(node.top, item)
+            del node.top[self.top_k:]
+
+    # Swaps an entry's old item for its new one (with its new popularity) in the best entries of every node on the path
+    # to text, which has already been inserted. An entry that drops down a full list stays in it, in its new place,
+    # as the entries that were pushed out of it before aren't kept.
+    def rerank(self, text, old_item, new_item):
+        node = self.trie
+        while text:
+            label, node = node.children[text[0]]
+            if old_item in node.top:
+                node.top.remove(old_item)
+            self.add_top(node, new_item)
+            text = text[len(label):]
+
+    # returns up to limit suggestions for a search box query, best first
+    def search(self, query, limit=8):
+        query_words = words(query)
+        if not query_words:
+            return []
+        with self.lock:
+            scores = {key: 1.0 for _, key in self.prefix_matches(" ".join(query_words))}
+            if len(scores) < limit:
+                fuzzy = self.fuzzy_matches(query_words)
+                for key in sorted(fuzzy, key=fuzzy.get, reverse=True)[:limit]:
+                    scores.setdefault(key, fuzzy[key])
+            suggestions = [{**self.entries[key], "score": round(score, 3)} for key, score in scores.items()]
+
+        exact = " ".join(query_words)
+        suggestions.sort(key=lambda s: (-s["score"], " ".join(words(s["title"])) != exact, -s["popularity"]))
+        return suggestions[:limit]
+
+    def prefix_matches(self, text):
+        node = self.trie
+        while text:
+            edge = node.children.get(text[0])
+            if edge is None:
+                return []
+            label, node = edge
+            if not (label.startswith(text) or text.startswith(label)):
+                return []
+            text = text[len(label):] # empty once text ends on (or part way along) this edge
+        return node.top
+
+    # entries matching the query once each word is swapped for its closest known word, all scored by the average
+    # similarity of the swapped words
+    def fuzzy_matches(self, query_words):
+        corrected, scores = [], []
+        for word in query_words:
+            match = self.closest_word(word)
+            if match is None:
+                return {}
+            corrected.append(match[0])
+            scores.append(match[1])
+        score = sum(scores) / len(scores)
+        return {key: score for _, key in self.prefix_matches(" ".join(corrected))}
+
+    # the known word most similar to word (sharing the most trigrams, out of all trigrams of both), and its similarity
+    def closest_word(self, word, min_score=0.3):
+        if word in self.vocabulary:
+            return word, 1.0
+        word_trigrams = trigrams(word)
+        shared = defaultdict(int)
+        for trigram in word_trigrams:
+            known_words = self.trigrams.get(trigram, ())
+            if len(known_words) > MAX_POSTINGS:
+                continue
+            for known_word in known_words:
+                shared[known_word] += 1
+        best = max(shared, default=None, key=lambda known_word: shared[known_word] / (len(word_trigrams) + self.vocabulary[known_word] - shared[known_word]))
+        if best is None:
+            return None
+        score = shared[best] / (len(word_trigrams) + self.vocabulary[best] - shared[best])
+        return (best, score) if score >= min_score else None
+
+    # The most popular titles in the index, e.g. as options for a search box. The list is kept until the index changes,
+    # as it's asked for on every rerun.
+    def titles(self, limit=None):
+        with self.lock:
+            version, cached_limit, titles = self.options
+            if version == self.version and cached_limit == limit:
+                return titles
+            entries = self.entries.values()
+            entries = heapq.nlargest(limit, entries, key=lambda entry: entry["popularity"]) if limit else \
+                      sorted(entries, key=lambda entry: -entry["popularity"])
+            titles = list(dict.fromkeys(entry["title"] for entry in entries))
+            self.options = (self.version, limit, titles)
+        return titles
+
+    # Adds every entry from one of TMDb's daily id exports (https://developer.themoviedb.org/docs/daily-id-exports),
+    # e.g. movie_ids_05_15_2024.json.gz, with at least min_popularity. kind is worked out from the file name if not given.
+    def seed_from_export(self, path, kind=None, min_popularity=0.0):
+        path = Path(path)
+        kind = kind or ("tv" if path.name.startswith("tv_") else "person" if path.name.startswith("person_") else "movie")
+        with (gzip.open(path, "rt") if path.suffix == ".gz" else open(path)) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("adult") or (record.get("popularity") or 0) < min_popularity:
+                    continue
+                self.add(kind, record.get("id"),
+                         record.get("original_title") or record.get("original_name") or record.get("name"),
+                         popularity=record.get("popularity"))
+
+    # adds every title in a local catalog (see catalog.py)
+    def seed_from_catalog(self, catalog):
+        for row in catalog.df.itertuples(index=False):
+            self.add_result(row, kind=catalog.type)
+
+
+def common_prefix_length(a, b):
+    length = 0
+    for char_a, char_b in zip(a, b):
+        if char_a != char_b:
+            break
+        length += 1
+    return length
+
+# trigrams of a word, padded so its start and end count too (e.g. "  d", " da", "dar", "ark", "rk ")
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def year_of(value):
+    if value is None or value != value: # None or NaN/NaT
+        return None
+    if hasattr(value, "year"):
+        return value.year
+    return int(str(value)[:4]) if str(value)[:4].isdigit() else None
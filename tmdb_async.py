@@ -0,0 +1,252 @@
+import asyncio
+import concurrent.futures
+import inspect
+import json
+import threading
+
+import aiohttp
+from themoviedb import aioTMDb
+
+from metrics import metrics
+from tmdb_cache import endpoint_for, lookup
+from tmdb_client import RETRY_STATUSES, RateLimiter, backoff_for, count_cache_request, flight_key, retry_delay
+
+# TMDb access over one pooled aiohttp client, shared by the whole process, so connections are kept alive and reused
+# between calls rather than opened per request, and many calls can be in flight at once without a thread each.
+#
+# AsyncTMDb runs an event loop in a background thread, with themoviedb's async client (aioTMDb) on top of
+# AsyncTMDbSession, which does the same as the app's requests session (see tmdb_client.py), sharing its cache lookup,
+# retry and deduplication rules: responses come from the persistent response cache where possible, and requests to
+# TMDb are rate limited (with the same RateLimiter as the requests session, if it's given one, so the process stays
+# within one limit), retried and deduplicated.
+#
+# It can be used three ways:
+#   - awaited, from code running on its loop:       await client.client.movie(550).details()
+#   - in batches from anywhere:                     client.details_many("movie", [550, 551, 552])
+#   - through .sync, which has the same methods as themoviedb's sync TMDb client and blocks for the result:
+#                                                   client.sync.discover().movie(page=1, with_genres="28")
+#     so a function using TMDb(...) can move over by swapping the client it calls.
+
+
+# Raised for a response that's still an error after retrying, like requests' raise_for_status()
+class TMDbHTTPError(Exception):
+    def __init__(self, status, url):
+        super().__init__(f"TMDb returned {status} for {url}")
+        self.status = status
+
+
+# The body of a response, which themoviedb's async client reads with `await response.json()`
+class JSONResponse:
+    def __init__(self, status, body, from_cache=False):
+        self.status = status
+        self.body = body
+        self.from_cache = from_cache
+
+    async def json(self):
+        return json.loads(self.body)
+
+
+# Stands in for an aiohttp.ClientSession in themoviedb's async client
+class AsyncTMDbSession:
+    def __init__(self, cache=None, limiter=None, pool_size=20, keepalive=30, timeout=10, connect_timeout=5,
+                 max_retries=3, backoff=0.5):
+        self.cache = cache
+        self.limiter = limiter or RateLimiter()
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = None # created on first use, as it has to be made inside the event loop
+        self.in_flight = {} # request key -> Future shared by everyone waiting on it
+        self.refreshing = {} # request key -> background refresh task
+
+    def http_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size,
+                                             keepalive_timeout=self.keepalive)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def request(self, method, url, params=None, **kwargs):
+        endpoint = endpoint_for(url)
+        with metrics.span("tmdb_request", endpoint=endpoint):
+            response = await self.cached_request(method, url, params, **kwargs)
+        count_cache_request(url, response.from_cache)
+        return response
+
+    # serves GET requests from the response cache while they're fresh, and serves stale ones while refreshing them
+    # in the background, as CachedSession does
+    async def cached_request(self, method, url, params, **kwargs):
+        if method.upper() != "GET" or self.cache is None:
+            return await self.shared_request(method, url, params, **kwargs)
+
+        key, body, stale = await asyncio.to_thread(lookup, self.cache, url, params)
+        if body is not None:
+            if stale and key not in self.refreshing:
+                self.refreshing[key] = asyncio.create_task(self.refresh(key, method, url, params, **kwargs))
+            return JSONResponse(200, body, from_cache=True)
+        return await self.fetch(key, method, url, params, **kwargs)
+
+    async def fetch(self, key, method, url, params, **kwargs):
+        response = await self.shared_request(method, url, params, **kwargs)
+        if response.status == 200:
+            await asyncio.to_thread(self.cache.set, key, response.body)
+        return response
+
+    async def refresh(self, key, method, url, params, **kwargs):
+        try:
+            await self.fetch(key, method, url, params, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError, TMDbHTTPError):
+            pass # keeps serving the stale copy, and tries again on the next request
+        finally:
+            self.refreshing.pop(key, None)
+
+    # shares one request between identical GET requests made at the same time ("singleflight")
+    async def shared_request(self, method, url, params, **kwargs):
+        if method.upper() != "GET":
+            return await self.send_with_retries(method, url, params, **kwargs)
+
+        key = flight_key(url, params)
+        future = self.in_flight.get(key)
+        if future is not None:
+            metrics.count("tmdb_coalesced_requests", endpoint=endpoint_for(url))
+            return await asyncio.shield(future)
+
+        future = self.in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await self.send_with_retries(method, url, params, **kwargs)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception() # marks it as retrieved, in case nobody else was waiting on it
+            raise
+        finally:
+            self.in_flight.pop(key, None)
+
+    async def send_with_retries(self, method, url, params, **kwargs):
+        endpoint = endpoint_for(url)
+        for attempt in range(self.max_retries + 1):
+            with metrics.span("tmdb_rate_limit_wait"):
+                while (wait := self.limiter.try_acquire()) > 0:
+                    await asyncio.sleep(wait)
+            try:
+                with metrics.span("tmdb_http", endpoint=endpoint):
+                    async with self.http_session().request(method, url, params=params, **kwargs) as http_response:
+                        response = JSONResponse(http_response.status, await http_response.read())
+                        headers = http_response.headers
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                metrics.count("tmdb_http_errors", endpoint=endpoint)
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(backoff_for(self.backoff, attempt))
+                continue
+
+            metrics.count("tmdb_http_responses", endpoint=endpoint, status=response.status)
+            if response.status not in RETRY_STATUSES or attempt == self.max_retries:
+                if response.status >= 400:
+                    raise TMDbHTTPError(response.status, url)
+                return response
+            await asyncio.sleep(retry_delay(self.limiter, response.status, headers, self.backoff, attempt))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+# Runs themoviedb's async client on an event loop in a background thread, so it can be used from sync code too
+class AsyncTMDb:
+    def __init__(self, key, session=None, language="en-GB", region="GB"):
+        self.session = session or AsyncTMDbSession()
+        self.client = aioTMDb(key=key, session=self.session, language=language, region=region)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True, name="tmdb-async").start()
+        self.sync = SyncAdapter(self, self.client)
+
+    # runs a coroutine on the client's loop and waits for its result. The caller's context (e.g. its metrics trace)
+    # is carried over, as the loop copies it when the coroutine is scheduled.
+    def run(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    # awaits fetch(key) for every key at once, returning a dict of key -> result (or the exception it raised)
+    async def gather(self, fetch, keys):
+        keys = list(dict.fromkeys(keys)) # removes duplicate keys so each one is only fetched once
+        results = await asyncio.gather(*(fetch(key) for key in keys), return_exceptions=True)
+        return dict(zip(keys, results))
+
+    # Calls fetch(key) (a coroutine function) for every key at once, yielding (key, result) pairs in the order they
+    # complete, like tmdb_data.fetch_in_parallel but without a thread per request. A failed fetch raises its exception
+    # when it's reached, unless return_exceptions is True, when the exception is yielded as its result instead.
+    def as_completed(self, fetch, keys, return_exceptions=False):
+        keys = list(dict.fromkeys(keys))
+        futures = {asyncio.run_coroutine_threadsafe(fetch(key), self.loop): key for key in keys}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                error = future.exception()
+                if error is not None and not return_exceptions:
+                    raise error
+                yield futures[future], error if error is not None else future.result()
+        finally:
+            for future in futures:
+                future.cancel() # stops the rest if the caller stops early
+
+    # Batch APIs - each one sends every request at once (up to the pool size in flight) and waits for them all.
+    # They return a dict of id -> result, where a result can be the exception its request raised.
+    async def details_many_async(self, type, ids):
+        return await self.gather(lambda id: getattr(self.client, type)(id).details(), ids)
+
+    async def watch_providers_many_async(self, type, ids):
+        return await self.gather(lambda id: getattr(self.client, type)(id).watch_providers(), ids)
+
+    async def discover_pages_async(self, type, pages, **params):
+        return await self.gather(lambda page: getattr(self.client.discover(), type)(page=page, **params), pages)
+
+    # ids of every movie or tv show (type) changed on TMDb between two dates (YYYY-MM-DD), from its changes endpoint,
+    # fetching every page after the first at once
+    async def changed_ids_async(self, type, start_date, end_date):
+        fetch = lambda page: self.client.request(f"{type}/changes", start_date=start_date, end_date=end_date, page=page)
+        first = await fetch(1)
+        rest = await asyncio.gather(*(fetch(page) for page in range(2, (first.get("total_pages") or 1) + 1)))
+        return {result["id"] for response in [first, *rest] for result in response.get("results") or []}
+
+    # sync versions of the batch APIs
+    def details_many(self, type, ids):
+        return self.run(self.details_many_async(type, ids))
+
+    def watch_providers_many(self, type, ids):
+        return self.run(self.watch_providers_many_async(type, ids))
+
+    def discover_pages(self, type, pages, **params):
+        return self.run(self.discover_pages_async(type, pages, **params))
+
+    def changed_ids(self, type, start_date, end_date):
+        return self.run(self.changed_ids_async(type, start_date, end_date))
+
+    def close(self):
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# Wraps an object from themoviedb's async client (the client itself, or e.g. client.movie(550)) so that its methods
+# block and return their results, giving it the same API as themoviedb's sync client
+class SyncAdapter:
+    def __init__(self, runner, target):
+        self.runner = runner
+        self.target = target
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if inspect.iscoroutine(result):
+                return self.runner.run(result)
+            return SyncAdapter(self.runner, result) # e.g. client.movie(550), whose methods are the actual calls
+        return call
+
@@ -0,0 +1,258 @@
+import contextvars
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+
+# How long (in seconds) responses from each TMDb endpoint stay fresh. Endpoints are matched in order against the
+# request path, with ids replaced by {id}, and anything not listed falls back to DEFAULT_TTL.
+# Genre, region and provider lists barely change, so they're kept much longer than discover results.
+ENDPOINT_TTLS = [
+    (r"genre/(movie|tv)/list", 7 * 24 * 3600),
+    (r"watch/providers/regions", 7 * 24 * 3600),
+    (r"watch/providers/(movie|tv)", 24 * 3600),
+    (r"(movie|tv)/\{id\}/watch/providers", 12 * 3600),
+    (r"person/\{id\}.*", 24 * 3600),
+    (r"(movie|tv)/\{id\}.*", 24 * 3600),
+    (r"discover/(movie|tv)", 3600),
+    (r"(movie|tv|person)/changes", 0), # only asked for when checking what's changed, so always fetched
+    (r"search/.*", 3600),
+]
+DEFAULT_TTL = 3600
+
+# Once a response is older than its TTL, it's still served for up to this long (as a fraction of the TTL)
+# while a fresh copy is fetched in the background - i.e. stale-while-revalidate.
+STALE_FRACTION = 0.5
+
+# request params which shouldn't change the cache key
+IGNORED_PARAMS = {"api_key"}
+
+# Set while a cached result is refreshed in the background (see fresh_responses), so the TMDb requests it makes skip
+# the response cache - otherwise the refresh would be answered with the same cached responses the old result was built from
+skip_cache = contextvars.ContextVar("skip_cache", default=False)
+
+
+# Returns the endpoint path (e.g. movie/{id}/watch/providers) for a TMDb url, used to look up its TTL
+def endpoint_for(url):
+    path = urlparse(url).path
+    path = re.sub(r"^/\d+/", "", path) # strips the API version, e.g. /3/
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path)
+
+def ttl_for(endpoint):
+    for pattern, ttl in ENDPOINT_TTLS:
+        if re.fullmatch(pattern, endpoint):
+            return ttl
+    return DEFAULT_TTL
+
+# Makes every TMDb request inside the block go to TMDb, storing the new responses in the cache as usual. It's carried
+# over to the async client's loop and fetch_in_parallel's threads along with the rest of the caller's context.
+@contextmanager
+def fresh_responses():
+    token = skip_cache.set(True)
+    try:
+        yield
+    finally:
+        skip_cache.reset(token)
+
+# Looks a GET request up in a response cache, for the sync and async sessions. Returns (key, body, stale), where body
+# is None if the response has to be fetched (it isn't cached, it's too old to serve, or the request is inside
+# fresh_responses()), and stale is True if it can be served but should be refreshed in the background.
+def lookup(cache, url, params):
+    key = cache_key(url, params)
+    cached = None if skip_cache.get() else cache.get(key)
+    if cached is None:
+        return key, None, False
+    body, stored_at = cached
+    age = time.time() - stored_at
+    ttl = ttl_for(endpoint_for(url))
+    if age < ttl:
+        return key, body, False
+    if age < ttl * (1 + STALE_FRACTION):
+        return key, body, True
+    return key, None, False
+
+# Builds a cache key from the url path and the request params, sorted so that the same request always gives the same key
+def cache_key(url, params=None):
+    path = urlparse(url).path
+    params = sorted((str(k), str(v)) for k, v in (params or {}).items() if v is not None and k not in IGNORED_PARAMS)
+    return path + "?" + "&".join(f"{k}={v}" for k, v in params)
+
+
+# Interface for cache backends, so a shared backend (e.g. Redis) can be swapped in for the local SQLite one.
+# get returns (body, stored_at) or None, and set stores the raw response body for a key. delete_paths deletes every
+# response for the given url paths and the paths under them (e.g. /3/movie/550 and /3/movie/550/watch/providers).
+class ResponseCache(ABC):
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, body):
+        pass
+
+    @abstractmethod
+    def delete_paths(self, paths):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+# Stores responses in a local SQLite file, which survives restarts and is shared by every app process on the machine.
+# When the stored bodies go over max_bytes, the least recently used responses are evicted.
+#
+# Hits don't write to the file: when each response was last used is kept in memory and written in batches of
+# touch_batch (or with the next set), and the size of the stored bodies is kept as a running total rather than summed
+# on every set. Other processes sharing the file don't update this one's total, so it's recounted from the table
+# whenever it says the cache is full, before anything is evicted.
+class SQLiteCache(ResponseCache):
+    def __init__(self, path=".cache/tmdb_cache.sqlite", max_bytes=256 * 1024 * 1024, touch_batch=100):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.touched = {} # key -> when it was last used, not yet written to the table
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL") # lets other processes read while one is writing
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.total_bytes = self.stored_bytes()
+
+    def stored_bytes(self):
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT body, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.touched[key] = time.time()
+                if len(self.touched) >= self.touch_batch:
+                    self.write_touched()
+        return row
+
+    def set(self, key, body):
+        now = time.time()
+        with self.lock:
+            old = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, stored_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, body, len(body), now, now)
+            )
+            self.touched.pop(key, None)
+            self.total_bytes += len(body) - (old[0] if old else 0)
+            self.write_touched()
+            self.evict()
+
+    # writes the last used times of the responses served since the last write, in one transaction
+    def write_touched(self):
+        if not self.touched:
+            return
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                                        [(last_used, key) for key, last_used in self.touched.items()])
+        self.touched = {}
+
+    # deletes the least recently used responses until the cache fits in max_bytes
+    def evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        self.total_bytes = self.stored_bytes()
+        if self.total_bytes <= self.max_bytes:
+            return
+        excess = self.total_bytes - self.max_bytes
+        freed = 0
+        keys = []
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self.total_bytes -= freed
+
+    def delete_paths(self, paths):
+        with self.lock:
+            # keys starting with "<path>?" or "<path>/", as ranges so they're found with the key's index
+            self.connection.executemany("DELETE FROM responses WHERE (key >= ? AND key < ?) OR (key >= ? AND key < ?)",
+                                        [(f"{path}?", f"{path}@", f"{path}/", f"{path}0") for path in paths])
+            self.total_bytes = self.stored_bytes()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.touched = {}
+            self.total_bytes = 0
+
+
+# A requests session which serves TMDb GET requests from a ResponseCache. Pass it to TMDb(session=...) and every
+# call made through the client (discover, genres, regions, providers, where to watch etc.) goes through the cache.
+class CachedSession(requests.Session):
+    def __init__(self, cache, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.refreshing = set() # keys currently being refreshed in the background
+        self.refreshing_lock = threading.Lock()
+
+    def request(self, method, url, params=None, **kwargs):
+        if method.upper() != "GET":
+            return super().request(method, url, params=params, **kwargs)
+
+        key, body, stale = lookup(self.cache, url, params)
+        if body is not None:
+            if stale:
+                self.refresh_in_background(key, method, url, params, **kwargs)
+            return cached_response(url, body)
+        return self.fetch(key, method, url, params, **kwargs)
+
+    # makes the real request and stores successful responses
+    def fetch(self, key, method, url, params, **kwargs):
+        response = super().request(method, url, params=params, **kwargs)
+        if response.status_code == 200:
+            self.cache.set(key, response.content)
+        return response
+
+    def refresh_in_background(self, key, method, url, params, **kwargs):
+        with self.refreshing_lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                self.fetch(key, method, url, params, **kwargs)
+            except requests.RequestException:
+                pass # keeps serving the stale copy, and tries again on the next request
+            finally:
+                with self.refreshing_lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+# Builds a requests.Response from a cached body, so the TMDb client can't tell it apart from a real one
+def cached_response(url, body):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.encoding = "utf-8"
+    response.headers["Content-Type"] = "application/json"
+    response._content = body
+    response.from_cache = True
+    return response
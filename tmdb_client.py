@@ -0,0 +1,158 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+
+from metrics import metrics
+from tmdb_cache import CachedSession, endpoint_for
+
+# Status codes worth retrying - 429 means we've hit TMDb's rate limit, the rest are temporary server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+# Token bucket shared by every request in the process: up to `rate` requests per second on average,
+# with bursts of up to `burst` requests at once.
+class RateLimiter:
+    def __init__(self, rate=40, burst=40):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # blocks until a request is allowed
+    def acquire(self):
+        while (wait := self.try_acquire()) > 0:
+            time.sleep(wait)
+
+    # takes a token if there is one, returning 0, or otherwise returns how long to wait before trying again - so
+    # async code can wait with asyncio.sleep rather than blocking its event loop
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    # tokens available right now, i.e. how many requests could be sent at once without waiting
+    def available(self):
+        with self.lock:
+            return min(self.burst, self.tokens + (time.monotonic() - self.updated_at) * self.rate)
+
+    # stops all requests for the given number of seconds, e.g. when TMDb returns a 429 with a Retry-After header
+    def pause(self, seconds):
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+            self.updated_at = time.monotonic()
+
+
+# A requests session for TMDb which:
+#   - waits for the shared RateLimiter before every request, and keeps at most max_concurrent requests in flight
+#   - retries 429s and temporary server errors, waiting for Retry-After if TMDb sends it, or backing off exponentially
+#   - shares one request between identical GET requests made at the same time ("singleflight"), so many users
+#     choosing the same filters at once only cost one call
+class ThrottledSession(requests.Session):
+    def __init__(self, limiter=None, max_concurrent=20, max_retries=3, backoff=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.limiter = limiter or RateLimiter()
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.in_flight = {} # request key -> Future shared by everyone waiting on it
+        self.in_flight_lock = threading.Lock()
+
+    def request(self, method, url, params=None, **kwargs):
+        if method.upper() != "GET":
+            return self.send_with_retries(method, url, params=params, **kwargs)
+
+        key = flight_key(url, params)
+        with self.in_flight_lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+
+        if not leader:
+            metrics.count("tmdb_coalesced_requests", endpoint=endpoint_for(url))
+            return future.result() # an identical request is already in flight, so wait for its response
+
+        try:
+            response = self.send_with_retries(method, url, params=params, **kwargs)
+            future.set_result(response)
+            return response
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.in_flight_lock:
+                self.in_flight.pop(key, None)
+
+    def send_with_retries(self, method, url, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            with metrics.span("tmdb_rate_limit_wait"):
+                self.limiter.acquire()
+            try:
+                with self.slots, metrics.span("tmdb_http", endpoint=endpoint_for(url)):
+                    response = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.count("tmdb_http_errors", endpoint=endpoint_for(url))
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(backoff_for(self.backoff, attempt))
+                continue
+
+            metrics.count("tmdb_http_responses", endpoint=endpoint_for(url), status=response.status_code)
+
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            time.sleep(retry_delay(self.limiter, response.status_code, response.headers, self.backoff, attempt))
+        return response
+
+
+# Times every TMDb request made through the session (whether or not it's served from the cache),
+# and counts cache hits and misses per endpoint
+class InstrumentedSession(requests.Session):
+    def request(self, method, url, **kwargs):
+        with metrics.span("tmdb_request", endpoint=endpoint_for(url)):
+            response = super().request(method, url, **kwargs)
+        count_cache_request(url, getattr(response, "from_cache", False))
+        return response
+
+
+# Session used by the app: responses come from the persistent cache where possible, and the requests that do
+# go out to TMDb are rate limited, retried and deduplicated. Every request is timed.
+class TMDbSession(InstrumentedSession, CachedSession, ThrottledSession):
+    pass
+
+
+# The parts of the session shared with the async session in tmdb_async.py
+
+def count_cache_request(url, from_cache):
+    metrics.count("cache_requests", function=f"tmdb:{endpoint_for(url)}", result="hit" if from_cache else "miss")
+
+# identifies identical GET requests, so they can share one response
+def flight_key(url, params):
+    return (url, tuple(sorted((str(k), str(v)) for k, v in (params or {}).items())))
+
+# How long to wait before retrying a response with one of the RETRY_STATUSES: TMDb's Retry-After if it sent one, or
+# exponential backoff. A 429 with Retry-After also pauses the rate limiter, slowing down every request, not just this one.
+def retry_delay(limiter, status, headers, backoff, attempt):
+    retry_after = retry_after_seconds(headers)
+    if status == 429 and retry_after is not None:
+        limiter.pause(retry_after)
+    return retry_after if retry_after is not None else backoff_for(backoff, attempt)
+
+# exponential backoff with jitter, so retries from different requests don't all land at once
+def backoff_for(backoff, attempt):
+    return backoff * (2 ** attempt) * (0.5 + random.random())
+
+def retry_after_seconds(headers):
+    try:
+        return max(0.0, float(headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
@@ -0,0 +1,823 @@
+import pandas as pd
+import streamlit as st
+from themoviedb import TMDb
+from themoviedb.routes_sync._base import Base
+from themoviedb.routes_async._base import Base as AsyncBase
+from frame_builder import FrameBuilder, replace_values
+from posters import poster_url, profile_url
+from tmdb_cache import SQLiteCache, fresh_responses, skip_cache
+from tmdb_client import RateLimiter, TMDbSession
+from tmdb_async import AsyncTMDb, AsyncTMDbSession
+from metadata import MetadataRegistry
+from prefetch import PagePrefetcher
+from catalog import Catalog
+from availability import AvailabilityMatrix
+from result_cache import ResultCache
+from refresher import BackgroundRefresher
+from delta_sync import ChangeFeed
+from query_store import SORT_COLUMNS, QueryStore, canonicalize
+from people import PersonIndex
+from title_index import GOOD_MATCH, KINDS, TitleIndex
+from metrics import metrics
+from pathlib import Path
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# The app's data functions - searching TMDb, discovering top movies and tv shows, and looking up genres, regions and
+# watch providers. They're kept out of main.py so they can be imported (e.g. by benchmark.py and export.py) without
+# drawing the app, and nothing here needs a Streamlit script to be running.
+
+# Settings passed to configure(), which take priority over environment variables and secrets.toml
+settings = {}
+
+# Sets settings (e.g. TMDB_API_KEY or MAX_CONCURRENT_REQUESTS) for a run outside the app, such as export.py.
+# Call it before any data function, as the TMDb session and other shared resources read their settings once.
+def configure(**overrides):
+    settings.update(overrides)
+
+# Gets a setting from configure(), an environment variable or secrets.toml (in that order), or default if none have it.
+# Settings are read when they're first needed rather than on import, so a headless run doesn't need a secrets.toml.
+def setting(name, default=None):
+    if name in settings:
+        return settings[name]
+    if name in os.environ:
+        return os.environ[name]
+    try:
+        return st.secrets.get(name, default)
+    except FileNotFoundError: # no secrets.toml
+        return default
+
+# whether an on/off setting is on - true in secrets.toml, or e.g. POSTER_CACHE=1 or true as an environment variable
+def enabled(name, default=False):
+    return str(setting(name, default)).strip().lower() in ("1", "true", "yes", "on")
+
+# Session shared by every user for all TMDb calls. Responses come from a persistent cache, which survives restarts and is
+# shared by every app process on the machine, and the calls that do go to TMDb are rate limited, retried on 429s and
+# deduplicated when identical. The cache size, rate limit and concurrency can be overridden in secrets.toml.
+@st.cache_resource
+def get_tmdb_session():
+    cache = SQLiteCache(path=setting("TMDB_CACHE_PATH", ".cache/tmdb_cache.sqlite"),
+                        max_bytes=int(setting("TMDB_CACHE_MAX_MB", 256)) * 1024 * 1024)
+    limiter = RateLimiter(rate=float(setting("TMDB_RATE_LIMIT", 40)),
+                          burst=int(setting("TMDB_RATE_BURST", 40)))
+    return TMDbSession(cache=cache,
+                       limiter=limiter,
+                       max_concurrent=int(setting("TMDB_MAX_CONCURRENT", 20)),
+                       max_retries=int(setting("TMDB_MAX_RETRIES", 3)))
+
+## TMDb API key - enter this yourself in a secrets.toml file in the .streamlit folder
+def tmdb_api_key():
+    api_key = setting("TMDB_API_KEY")
+    if not api_key:
+        raise RuntimeError("No TMDb API key - set TMDB_API_KEY in .streamlit/secrets.toml or as an environment variable")
+    return api_key
+
+# Sync TMDb client, for the calls that haven't moved over to the async client below yet
+@st.cache_resource
+def get_tmdb():
+    api_key = tmdb_api_key()
+    if setting("TMDB_URL"): # another server to send TMDb requests to, e.g. fake_tmdb.py's for testing
+        Base.TMDB_URL = setting("TMDB_URL")
+    return TMDb(key=api_key, language='en-GB', region='GB', session=get_tmdb_session())
+
+# Async TMDb client shared by every user (see tmdb_async.py), which keeps a pool of up to TMDB_POOL_SIZE connections
+# to TMDb alive between calls, and can have many requests in flight without a thread for each. It uses the same response
+# cache and rate limiter as the sync session. Sync code calls it through get_async_tmdb().sync, which has the same
+# methods as get_tmdb(), or its batch functions (e.g. details_many) and as_completed.
+@st.cache_resource
+def get_async_tmdb():
+    api_key = tmdb_api_key()
+    if setting("TMDB_URL"):
+        AsyncBase.TMDB_URL = setting("TMDB_URL")
+    sync_session = get_tmdb_session()
+    session = AsyncTMDbSession(cache=sync_session.cache,
+                               limiter=sync_session.limiter,
+                               pool_size=int(setting("TMDB_POOL_SIZE", 20)),
+                               keepalive=float(setting("TMDB_KEEPALIVE", 30)),
+                               timeout=float(setting("TMDB_TIMEOUT", 10)),
+                               connect_timeout=float(setting("TMDB_CONNECT_TIMEOUT", 5)),
+                               max_retries=int(setting("TMDB_MAX_RETRIES", 3)))
+    return AsyncTMDb(api_key, session=session, language='en-GB', region='GB')
+
+# max number of TMDb requests in flight at once when fetching in parallel - can be overridden in secrets.toml
+def max_concurrent_requests():
+    return int(setting("MAX_CONCURRENT_REQUESTS", 8))
+
+# Calls fetch(key, *args) for every key using a bounded thread pool, with up to max_workers requests in flight.
+# Yields (key, result) pairs in the order they complete, so the caller can fill in results as they arrive.
+def fetch_in_parallel(fetch, keys, *args, max_workers=None):
+    keys = list(dict.fromkeys(keys)) # removes duplicate keys so each one is only fetched once
+    if not keys:
+        return
+    max_workers = max_workers or max_concurrent_requests()
+    ctx = get_script_run_ctx(suppress_warning=True) # passed to each worker thread so cached calls know which session they belong to
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(keys))),
+                            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)) as executor:
+        # each call runs in a copy of this thread's context, so its timings are added to this run's trace
+        futures = {executor.submit(contextvars.copy_context().run, fetch, key, *args): key for key in keys}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+# Results of the data functions below, shared by every session and kept within RESULT_CACHE_MAX_MB of memory (128 by
+# default), evicting the least recently used results first - see result_cache.py
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(max_bytes=int(setting("RESULT_CACHE_MAX_MB", 128)) * 1024 * 1024)
+
+# Caches a function's results in the shared result cache for ttl seconds - used like st.cache_data(ttl=...).
+# With refresh=True, its most popular results are kept fresh in the background (see get_refresher), and
+# on_refresh(function, args, kwargs, value) is called with each refreshed result.
+def cache_result(ttl=None, refresh=False, on_refresh=None):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return get_result_cache().call(function, args, kwargs, ttl=ttl, refresher=get_refresher() if refresh else None,
+                                           on_refresh=on_refresh)
+        return wrapper
+    return decorate
+
+# whether live requests are leaving room in the rate limit (using less than half of its burst), so background work
+# (scheduled refreshes, the availability build) can go ahead without holding them up
+def rate_limit_has_room():
+    limiter = get_tmdb_session().limiter
+    return limiter.available() >= limiter.burst / 2
+
+# Refreshes the most requested discover results, provider lists and where to watch lookups in the background shortly
+# before they expire, and lets them be served stale (for up to REFRESH_MAX_STALE_MINUTES) while they're refreshed, so
+# users don't wait on a cold fetch when they expire - see refresher.py. At most REFRESH_MAX_CONCURRENT refreshes run at
+# once, and scheduled ones wait while live requests are using more than half of the rate limit's burst. Refreshes skip
+# the response cache, whose discover responses live as long as the results built from them.
+@st.cache_resource
+def get_refresher():
+    return BackgroundRefresher(max_concurrent=int(setting("REFRESH_MAX_CONCURRENT", 2)),
+                               lead=float(setting("REFRESH_LEAD_MINUTES", 5)) * 60,
+                               top_k=int(setting("REFRESH_TOP_K", 50)),
+                               max_stale=float(setting("REFRESH_MAX_STALE_MINUTES", 30)) * 60,
+                               can_start=rate_limit_has_room,
+                               refresh_context=fresh_responses)
+
+#%% Movie search function:
+
+# Get and cache a person's biography, which isn't included in search results and needs a separate details call
+@metrics.track_cache("get_biography")
+@cache_result(ttl=3600) # Cache for 1 hour
+@metrics.on_miss("get_biography")
+def get_biography(person_id):
+    return get_tmdb().person(person_id).details().biography
+
+# Every person seen in search results, shared by every session so names can be looked up as they're typed without calling TMDb
+@st.cache_resource
+def get_person_index():
+    return PersonIndex()
+
+# Every movie, tv show and person the app has fetched, shared by every session so the search box can answer most searches
+# without calling TMDb. It's seeded with every title in the local catalog (if there is one) and TMDb's daily id exports
+# listed in TITLE_INDEX_EXPORTS in secrets.toml (if any), in the background so the app doesn't wait for it.
+@st.cache_resource
+def get_title_index():
+    index = TitleIndex()
+    catalogs = [catalog for catalog in (get_catalog("movie"), get_catalog("tv")) if catalog is not None]
+    exports = setting("TITLE_INDEX_EXPORTS", [])
+    min_popularity = float(setting("TITLE_INDEX_MIN_POPULARITY", 1))
+
+    def seed():
+        for catalog in catalogs:
+            index.seed_from_catalog(catalog)
+        for export_path in exports:
+            index.seed_from_export(export_path, min_popularity=min_popularity)
+
+    if catalogs or exports:
+        threading.Thread(target=seed, daemon=True, name="title-index-seed").start()
+    return index
+
+# function to search for movies, actors and tv shows
+# results are built straight from the search payload (fast), pass fetch_details=True to also get full person biographies (slower)
+@metrics.timed()
+def multi_search(search_term="Jack", search_type="multi", fetch_details=False):
+
+    # checks search type and calls the appropriate TMDb search method
+    search = get_async_tmdb().sync.search()
+    if search_type == "movie":
+        results = search.movies(search_term)
+    elif search_type == "tv":
+        results = search.tv(search_term)
+    elif search_type == "person":
+        results = search.people(search_term)
+    elif search_type == "multi":
+        results = search.multi(search_term)
+    else:
+        raise ValueError("Invalid search type. Choose from 'movie', 'tv', 'person' or 'multi'.")
+
+    # TMDb's search results can list the same title more than once, so each one is only kept once (in its first position)
+    unique_results = {}
+    for result in results:
+        unique_results.setdefault((result.media_type, result.id), result)
+    results = list(unique_results.values())
+
+    # creates empty column buffers for each type of result
+    movie_rows = FrameBuilder({'Title': "str", 'Overview': "str"})
+    person_rows = FrameBuilder({'Name': "str", 'Known For': "list", 'Biography': "str"})
+    tv_rows = FrameBuilder({'Title': "str", 'Overview': "str"})
+
+    # loops through results and appends to the appropriate buffer - title and overview are already in the search payload
+    for result in results:
+        get_title_index().add_result(result)
+        if result.media_type == "movie":
+            movie_rows.append([result.title, result.overview])
+            
+        elif result.media_type == "person":
+            person_rows.append([result.name, [str(m) for m in result.known_for or []], ""])
+            get_person_index().add(result.id, result.name, result.popularity, result.known_for_department)
+
+        elif result.media_type == "tv":
+            tv_rows.append([result.name, result.overview])
+
+    # biographies are only in the full person details, so fetch those in parallel if asked for
+    if fetch_details:
+        person_ids = [result.id for result in results if result.media_type == "person"]
+        row_for_id = {person_id: row for row, person_id in enumerate(person_ids)}
+        for person_id, biography in fetch_in_parallel(get_biography, person_ids):
+            person_rows.set(row_for_id[person_id], 'Biography', biography)
+
+    # creates dict of all results dataframes
+    results_dict = {
+        'movie': movie_rows.to_frame(), 
+        'person': person_rows.to_frame(),
+        'tv': tv_rows.to_frame()
+    }
+    
+    # returns all results in a dict if search_type is 'multi', otherwise returns the specific type
+    if search_type == "multi":
+        return results_dict
+    else:
+        return results_dict[search_type]
+
+        
+# function to search for only one of movies, tv shows or actors
+@metrics.timed()
+def single_search(search_term="Jack", search_type="movie", fetch_details=False):
+    if search_type not in ("movie", "tv", "person"):
+        raise ValueError("Invalid search type. Choose from 'movie', 'tv', or 'person'.")
+
+    # a single type search returns just that type's dataframe
+    return multi_search(search_term, search_type=search_type, fetch_details=fetch_details)
+
+
+#%% Top movies by genre
+
+# Genre, region and watch provider lists are fetched lazily, once per list, and shared by every session.
+# They're also saved to a snapshot file, so a restarted app can draw its widgets without waiting on TMDb.
+@st.cache_resource
+def get_metadata_registry():
+    return MetadataRegistry(get_async_tmdb().sync, snapshot_path=setting("METADATA_SNAPSHOT_PATH", ".cache/metadata_snapshot.json"),
+                            refresher=get_refresher())
+
+# Get a dict for mapping genre names to IDs (or IDs to names if reverse is True)
+def get_genre_map(reverse=False, type="movie"):
+    return get_metadata_registry().genres(type=type, reverse=reverse)
+
+# Get a dict of regions from tmdb which have watch provider data (United Kingdom: GB)
+def get_region_map(reverse=False):
+    return get_metadata_registry().regions(reverse=reverse)
+
+# Get a dict of watch providers for a given region
+def get_provider_map(region="GB", type="movie", display_priority=25, reverse=False): 
+    # display priority is tmdb's score for how high to display the provider, only providers at or above it are returned
+    return get_metadata_registry().providers(region=region, type=type, display_priority=display_priority, reverse=reverse)
+
+# Which subscription providers each movie is on in every region, shared by every session (see availability.py), so the
+# Where to Watch column and provider filters are answered locally, and switching region doesn't need any new calls.
+# It's saved to AVAILABILITY_PATH so it survives restarts. If there's a local catalog, every movie in it is added in the
+# background, along with the provider list for every region, so those are all ready before anyone asks for them.
+@st.cache_resource
+def get_availability():
+    availability = AvailabilityMatrix(path=setting("AVAILABILITY_PATH", ".cache/availability.json"),
+                                      max_age=float(setting("AVAILABILITY_MAX_AGE_HOURS", 24)) * 3600)
+    catalog = get_catalog("movie")
+    if catalog is not None:
+        threading.Thread(target=build_availability, args=(availability, catalog.ids.tolist()), daemon=True,
+                         name="availability").start()
+    return availability
+
+# Adds every movie the availability matrix doesn't know yet (or knew too long ago), and fetches the provider list for
+# every region. The movies are fetched through the async client's connection pool, and any that fail are left out for
+# now and fetched when they're next shown.
+# It shares the rate limit with live requests, so it only takes a small share of it: movies are fetched in batches of
+# AVAILABILITY_BUILD_BATCH, at most AVAILABILITY_BUILD_RATE a second (10 by default, a quarter of the default limit),
+# and each batch waits while live requests are busy (see rate_limit_has_room).
+def build_availability(availability, tmdb_ids):
+    missing = [tmdb_id for tmdb_id in tmdb_ids if not availability.known(tmdb_id)]
+    batch_size = int(setting("AVAILABILITY_BUILD_BATCH", 10))
+    build_limiter = RateLimiter(rate=float(setting("AVAILABILITY_BUILD_RATE", 10)), burst=batch_size)
+    with metrics.span("availability_build", titles=len(missing)):
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            for _ in batch:
+                build_limiter.acquire()
+            while not rate_limit_has_room():
+                metrics.count("availability_build_deferred")
+                time.sleep(1)
+            for tmdb_id, providers in get_async_tmdb().as_completed(watch_providers_async, batch, return_exceptions=True):
+                if not isinstance(providers, Exception):
+                    availability.add(tmdb_id, providers.results)
+        availability.save()
+        for _ in fetch_in_parallel(lambda region: get_provider_map(region=region), get_region_map(reverse=True)):
+            pass
+
+# Fetches a movie's watch providers, which come for every region at once, and adds them to the availability matrix
+@metrics.on_miss("where_to_watch")
+def fetch_watch_providers(tmdb_id):
+    results = get_async_tmdb().sync.movie(tmdb_id).watch_providers().results # searches on given tmdb id e.g. 5255
+    get_availability().add(tmdb_id, results)
+
+async def watch_providers_async(tmdb_id):
+    return await get_async_tmdb().client.movie(tmdb_id).watch_providers()
+
+# refetches a movie's watch providers for the refresher, returning when they next expire
+def refresh_watch_providers(tmdb_id):
+    fetch_watch_providers(tmdb_id)
+    return get_availability().expires_at(tmdb_id)
+
+# whether a movie's providers can be shown without fetching them first - they're either fresh, or recently expired
+# and being refreshed in the background
+def has_watch_providers(tmdb_id):
+    expires_at = get_availability().expires_at(tmdb_id)
+    return expires_at is not None and get_refresher().servable(expires_at)
+
+# Gets the top 5 'flatrate' providers for a movie in a region, where flatrate providers are subscription providers.
+# Only calls TMDb the first time a movie is seen (in any region) - after that, its providers are refreshed in the
+# background once they're older than a day.
+@metrics.track_cache("where_to_watch")
+def where_to_watch(tmdb_id, region='GB'):
+    availability = get_availability()
+    if not has_watch_providers(tmdb_id):
+        fetch_watch_providers(tmdb_id)
+    get_refresher().seen("where_to_watch", tmdb_id, availability.expires_at(tmdb_id),
+                         functools.partial(refresh_watch_providers, tmdb_id))
+    return availability.where_to_watch(tmdb_id, region)[:5]
+
+# Gets where to watch for many movies at once, yielding (tmdb_id, providers) pairs as each one arrives - straight
+# away for the movies already in the availability matrix, and fetching the rest at once through the async client.
+# As in build_availability, a movie whose lookup fails is left out (so its row has no providers) rather than failing
+# the whole table, and is fetched again when it's next shown.
+def where_to_watch_many(tmdb_ids, region='GB'):
+    availability = get_availability()
+    tmdb_ids = list(dict.fromkeys(tmdb_ids))
+    for tmdb_id in tmdb_ids:
+        if has_watch_providers(tmdb_id):
+            yield tmdb_id, where_to_watch(tmdb_id, region)
+    missing = [tmdb_id for tmdb_id in tmdb_ids if not has_watch_providers(tmdb_id)]
+    for tmdb_id, providers in get_async_tmdb().as_completed(watch_providers_async, missing, return_exceptions=True):
+        if isinstance(providers, Exception):
+            metrics.count("where_to_watch_errors")
+            continue
+        availability.add(tmdb_id, providers.results)
+        metrics.count("cache_requests", function="where_to_watch", result="miss")
+        get_refresher().track("where_to_watch", tmdb_id, availability.expires_at(tmdb_id),
+                              functools.partial(refresh_watch_providers, tmdb_id))
+        yield tmdb_id, availability.where_to_watch(tmdb_id, region)[:5]
+
+# max number of discover pages (of 20 results each) a user can load into a table - can be overridden in secrets.toml
+def max_discover_pages():
+    return int(setting("MAX_DISCOVER_PAGES", 5))
+
+# Background fetcher shared by every session, used to get the next page of discover results ready before it's asked for
+@st.cache_resource
+def get_page_prefetcher():
+    return PagePrefetcher(ttl=3600) # as long as the top movies and tv shows tables are cached
+
+# Local catalog of movies or tv shows (built with catalog.py), used to answer discover queries without calling TMDb.
+# Only used if LOCAL_CATALOG_PATH is set in secrets.toml and the catalog file for the type exists.
+@st.cache_resource
+def get_catalog(type):
+    catalog_path = setting("LOCAL_CATALOG_PATH")
+    if not catalog_path or not (Path(catalog_path) / f"{type}.parquet").exists():
+        return None
+    return Catalog.load(Path(catalog_path) / f"{type}.parquet", type=type)
+
+# Fetches one page of discover results (type is 'movie' or 'tv'), and starts prefetching the page after it in the background
+# so it's ready if the user loads more results. Uses the prefetched copy of this page if there is one.
+# Queries the local catalog can answer (i.e. without keyword or people filters) are answered from it instead - including
+# movie provider filters, once the availability matrix has every movie in the catalog.
+@metrics.timed()
+def discover_page(type, page=1, **params):
+    catalog = get_catalog(type)
+    if catalog is not None and catalog.can_answer(**params):
+        metrics.count("catalog_queries", type=type)
+        return catalog.discover(page=page, **params)
+
+    providers, region = params.get("with_watch_providers"), params.get("watch_region")
+    other_params = {key: value for key, value in params.items() if key not in ("with_watch_providers", "watch_region")}
+    if (catalog is not None and type == "movie" and providers and region and "," not in str(providers) # ',' means all of them
+            and catalog.can_answer(**other_params) and get_availability().covers(catalog.ids)):
+        metrics.count("catalog_queries", type=type)
+        ids = get_availability().titles(region, str(providers).split("|"))
+        return catalog.discover(page=page, ids=ids, **other_params)
+
+    fetch = lambda p: getattr(get_async_tmdb().sync.discover(), type)(page=p, **params)
+    key = (type, tuple(sorted(params.items())))
+    prefetcher = get_page_prefetcher()
+    results = fetch(page) if skip_cache.get() else prefetcher.get(key, page, fetch) # a refresh skips prefetched pages too
+    if page < min(results.total_pages or 1, max_discover_pages()):
+        prefetcher.prefetch(key, page + 1, fetch)
+    get_title_index().add_results(results, kind=type)
+    return results
+
+# Results of recent queries shared by every session, used to answer narrower queries (e.g. a higher minimum vote count)
+# without calling TMDb again
+@st.cache_resource
+def get_query_store():
+    return QueryStore(max_bytes=int(setting("QUERY_STORE_MAX_MB", 64)) * 1024 * 1024,
+                      ttl=3600) # as long as the top movies and tv shows tables are cached
+
+# Gets one page of results from top_function (top_movies_by_genre or top_tv_shows_by_genre), or from the query store
+# if an earlier query already covers it
+def query_page(top_function, page=1, **filters):
+    filters = canonicalize(filters)
+    store = get_query_store()
+    df = store.answer(top_function.__name__, filters, page)
+    metrics.count("cache_requests", function="query_store", result="miss" if df is None else "hit")
+    if df is None:
+        df = top_function(page=page, **filters)
+        store.remember(top_function.__name__, filters, page, df)
+    return df
+
+# Puts a background refresh of a page that query_page asked for into the query store, in place of its old copy, so
+# the refreshed rows are shown straight away rather than once the stored page expires
+def replace_query_page(top_function, args, kwargs, df):
+    filters = dict(kwargs)
+    page = filters.pop("page", 1)
+    if not args:
+        get_query_store().replace(top_function.__name__, canonicalize(filters), page, df.copy(deep=False))
+
+# Yields the combined table of pages 1, 1-2, 1-3 ... up to pages, so the table can be redrawn as each page arrives.
+# top_function is top_movies_by_genre or top_tv_shows_by_genre, and stops early once TMDb runs out of pages.
+def stream_pages(top_function, pages=1, **filters):
+    frames = []
+    for page in range(1, min(pages, max_discover_pages()) + 1):
+        df = query_page(top_function, page=page, **filters)
+        frames.append(df)
+        combined = pd.concat(frames, ignore_index=True)
+        combined.attrs = df.attrs
+        yield combined
+        if page >= df.attrs.get("total_pages", page):
+            break
+
+# Shows a progress bar in the app, or returns None when there's no app to show it in (e.g. in export.py)
+def show_progress(text):
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    return st.progress(0, text)
+
+# indexes a table's rows by their titles' tmdb ids, and records when it was built, so sync_changes can update the rows
+# of titles that change on TMDb rather than the whole table being fetched again
+def stamp_rows(df, results):
+    df.index = pd.Index([result.id for result in results], name="tmdb_id")
+    df.attrs["fetched_at"] = df.attrs["synced_at"] = time.time()
+
+# Columns and dtypes of the movie and tv show tables
+movie_columns = {'Poster': "str", 'Title': "str", 'Overview': "str", 'Popularity': "float",
+                 'Release Date': "datetime", 'Vote Average': "float",
+                 'Vote Count': "int", 'Genres': "list", 'Trailer': "str", 'Where to Watch': "list"}
+tv_columns = {'Poster': "str", 'Title': "str", 'Overview': "str", 'Popularity': "float",
+              'Release Date': "datetime", 'Vote Average': "float",
+              'Vote Count': "int", 'Genres': "list"}
+
+@metrics.track_cache("top_movies_by_genre")
+@cache_result(ttl=3600, refresh=True, on_refresh=replace_query_page)  # Cache for 1 hour, refreshing popular results before then
+@metrics.on_miss("top_movies_by_genre")
+@metrics.timed()
+def top_movies_by_genre(genre=['Action', 'Drama'], 
+                        keyword = None, # e.g. a list such as ['Christmas'] or ['Fast', 'Furious'] 
+                        people = None, # e.g. directors or actors
+                        sort_by="popularity.desc",
+                        primary_release_date__gte="1997-08-15",
+                        primary_release_date__lte="2025-12-31",
+                        vote_count__gte=10000,
+                        get_watch_providers=False, # defaults to False due to slow 20s API call
+                        watch_region = None,
+                        watch_providers = None, # e.g. 8 for netflix. 
+                        page=1
+                        ): 
+    
+    genre_name_to_id = get_genre_map()
+    genre_id_to_name = get_genre_map(reverse=True)
+    genre_ids = [str(genre_name_to_id[g]) for g in genre if g in genre_name_to_id]
+
+    # Join into a string so that it can be passed to the TMDb API in 'with_genres'
+    # join with '|' for OR and ',' for AND, i.e. whether to include films with one of the genres or exclusively films with ALL genres given
+    genre_string = "|".join(genre_ids)
+
+    progress_bar = show_progress("Fetching movies...")
+        
+
+    # Fetches top movies by genre using the TMDb API for given criteria
+    results = discover_page(
+        "movie",
+        page=page,
+        sort_by=sort_by,
+        primary_release_date__gte=primary_release_date__gte,
+        primary_release_date__lte=primary_release_date__lte,
+        vote_count__gte=vote_count__gte,
+        with_genres=genre_string,
+        with_keywords=keyword,
+        with_people=people,
+        watch_region=watch_region,
+        with_watch_providers=watch_providers
+    )
+
+    # Create column buffers to store movie details, which are built into a DataFrame once all rows are added
+    movie_rows = FrameBuilder(movie_columns)
+
+    # Loop through the movies and get details
+    for movie in results:
+        # Full details of object functions here: https://github.com/leandcesar/themoviedb/blob/7879120fb550f17741d3f8b26add27549e7ed192/themoviedb/schemas/_partial.py#L61
+        movie_rows.append([poster_url(movie.poster_path), # smallest size that fits the poster column, see posters.py
+                           movie.title,
+                           movie.overview, 
+                           movie.popularity,
+                           movie.release_date,
+                           movie.vote_average,
+                           movie.vote_count,
+                           [genre_id_to_name[g] for g in movie.genre_ids if g in genre_id_to_name],
+                           f"https://www.youtube.com/results?search_query={movie.title.replace(' ', '+')} trailer",
+                           [] # filled in below if get_watch_providers is True
+        ])
+
+    # fetches where to watch for the whole page in parallel, filling in each row as its result arrives
+    if get_watch_providers:
+        movie_ids = [movie.id for movie in results]
+        row_for_id = {tmdb_id: row for row, tmdb_id in enumerate(movie_ids)}
+        movie_count=1
+        for tmdb_id, providers in where_to_watch_many(movie_ids, region=watch_region or 'GB'):
+            movie_rows.set(row_for_id[tmdb_id], 'Where to Watch', providers)
+            if progress_bar:
+                progress_bar.progress(movie_count/len(movie_ids), f"Finding where to watch ({movie_count} / {len(movie_ids)}) ...")
+            movie_count+=1
+
+    movie_details_df = movie_rows.to_frame()
+    movie_details_df.attrs["total_pages"] = results.total_pages or 1 # used to know whether there are more pages to load
+    stamp_rows(movie_details_df, results)
+
+    if get_watch_providers==False:
+        movie_details_df = movie_details_df.drop(columns=['Where to Watch']) # drops null where to watch column if parameter is False
+
+    
+    if progress_bar:
+        progress_bar.empty()
+
+    return movie_details_df
+
+@metrics.track_cache("top_tv_shows_by_genre")
+@cache_result(ttl=3600, refresh=True, on_refresh=replace_query_page)  # Cache for 1 hour, refreshing popular results before then
+@metrics.on_miss("top_tv_shows_by_genre")
+@metrics.timed()
+def top_tv_shows_by_genre(genre=['Action', 'Comedy'], 
+                          sort_by="popularity.desc",
+                          primary_release_date__gte="1997-08-15",
+                          primary_release_date__lte="2025-12-31",
+                          keyword=None,
+                          vote_count__gte=10000,
+                          watch_region=None,
+                          watch_providers=None, # e.g. 8 for netflix
+                          page=1):
+    
+    genre_name_to_id = get_genre_map(type="tv")
+    genre_id_to_name = get_genre_map(reverse=True, type="tv")
+    genre_ids = [str(genre_name_to_id[g]) for g in genre if g in genre_name_to_id]
+
+    # Join into a string so that it can be passed to the TMDb API in 'with_genres'
+    # join with '|' for OR and ',' for AND, i.e. whether to include films with one of the genres or exclusively films with ALL genres given
+    genre_string = "|".join(genre_ids)
+        
+
+    # Fetches top tv shows by genre using the TMDb API for given criteria
+    results = discover_page(
+        "tv",
+        page=page,
+        sort_by=sort_by,
+        first_air_date__gte=primary_release_date__gte,
+        first_air_date__lte=primary_release_date__lte,
+        with_keywords=keyword,
+        vote_count__gte=vote_count__gte,
+        with_genres=genre_string,
+        watch_region=watch_region,
+        with_watch_providers=watch_providers
+    )
+
+    # Create column buffers to store tv show details, which are built into a DataFrame once all rows are added
+    tv_rows = FrameBuilder(tv_columns)
+
+    # Loop through the tv shows and get details
+    for show in results:
+        # Full details of object functions here: https://github.com/leandcesar/themoviedb/blob/7879120fb550f17741d3f8b26add27549e7ed192/themoviedb/schemas/_partial.py#L61
+        tv_rows.append([poster_url(show.poster_path), 
+                        show.name,
+                        show.overview, 
+                        show.popularity,
+                        show.first_air_date,
+                        show.vote_average,
+                        show.vote_count,
+                        [genre_id_to_name[g] for g in show.genre_ids if g in genre_id_to_name]
+        ])
+
+    tv_details_df = tv_rows.to_frame()
+    tv_details_df.attrs["total_pages"] = results.total_pages or 1 # used to know whether there are more pages to load
+    stamp_rows(tv_details_df, results)
+
+    return tv_details_df
+
+
+#%% Cast and crew
+
+# Finds people by name (or the start of their name), from the people already seen if any match, otherwise with a
+# person search on TMDb - which adds the people it finds to the index, so the next lookup is instant
+def find_people(name, limit=10):
+    people = get_person_index().search(name, limit)
+    if not people:
+        single_search(name, search_type="person")
+        people = get_person_index().search(name, limit)
+    return people
+
+# Columns and dtypes of the filmography table
+filmography_columns = {'Poster': "str", 'Title': "str", 'Type': "category", 'Role': "str", 'Release Date': "datetime",
+                       'Popularity': "float", 'Vote Average': "float", 'Vote Count': "int", 'Genres': "list"}
+
+# Gets every movie and tv show a person has been in or worked on, from one combined credits call (rather than a
+# details call per title). Cached per person, so looking someone up again doesn't call TMDb.
+@metrics.track_cache("get_filmography")
+@cache_result(ttl=3600) # Cache for 1 hour
+@metrics.on_miss("get_filmography")
+@metrics.timed()
+def get_filmography(person_id):
+    credits = get_tmdb().person(person_id).combined_credits()
+    genre_id_to_name = {**get_genre_map(reverse=True, type="tv"), **get_genre_map(reverse=True)}
+
+    # someone can have more than one credit on a title (e.g. director and writer), which are combined into one row
+    titles = {} # (media type, id) -> (credit, list of roles)
+    for credit in (credits.cast or []) + (credits.crew or []):
+        role = getattr(credit, "character", None) or getattr(credit, "job", None)
+        _, roles = titles.setdefault((credit.media_type, credit.id), (credit, []))
+        if role and role not in roles:
+            roles.append(role)
+
+    filmography_rows = FrameBuilder(filmography_columns)
+    get_title_index().add_results(credit for credit, _ in titles.values())
+    for credit, roles in titles.values():
+        is_movie = credit.media_type == "movie"
+        filmography_rows.append([poster_url(credit.poster_path),
+                                 credit.title if is_movie else credit.name,
+                                 "Movie" if is_movie else "TV",
+                                 ", ".join(roles),
+                                 credit.release_date if is_movie else credit.first_air_date,
+                                 credit.popularity,
+                                 credit.vote_average,
+                                 credit.vote_count,
+                                 [genre_id_to_name[g] for g in credit.genre_ids or [] if g in genre_id_to_name]
+        ])
+    return filmography_rows.to_frame()
+
+# Sorts a filmography by popularity or rating (sort_by is 'popularity.desc' or 'vote_average.desc') - done locally on
+# the cached filmography, so changing the sort order doesn't call TMDb
+def sort_filmography(df, sort_by="popularity.desc"):
+    return (df.sort_values(SORT_COLUMNS.get(sort_by, "Popularity"), ascending=False, na_position="last", kind="stable")
+              .reset_index(drop=True))
+
+
+#%% Search box
+
+# Columns and dtypes of the search suggestions table
+suggestion_columns = {'Poster': "str", 'Name': "str", 'Type': "category", 'Year': "int", 'Popularity': "float"}
+
+# Suggests movies, tv shows and people for the search box - from the title index if it has a good match (in well under
+# 10ms), otherwise from a TMDb multi search, whose results are added to the index so the same search is instant next time
+@metrics.timed()
+def suggest_titles(query, limit=8):
+    index = get_title_index()
+    suggestions = index.search(query, limit)
+    good_match = any(suggestion["score"] >= GOOD_MATCH for suggestion in suggestions)
+    metrics.count("cache_requests", function="title_index", result="hit" if good_match else "miss")
+    if not good_match:
+        multi_search(query)
+        suggestions = index.search(query, limit)
+
+    suggestion_rows = FrameBuilder(suggestion_columns)
+    for suggestion in suggestions:
+        is_person = suggestion["kind"] == "person"
+        suggestion_rows.append([profile_url(suggestion["poster_path"]) if is_person else poster_url(suggestion["poster_path"]),
+                                suggestion["title"],
+                                KINDS[suggestion["kind"]],
+                                suggestion["year"],
+                                suggestion["popularity"]
+        ])
+    return suggestion_rows.to_frame()
+
+
+#%% Delta sync
+
+# Checks TMDb for titles changed since the last check every DELTA_SYNC_MINUTES (30 by default, 0 to turn it off), and
+# updates only those in the shared caches - see sync_changes. The time of the last check is saved to DELTA_SYNC_PATH,
+# so a restarted app carries on from it.
+@st.cache_resource
+def start_delta_sync():
+    feed = ChangeFeed(lambda type, start_date, end_date: get_async_tmdb().changed_ids(type, start_date, end_date),
+                      path=setting("DELTA_SYNC_PATH", ".cache/delta_sync.json"))
+    interval = float(setting("DELTA_SYNC_MINUTES", 30)) * 60
+    if interval > 0:
+        threading.Thread(target=sync_changes_every, args=(feed, interval), daemon=True, name="delta-sync").start()
+    return feed
+
+def sync_changes_every(feed, interval):
+    while True:
+        for type in ("movie", "tv"):
+            try:
+                sync_changes(feed, type)
+            except Exception:
+                metrics.count("delta_sync_errors", type=type) # the watermark stays put, so the next sync covers these changes
+        time.sleep(interval)
+
+# Brings the caches up to date with the titles of one type (movie or tv) changed on TMDb since the last sync, so the
+# cost of keeping them fresh grows with how many titles change rather than how many are cached:
+#   - the changed titles' responses are deleted from the response cache, so they're fetched again when next needed
+#   - changed movies in the availability matrix have their providers fetched again, and the other movies it checked
+#     since the last sync are marked as current, so they aren't fetched again when they'd have expired - up to
+#     DELTA_MAX_AGE_HOURS after they were fetched, as TMDb's changes don't include provider changes
+#   - cached top movies and tv shows tables built or updated since the last sync have their changed rows updated from
+#     the titles' details, and are kept for as long again - also up to DELTA_MAX_AGE_HOURS (24 by default) after they were
+#     built, as titles joining a query's results, or its order changing, are only picked up by running it again
+# Cached data is taken to be current as of when it was added, so the first sync only records the watermark.
+def sync_changes(feed, type):
+    now = time.time()
+    since, changed = feed.changes(type, now)
+    if since is not None:
+        with metrics.span("delta_sync", type=type):
+            metrics.count("delta_sync_changed_titles", amount=len(changed), type=type)
+            get_tmdb_session().cache.delete_paths([f"/{Base.TMDB_VERSION}/{type}/{tmdb_id}" for tmdb_id in changed])
+            if type == "movie":
+                sync_availability(since, now, changed)
+            sync_tables(type, since, now, changed)
+    feed.advance(type, now)
+
+# how long after it was fetched something can still be kept up to date by sync_changes, rather than fetched again in full
+def delta_max_age():
+    return float(setting("DELTA_MAX_AGE_HOURS", 24)) * 3600
+
+def sync_availability(since, now, changed):
+    availability = get_availability()
+    refetch = [tmdb_id for tmdb_id in changed if availability.expires_at(tmdb_id) is not None]
+    for tmdb_id, providers in get_async_tmdb().as_completed(watch_providers_async, refetch, return_exceptions=True):
+        if not isinstance(providers, Exception):
+            availability.add(tmdb_id, providers.results)
+    for tmdb_id in availability.renew(since, now, changed, max_renew_age=delta_max_age()):
+        get_refresher().postpone("where_to_watch", tmdb_id, availability.expires_at(tmdb_id))
+
+def sync_tables(type, since, now, changed):
+    top_function, columns = (top_movies_by_genre, movie_columns) if type == "movie" else (top_tv_shows_by_genre, tv_columns)
+    max_age = delta_max_age()
+    renewable = lambda df: df.attrs.get("synced_at", 0) >= since and now - df.attrs.get("fetched_at", 0) < max_age
+
+    # details of the changed titles in the tables, fetched once each however many tables they're in
+    tables = get_result_cache().values(top_function)
+    ids = {tmdb_id for df in tables if renewable(df) for tmdb_id in changed.intersection(df.index)}
+    details = {tmdb_id: result for tmdb_id, result in get_async_tmdb().details_many(type, ids).items()
+               if not isinstance(result, Exception)}
+
+    # the table with its changed rows updated, or None if any of their details couldn't be fetched
+    def patch(df, filters):
+        updates = {}
+        for row, tmdb_id in enumerate(df.index):
+            if tmdb_id not in changed:
+                continue
+            if tmdb_id not in details:
+                return None
+            title = details[tmdb_id]
+            updates[row] = {"Poster": poster_url(title.poster_path),
+                            "Title": title.title if type == "movie" else title.name,
+                            "Overview": title.overview,
+                            "Popularity": title.popularity,
+                            "Vote Average": title.vote_average,
+                            "Vote Count": title.vote_count}
+            if type == "movie":
+                updates[row]["Trailer"] = f"https://www.youtube.com/results?search_query={title.title.replace(' ', '+')} trailer"
+            if filters.get("get_watch_providers"):
+                updates[row]["Where to Watch"] = get_availability().where_to_watch(tmdb_id, filters.get("watch_region") or 'GB')[:5]
+        return replace_values(df, updates, columns) if updates else df.copy(deep=False)
+
+    def renew(key, df, expires_at):
+        if not renewable(df):
+            return None
+        patched = patch(df, dict(key[2]))
+        if patched is None:
+            return None
+        patched.attrs = {**df.attrs, "synced_at": now}
+        return patched, expires_at + now - df.attrs["synced_at"]
+
+    for key, expires_at in get_result_cache().update(top_function, renew):
+        get_refresher().postpone(f"results:{top_function.__name__}", key, expires_at)
+    # the query store's copies of the same pages get the same rows updated, where they've been fetched
+    get_query_store().update(top_function.__name__, lambda filters, df: patch(df, filters) if changed.intersection(df.index) else None)